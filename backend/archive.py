@@ -0,0 +1,81 @@
+"""
+Streaming ZIP and tar writers. Archives are produced chunk by chunk from async iterators of
+object data, so neither the archive nor any member is held in memory or staged to disk.
+
+Each entry is a tuple (name, size, last_modified, chunks) where chunks is an async iterator of bytes.
+ZIP members are deflated and CRC'd on the storage executor; the generators only pass bytes on.
+"""
+
+from minio_client import run_storage
+import datetime
+import tarfile
+import zipfile
+
+
+class _Sink:
+    """Unseekable file object that collects what zipfile writes until it is drained."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+async def stream_zip(entries, compress=False):
+    sink = _Sink()
+    # On an unseekable output zipfile writes sizes and CRCs in data descriptors after each member
+    archive = zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED)
+    async for name, size, last_modified, chunks in entries:
+        info = zipfile.ZipInfo(name, date_time=zip_timestamp(last_modified))
+        info.compress_type = archive.compression
+        # Lets zipfile decide up front whether the member needs ZIP64 headers
+        info.file_size = size
+        member = archive.open(info, "w")
+        try:
+            async for chunk in chunks:
+                await run_storage(member.write, chunk)
+                if data := sink.drain():
+                    yield data
+        finally:
+            # Flushes the compressor and writes the data descriptor
+            await run_storage(member.close)
+        yield sink.drain()
+    archive.close()
+    yield sink.drain()
+
+
+async def stream_tar(entries):
+    written = 0
+    async for name, size, last_modified, chunks in entries:
+        info = tarfile.TarInfo(name)
+        info.size = size
+        info.mtime = last_modified.timestamp() if last_modified else 0
+        header = info.tobuf(format=tarfile.PAX_FORMAT)
+        yield header
+        written += len(header)
+        async for chunk in chunks:
+            yield chunk
+        padding = -size % tarfile.BLOCKSIZE
+        yield b"\0" * padding
+        written += size + padding
+    # End-of-archive marker, then pad to a full record like tarfile does
+    trailer = 2 * tarfile.BLOCKSIZE
+    trailer += -(written + trailer) % tarfile.RECORDSIZE
+    yield b"\0" * trailer
+
+
+def zip_timestamp(last_modified):
+    # ZIP timestamps cannot represent dates before 1980
+    if last_modified is None or last_modified.year < 1980:
+        return (1980, 1, 1, 0, 0, 0)
+    return last_modified.astimezone(datetime.timezone.utc).timetuple()[:6]
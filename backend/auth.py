@@ -5,4 +5,25 @@ from passlib.context import CryptContext
 SECRET_KEY = os.getenv("SECRET_KEY", "mysecret")
 ALGORITHM = os.getenv("ALGORITHM", "HS256")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/login")
-password_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
\ No newline at end of file
+password_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+# Access tokens stay short-lived; sessions are renewed through /refresh, which checks a signature
+# instead of running bcrypt again.
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 60))
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", 7))
+
+# bcrypt runs on a process pool so hashing never holds the API's GIL. Beyond PASSWORD_QUEUE_LIMIT
+# pending hash / verify calls, signup and login are rejected with 503 instead of queueing.
+PASSWORD_WORKERS = int(os.getenv("PASSWORD_WORKERS", os.cpu_count() or 2))
+PASSWORD_QUEUE_LIMIT = int(os.getenv("PASSWORD_QUEUE_LIMIT", PASSWORD_WORKERS * 4))
+
+# Authenticated-principal cache, see utilities.get_current_user
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", 10000))
+AUTH_CACHE_TTL = int(os.getenv("AUTH_CACHE_TTL", 60))
+
+# Short-lived cache of /download_shared authorization results, invalidated by /share
+PERMISSION_CACHE_SIZE = int(os.getenv("PERMISSION_CACHE_SIZE", 10000))
+PERMISSION_CACHE_TTL = int(os.getenv("PERMISSION_CACHE_TTL", 30))
+
+# Comma-separated usernames allowed on operator endpoints such as /cache_stats; none by default
+ADMIN_USERS = {name.strip() for name in os.getenv("ADMIN_USERS", "").split(",") if name.strip()}
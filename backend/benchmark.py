@@ -0,0 +1,375 @@
+"""
+# benchmark.py
+Self-contained load and benchmark suite for the API. It runs the app from main.py in-process
+against SQLite (or any DATABASE_URL, e.g. a throwaway Postgres) and the in-memory FakeMinio
+(or the local filesystem storage driver with --storage local), and drives it through httpx's
+ASGI transport, so no docker-compose stack is needed.
+
+For each scenario it reports p50/p95/p99 latency, requests/s, MB/s and peak RSS, writes the
+results as JSON, and can compare them with an earlier run to catch regressions.
+
+Requires the packages in requirements-dev.txt (aiosqlite on top of requirements.txt).
+
+Usage:
+    python benchmark.py --output results.json
+    python benchmark.py --scale 0.2 --scenarios small_upload,list_large_bucket
+    python benchmark.py --compare results.json --threshold 0.15
+"""
+
+import argparse
+import asyncio
+import datetime
+import importlib
+import json
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import time
+
+SCENARIOS = ("auth", "small_upload", "large_upload", "list_large_bucket", "shared_download", "bulk_delete")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the cloud bucket service in-process.")
+    parser.add_argument("--database-url", help="SQLAlchemy async URL; defaults to a temporary SQLite file")
+    parser.add_argument("--storage", choices=("fake", "local"), default="fake",
+                        help="In-memory FakeMinio or the local filesystem driver in a temporary directory")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Comma-separated scenarios to run")
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiplier for request and object counts")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent requests per scenario")
+    parser.add_argument("--large-size-mb", type=int, default=32, help="Object size for large uploads")
+    parser.add_argument("--output", default="benchmark_results.json", help="Where to write JSON results")
+    parser.add_argument("--compare", help="Earlier results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="Relative p95 / throughput change that counts as a regression")
+    parser.add_argument("--seed", type=int, default=1)
+    return parser.parse_args()
+
+
+def current_rss():
+    """Resident set size in bytes, from /proc when available."""
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class Bench:
+    def __init__(self, http, concurrency):
+        self.http = http
+        self.concurrency = concurrency
+        self.results = {}
+
+    async def run(self, name, operations, concurrency=None):
+        """
+        Run operations (async callables returning (ok, bytes_moved)) with bounded concurrency
+        and record latency, throughput and peak RSS under the scenario name.
+        """
+        queue = asyncio.Queue()
+        for operation in operations:
+            queue.put_nowait(operation)
+        latencies, errors, moved = [], 0, 0
+        peak_rss = current_rss()
+        done = asyncio.Event()
+
+        async def sample_rss():
+            nonlocal peak_rss
+            while not done.is_set():
+                peak_rss = max(peak_rss, current_rss())
+                await asyncio.sleep(0.05)
+
+        async def worker():
+            nonlocal errors, moved
+            while not queue.empty():
+                operation = queue.get_nowait()
+                start = time.perf_counter()
+                try:
+                    ok, transferred = await operation()
+                except Exception as e:
+                    print(f"  {name}: {e!r}")
+                    ok, transferred = False, 0
+                latencies.append(time.perf_counter() - start)
+                moved += transferred
+                errors += 0 if ok else 1
+
+        sampler = asyncio.create_task(sample_rss())
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency or self.concurrency)))
+        elapsed = time.perf_counter() - start
+        done.set()
+        await sampler
+
+        latencies.sort()
+        self.results[name] = {
+            "requests": len(latencies),
+            "errors": errors,
+            "duration_s": round(elapsed, 4),
+            "requests_per_s": round(len(latencies) / elapsed, 2) if elapsed else None,
+            "mb_per_s": round(moved / elapsed / 1e6, 2) if elapsed else None,
+            "latency_ms": {
+                key: round(value * 1000, 3) if value is not None else None
+                for key, value in (
+                    ("p50", percentile(latencies, 0.50)),
+                    ("p95", percentile(latencies, 0.95)),
+                    ("p99", percentile(latencies, 0.99)),
+                    ("mean", sum(latencies) / len(latencies) if latencies else None),
+                )
+            },
+            "peak_rss_mb": round(peak_rss / 1e6, 1),
+        }
+        result = self.results[name]
+        print(f"{name:>20}: {result['requests']} req, {result['errors']} errors, "
+              f"{result['requests_per_s']} req/s, {result['mb_per_s']} MB/s, "
+              f"p50 {result['latency_ms']['p50']} ms, p95 {result['latency_ms']['p95']} ms, "
+              f"p99 {result['latency_ms']['p99']} ms, peak RSS {result['peak_rss_mb']} MB")
+
+    # Helpers used by scenarios for setup
+
+    async def user(self, username, password="benchmark"):
+        await self.http.post("/signup", json={"username": username, "password": password})
+        response = await self.http.post("/login", data={"username": username, "password": password})
+        response.raise_for_status()
+        return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    async def bucket(self, headers, bucket):
+        response = await self.http.post("/buckets", json={"bucket": bucket}, headers=headers)
+        response.raise_for_status()
+
+    def upload(self, headers, bucket, filename, payload):
+        async def operation():
+            response = await self.http.post(
+                "/upload", params={"bucket": bucket}, files={"file": (filename, payload)}, headers=headers
+            )
+            return response.status_code == 200, len(payload)
+        return operation
+
+
+async def populate(app_module, storage, bucket_name, count, payload=b"x"):
+    """Insert objects straight into the storage driver and their Files rows in bulk, bypassing the API."""
+    from sqlalchemy import select, insert
+    from models import Bucket, Files
+
+    names = [f"obj/{i:08d}" for i in range(count)]
+    for name in names:
+        storage.put_object(bucket_name, name, _Reader(payload), len(payload))
+    async with app_module.SessionLocal() as db:
+        bucket_id = (await db.execute(select(Bucket.id).where(Bucket.name == bucket_name))).scalar()
+        for start in range(0, count, 5000):
+            await db.execute(insert(Files), [
+                {"name": name, "bucket_id": bucket_id, "size": len(payload)} for name in names[start:start + 5000]
+            ])
+        await db.commit()
+    return names
+
+
+class _Reader:
+    def __init__(self, data):
+        self.data = data
+
+    def read(self, size=-1):
+        data, self.data = (self.data, b"") if size < 0 else (self.data[:size], self.data[size:])
+        return data
+
+
+async def scenario_auth(bench, args, app_module, storage):
+    count = max(1, int(20 * args.scale))
+    usernames = [f"auth-user-{i}" for i in range(count)]
+
+    def signup(username):
+        async def operation():
+            response = await bench.http.post("/signup", json={"username": username, "password": "benchmark"})
+            return response.status_code == 200, 0
+        return operation
+
+    def login(username):
+        async def operation():
+            response = await bench.http.post("/login", data={"username": username, "password": "benchmark"})
+            return response.status_code == 200, 0
+        return operation
+
+    await bench.run("signup", [signup(username) for username in usernames])
+    await bench.run("login", [login(username) for username in usernames])
+
+
+async def scenario_small_upload(bench, args, app_module, storage):
+    headers = await bench.user("small-uploader")
+    await bench.bucket(headers, "small")
+    payload = os.urandom(4096)
+    count = max(1, int(500 * args.scale))
+    await bench.run("small_upload", [bench.upload(headers, "small", f"file-{i}", payload) for i in range(count)])
+
+
+async def scenario_large_upload(bench, args, app_module, storage):
+    headers = await bench.user("large-uploader")
+    await bench.bucket(headers, "large")
+    payload = os.urandom(args.large_size_mb * 1024 * 1024)
+    count = max(1, int(8 * args.scale))
+    await bench.run(
+        "large_upload",
+        [bench.upload(headers, "large", f"file-{i}", payload) for i in range(count)],
+        concurrency=min(bench.concurrency, 4)
+    )
+
+
+async def scenario_list_large_bucket(bench, args, app_module, storage):
+    from utilities import encode_continuation_token
+
+    headers = await bench.user("lister")
+    await bench.bucket(headers, "listing")
+    count = max(1000, int(20000 * args.scale))
+    names = await populate(app_module, storage, "lister-listing", count)
+    # Every page can be requested independently by handing out its continuation token
+    tokens = [None] + [encode_continuation_token(names[i - 1]) for i in range(1000, count, 1000)]
+
+    def page(token):
+        async def operation():
+            params = {"bucket": "listing", "limit": 1000}
+            if token:
+                params["continuation_token"] = token
+            response = await bench.http.get("/files", params=params, headers=headers)
+            return response.status_code == 200, len(response.content)
+        return operation
+
+    await bench.run("list_large_bucket", [page(token) for token in tokens * 3])
+
+
+async def scenario_shared_download(bench, args, app_module, storage):
+    owner = await bench.user("sharer")
+    reader = await bench.user("reader")
+    await bench.bucket(owner, "shared")
+    payload = os.urandom(256 * 1024)
+    filenames = [f"asset-{i}" for i in range(20)]
+    for filename in filenames:
+        await bench.upload(owner, "shared", filename, payload)()
+        await bench.http.post("/share", json={
+            "bucket": "shared", "filename": filename, "shared_with_username": "reader"
+        }, headers=owner)
+
+    def download(filename):
+        async def operation():
+            response = await bench.http.get(
+                "/download_shared", params={"bucket": "sharer-shared", "filename": filename}, headers=reader
+            )
+            return response.status_code == 200, len(response.content)
+        return operation
+
+    count = max(1, int(500 * args.scale))
+    await bench.run("shared_download", [download(random.choice(filenames)) for _ in range(count)])
+
+
+async def scenario_bulk_delete(bench, args, app_module, storage):
+    headers = await bench.user("deleter")
+    await bench.bucket(headers, "deletes")
+    count = max(1000, int(10000 * args.scale))
+    names = await populate(app_module, storage, "deleter-deletes", count)
+
+    def delete_batch(batch):
+        async def operation():
+            response = await bench.http.request(
+                "DELETE", "/delete_files", json={"bucket": "deletes", "filename": json.dumps(batch)}, headers=headers
+            )
+            return response.status_code == 200, 0
+        return operation
+
+    batches = [names[i:i + 1000] for i in range(0, count, 1000)]
+    await bench.run("bulk_delete", [delete_batch(batch) for batch in batches], concurrency=min(bench.concurrency, 4))
+
+
+def compare(results, previous_path, threshold):
+    """Print the change against an earlier run. Returns True if any scenario regressed."""
+    with open(previous_path) as previous_file:
+        previous = json.load(previous_file)["scenarios"]
+    regressed = False
+    print(f"\nComparison with {previous_path} (threshold {threshold:.0%}):")
+    for name, result in results.items():
+        before = previous.get(name)
+        if not before:
+            print(f"{name:>20}: no baseline")
+            continue
+        p95_before, p95_after = before["latency_ms"]["p95"], result["latency_ms"]["p95"]
+        rps_before, rps_after = before["requests_per_s"], result["requests_per_s"]
+        p95_change = (p95_after - p95_before) / p95_before if p95_before else 0.0
+        rps_change = (rps_after - rps_before) / rps_before if rps_before else 0.0
+        flag = p95_change > threshold or rps_change < -threshold
+        regressed = regressed or flag
+        print(f"{name:>20}: p95 {p95_before} -> {p95_after} ms ({p95_change:+.1%}), "
+              f"req/s {rps_before} -> {rps_after} ({rps_change:+.1%}){'  REGRESSION' if flag else ''}")
+    return regressed
+
+
+async def run(args, app_module, storage):
+    import httpx
+
+    random.seed(args.seed)
+    transport = httpx.ASGITransport(app=app_module.app)
+    async with app_module.app.router.lifespan_context(app_module.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as http:
+            bench = Bench(http, args.concurrency)
+            for name in args.scenarios.split(","):
+                await globals()[f"scenario_{name.strip()}"](bench, args, app_module, storage)
+            return bench.results
+
+
+def main():
+    args = parse_args()
+    unknown = set(args.scenarios.split(",")) - set(SCENARIOS)
+    if unknown:
+        sys.exit(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+    workdir = tempfile.mkdtemp(prefix="cbs-bench-")
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite+aiosqlite:///{workdir}/benchmark.db"
+
+    if args.storage == "local":
+        os.environ["STORAGE_BACKEND"] = "local"
+        os.environ["LOCAL_STORAGE_ROOT"] = os.path.join(workdir, "storage")
+    import minio_client
+    if args.storage == "fake":
+        # The fake has to be in place before the app modules import the client
+        from fake_minio import FakeMinio
+        minio_client.client = FakeMinio()
+    storage = minio_client.client
+    # Create the schema the same way deployments do
+    from alembic import command
+    from alembic.config import Config
+    command.upgrade(Config(os.path.join(os.path.dirname(os.path.abspath(__file__)), "alembic.ini")), "head")
+    app_module = importlib.import_module("main")
+
+    results = asyncio.run(run(args, app_module, storage))
+    report = {
+        "meta": {
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "database": os.environ["DATABASE_URL"].split(":", 1)[0],
+            "storage": args.storage,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "scale": args.scale,
+            "concurrency": args.concurrency,
+            "large_size_mb": args.large_size_mb,
+        },
+        "scenarios": results,
+    }
+    with open(args.output, "w") as output:
+        json.dump(report, output, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.compare and compare(results, args.compare, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+In-process registry of bucket metadata. Each entry holds the Bucket row id and whether the
+bucket exists in MinIO, keyed by (owner_id, bucket_name), so hot endpoints can skip both the
+bucket_exists round trip and the buckets lookup. create_bucket / delete_bucket invalidate entries.
+
+The backend is pluggable through BUCKET_REGISTRY_BACKEND: "local" (default) keeps entries per
+process, "redis" shares them between uvicorn workers (requires the optional redis package).
+"""
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from minio_client import client, run_storage
+from models import Bucket
+from cache import TTLCache
+import json
+import os
+
+BUCKET_REGISTRY_BACKEND = os.getenv("BUCKET_REGISTRY_BACKEND", "local")
+BUCKET_REGISTRY_SIZE = int(os.getenv("BUCKET_REGISTRY_SIZE", 10000))
+BUCKET_REGISTRY_TTL = int(os.getenv("BUCKET_REGISTRY_TTL", 300))
+REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
+
+
+class LocalRegistryBackend:
+    def __init__(self, maxsize, ttl):
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    async def get(self, key):
+        return self.cache.get(key)
+
+    async def set(self, key, value):
+        self.cache.set(key, value)
+
+    async def delete(self, key):
+        self.cache.pop(key)
+
+    def stats(self):
+        return self.cache.stats()
+
+
+class RedisRegistryBackend:
+    def __init__(self, url, ttl):
+        import redis.asyncio as redis
+        self.redis = redis.from_url(url)
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key):
+        value = await self.redis.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(value)
+
+    async def set(self, key, value):
+        await self.redis.set(key, json.dumps(value), ex=self.ttl)
+
+    async def delete(self, key):
+        await self.redis.delete(key)
+
+    def stats(self):
+        return {"backend": "redis", "hits": self.hits, "misses": self.misses}
+
+
+if BUCKET_REGISTRY_BACKEND == "redis":
+    registry = RedisRegistryBackend(REDIS_URL, BUCKET_REGISTRY_TTL)
+else:
+    registry = LocalRegistryBackend(BUCKET_REGISTRY_SIZE, BUCKET_REGISTRY_TTL)
+
+
+def registry_key(owner_id, bucket_name):
+    return f"bucket:{owner_id}:{bucket_name}"
+
+
+async def get_bucket(db: AsyncSession, owner_id, bucket_name):
+    """
+    Return {"id": <Bucket.id or None>, "exists": <exists in MinIO>, "compression": <codec or None>}
+    for a bucket owned by owner_id. Only buckets that have a database row are cached.
+    """
+    key = registry_key(owner_id, bucket_name)
+    entry = await registry.get(key)
+    if entry is not None:
+        return entry
+    row = (await db.execute(
+        select(Bucket.id, Bucket.compression).where(Bucket.name == bucket_name, Bucket.owner_id == owner_id)
+    )).first()
+    bucket_id, compression = row if row else (None, None)
+    entry = {"id": bucket_id, "exists": await run_storage(client.bucket_exists, bucket_name), "compression": compression}
+    if bucket_id is not None:
+        await registry.set(key, entry)
+    return entry
+
+
+async def invalidate_bucket(owner_id, bucket_name):
+    await registry.delete(registry_key(owner_id, bucket_name))
@@ -0,0 +1,291 @@
+import hashlib
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Thread-safe, size-bounded LRU cache whose entries expire after a TTL (in seconds)."""
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[1] <= time.monotonic():
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0 or self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            return entry[0] if entry else None
+
+    def discard_where(self, predicate):
+        """Remove every entry whose key satisfies predicate. Returns how many were removed."""
+        with self._lock:
+            keys = [key for key in self._data if predicate(key)]
+            for key in keys:
+                del self._data[key]
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+class FrequencySketch:
+    """Count-min sketch of recent access frequencies (4-bit style counters, halved periodically so old popularity fades)."""
+
+    def __init__(self, width):
+        self.width = 1 << max(width - 1, 1).bit_length()
+        self.rows = [[0] * self.width for _ in range(4)]
+        self.additions = 0
+        self.sample_size = 10 * self.width
+
+    def _indexes(self, key):
+        mask = self.width - 1
+        return [hash((seed, key)) & mask for seed in range(4)]
+
+    def increment(self, key):
+        for row, index in zip(self.rows, self._indexes(key)):
+            if row[index] < 15:
+                row[index] += 1
+        self.additions += 1
+        if self.additions >= self.sample_size:
+            self.additions //= 2
+            for row in self.rows:
+                row[:] = [count >> 1 for count in row]
+
+    def estimate(self, key):
+        return min(row[index] for row, index in zip(self.rows, self._indexes(key)))
+
+
+class ObjectCache:
+    """
+    Thread-safe cache of small object bodies, bounded in bytes. Eviction is LRU; admission is
+    TinyLFU, so when the cache is full a new object only displaces the LRU entries if it has been
+    requested more often than they have. Entries evicted from memory spill to an optional disk
+    tier with its own LRU byte budget.
+
+    Keys are (bucket, object name, etag) tuples. get() only touches memory; read_disk() and put()
+    may do file I/O and belong on an executor.
+    """
+
+    def __init__(self, max_bytes, max_object_size, disk_dir=None, disk_bytes=0):
+        self.max_bytes = max_bytes
+        self.max_object_size = max_object_size
+        self.disk_bytes = disk_bytes if disk_dir else 0
+        self.disk_dir = None
+        if self.disk_bytes > 0:
+            # Per process, since the index lives in memory; leftovers of a previous run are dropped
+            self.disk_dir = os.path.join(disk_dir, str(os.getpid()))
+            shutil.rmtree(self.disk_dir, ignore_errors=True)
+            os.makedirs(self.disk_dir)
+        self.sketch = FrequencySketch(max(max_bytes // max(max_object_size // 8, 1), 1024))
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        self._disk = OrderedDict()
+        self._disk_size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.bytes_served = 0
+        self.evictions = 0
+        self.disk_evictions = 0
+        self.rejections = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0 and self.max_object_size > 0
+
+    def cacheable(self, size):
+        return self.enabled and size is not None and size <= self.max_object_size
+
+    def get(self, key):
+        """Body from the memory tier, or None. Also counts the access for admission."""
+        with self._lock:
+            self.sketch.increment(key)
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+            elif key not in self._disk:
+                self.misses += 1
+            return data
+
+    def on_disk(self, key):
+        with self._lock:
+            return key in self._disk
+
+    def read_disk(self, key):
+        """Body from the disk tier, or None; promoted to memory if admission allows. Blocking."""
+        try:
+            with open(self._disk_path(key), "rb") as f:
+                data = f.read()
+        except OSError:
+            data = None
+        with self._lock:
+            if data is None or key not in self._disk:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._disk.move_to_end(key)
+        self.put(key, data)
+        return data
+
+    def put(self, key, data):
+        """Offer a body to the cache. Blocking when the disk tier is on."""
+        if not self.cacheable(len(data)):
+            return
+        promoted = False
+        with self._lock:
+            if key in self._memory:
+                return
+            spilled = self._admit(key, data)
+            if spilled is None:
+                self.rejections += 1
+                spilled = [(key, data)]
+            elif key in self._disk:
+                # The tiers are exclusive; a promoted entry leaves the disk
+                self._disk_size -= self._disk.pop(key)
+                promoted = True
+        if promoted:
+            self._remove_file(key)
+        for spilled_key, spilled_data in spilled:
+            self._spill(spilled_key, spilled_data)
+
+    def _admit(self, key, data):
+        """Insert into memory, evicting colder LRU entries. Returns the evicted entries, or None if rejected."""
+        needed = self._memory_size + len(data) - self.max_bytes
+        victims = []
+        if needed > 0:
+            frequency = self.sketch.estimate(key)
+            for victim_key, victim_data in self._memory.items():
+                if self.sketch.estimate(victim_key) >= frequency:
+                    return None
+                victims.append(victim_key)
+                needed -= len(victim_data)
+                if needed <= 0:
+                    break
+        evicted = [(victim_key, self._memory.pop(victim_key)) for victim_key in victims]
+        for _, victim_data in evicted:
+            self._memory_size -= len(victim_data)
+        self.evictions += len(evicted)
+        self._memory[key] = data
+        self._memory_size += len(data)
+        return evicted
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir or "", hashlib.sha256(repr(key).encode()).hexdigest())
+
+    def _spill(self, key, data):
+        if not self.disk_dir or len(data) > self.disk_bytes:
+            return
+        with self._lock:
+            if key in self._disk:
+                return
+        path = self._disk_path(key)
+        try:
+            with open(path + ".tmp", "wb") as f:
+                f.write(data)
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            print("Object cache write error:", e)
+            return
+        removed = []
+        with self._lock:
+            self._disk[key] = len(data)
+            self._disk_size += len(data)
+            while self._disk_size > self.disk_bytes:
+                old_key, old_size = self._disk.popitem(last=False)
+                self._disk_size -= old_size
+                self.disk_evictions += 1
+                removed.append(old_key)
+        for old_key in removed:
+            self._remove_file(old_key)
+
+    def _remove_file(self, key):
+        try:
+            os.remove(self._disk_path(key))
+        except OSError:
+            pass
+
+    def count_served(self, nbytes):
+        with self._lock:
+            self.bytes_served += nbytes
+
+    def invalidate(self, bucket, name=None):
+        """Drop every version of bucket/name, or everything in bucket when name is None."""
+        def matches(key):
+            return key[0] == bucket and (name is None or key[1] == name)
+
+        with self._lock:
+            memory_keys = [key for key in self._memory if matches(key)]
+            disk_keys = [key for key in self._disk if matches(key)]
+            for key in memory_keys:
+                self._memory_size -= len(self._memory.pop(key))
+            for key in disk_keys:
+                self._disk_size -= self._disk.pop(key)
+            self.invalidations += len(memory_keys) + len(disk_keys)
+        for key in disk_keys:
+            self._remove_file(key)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self._memory),
+                "bytes": self._memory_size,
+                "max_bytes": self.max_bytes,
+                "max_object_size": self.max_object_size,
+                "disk_entries": len(self._disk),
+                "disk_bytes": self._disk_size,
+                "max_disk_bytes": self.disk_bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_ratio": round((self.hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+                "bytes_served": self.bytes_served,
+                "evictions": self.evictions,
+                "disk_evictions": self.disk_evictions,
+                "rejections": self.rejections,
+                "invalidations": self.invalidations,
+            }
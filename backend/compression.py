@@ -0,0 +1,154 @@
+"""
+Transparent per-object compression. Buckets opt in with a codec ("gzip", or "zstd" with the
+optional zstandard package). Uploads of compressible content types are compressed while they are
+streamed to storage, and the codec and original size are kept as object metadata. Downloads pass
+the stored bytes through with Content-Encoding when the client accepts the codec, and otherwise
+decompress on the fly.
+"""
+
+from minio_client import run_storage
+import mimetypes
+import os
+import zlib
+
+CODEC_META_KEY = "codec"
+ORIGINAL_SIZE_META_KEY = "original-size"
+COMPRESSION_LEVEL = int(os.getenv("COMPRESSION_LEVEL", 3))
+# Objects smaller than this are stored as-is; the header overhead outweighs the saving
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", 1024))
+
+COMPRESSIBLE_TYPES = {
+    "application/json", "application/x-ndjson", "application/xml", "application/javascript",
+    "application/x-yaml", "application/yaml", "application/csv", "application/sql", "image/svg+xml",
+}
+# Used when the client sends no useful content type and mimetypes does not know the extension
+COMPRESSIBLE_EXTENSIONS = {".log", ".jsonl", ".ndjson", ".yaml", ".yml", ".md", ".tsv", ".toml", ".ini"}
+
+
+def zstd_module():
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    return zstandard
+
+
+def available_codecs():
+    return ("gzip", "zstd") if zstd_module() else ("gzip",)
+
+
+def is_compressible(content_type, filename):
+    if not content_type or content_type == "application/octet-stream":
+        if os.path.splitext(filename)[1].lower() in COMPRESSIBLE_EXTENSIONS:
+            return True
+        content_type = mimetypes.guess_type(filename)[0] or ""
+    content_type = content_type.split(";")[0].strip().lower()
+    return content_type.startswith("text/") or content_type in COMPRESSIBLE_TYPES \
+        or content_type.endswith("+json") or content_type.endswith("+xml")
+
+
+def compression_metadata(codec, original_size):
+    return {CODEC_META_KEY: codec, ORIGINAL_SIZE_META_KEY: str(original_size)}
+
+
+def stored_codec(stat):
+    """(codec, original size) of a compressed object, or (None, None)."""
+    metadata = stat.metadata or {}
+    codec = metadata.get(f"x-amz-meta-{CODEC_META_KEY}")
+    if not codec:
+        return None, None
+    return codec, int(metadata.get(f"x-amz-meta-{ORIGINAL_SIZE_META_KEY}", 0))
+
+
+def object_size(stat):
+    """Size of an object's content as clients see it, i.e. before compression."""
+    codec, original_size = stored_codec(stat)
+    return original_size if codec else stat.size
+
+
+def compressor(codec):
+    if codec == "zstd":
+        return zstd_module().ZstdCompressor(level=COMPRESSION_LEVEL).compressobj()
+    # wbits=31 writes a gzip container, which is what Content-Encoding: gzip means
+    return zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, 31)
+
+
+def decompressor(codec):
+    if codec == "zstd":
+        return zstd_module().ZstdDecompressor().decompressobj()
+    return zlib.decompressobj(31)
+
+
+def decompress_bytes(data, codec):
+    decoder = decompressor(codec)
+    return decoder.decompress(data) + decoder.flush()
+
+
+class CompressingReader:
+    """File-like wrapper whose read() returns the compressed stream of the wrapped file."""
+
+    def __init__(self, fileobj, codec, chunk_size=1024 * 1024):
+        self.fileobj = fileobj
+        self.compressor = compressor(codec)
+        self.chunk_size = chunk_size
+        self.buffer = b""
+        self.finished = False
+
+    def read(self, size=-1):
+        while not self.finished and (size < 0 or len(self.buffer) < size):
+            chunk = self.fileobj.read(self.chunk_size)
+            if chunk:
+                self.buffer += self.compressor.compress(chunk)
+            else:
+                self.buffer += self.compressor.flush()
+                self.finished = True
+        if size < 0:
+            data, self.buffer = self.buffer, b""
+        else:
+            data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+
+def accepts_encoding(header, codec):
+    """True if an Accept-Encoding header lists codec (q=0 refuses it). A bare "*" does not count."""
+    if not header:
+        return False
+    for item in header.split(","):
+        token, _, params = item.strip().partition(";")
+        if token.strip().lower() != codec:
+            continue
+        q = params.strip()
+        if q.startswith("q="):
+            try:
+                return float(q[2:]) > 0
+            except ValueError:
+                return False
+        return True
+    return False
+
+
+async def decompress_stream(chunks, codec, start=0, length=None):
+    """
+    Decompress an async iterator of compressed chunks, yielding only the decoded bytes in
+    [start, start + length). Each chunk is decompressed on the storage executor.
+    """
+    decoder = decompressor(codec)
+    position = 0
+    end = None if length is None else start + length
+
+    def window(data):
+        nonlocal position
+        piece = data[max(start - position, 0):len(data) if end is None else max(end - position, 0)]
+        position += len(data)
+        return piece
+
+    try:
+        async for chunk in chunks:
+            if piece := window(await run_storage(decoder.decompress, chunk)):
+                yield piece
+            if end is not None and position >= end:
+                return
+        if piece := window(decoder.flush()):
+            yield piece
+    finally:
+        await chunks.aclose()
@@ -0,0 +1,113 @@
+"""
+Content-addressed storage for uploads. When DEDUP_ENABLED is set, each distinct blob is stored once
+in DEDUP_BUCKET under its sha256, and the user's bucket only holds an empty pointer object whose
+metadata names the blob. Blob rows carry a reference count of the Files rows pointing at them.
+"""
+
+from sqlalchemy import select, update, delete, func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from minio_client import client, run_storage, remove_objects, DELETE_BATCH_SIZE
+from compression import CompressingReader, compression_metadata
+from models import Blob, Files
+import hashlib
+import io
+import os
+
+DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "false").lower() in ("1", "true", "yes")
+# User buckets are always named "<username>-<bucket>", so a name without a hyphen cannot collide
+DEDUP_BUCKET = os.getenv("DEDUP_BUCKET", "blobs")
+POINTER_META_KEY = "blob"
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def hash_file(fileobj):
+    """Hash a local (spooled) file and rewind it. Returns (size, sha256 hexdigest)."""
+    digest = hashlib.sha256()
+    size = 0
+    while chunk := fileobj.read(HASH_CHUNK_SIZE):
+        size += len(chunk)
+        digest.update(chunk)
+    fileobj.seek(0)
+    return size, digest.hexdigest()
+
+
+def pointer_target(stat):
+    """Blob hash referenced by a pointer object, or None for a regular object."""
+    return (stat.metadata or {}).get(f"x-amz-meta-{POINTER_META_KEY}")
+
+
+async def put_pointer(bucket_name, object_name, content_hash, content_type):
+    await run_storage(
+        client.put_object, bucket_name, object_name, io.BytesIO(b""), 0,
+        content_type=content_type, metadata={POINTER_META_KEY: content_hash}
+    )
+
+
+async def acquire_blob(db: AsyncSession, content_hash):
+    """Take a reference on an existing blob. Returns False if the blob is not stored yet."""
+    result = await db.execute(
+        update(Blob).where(Blob.hash == content_hash).values(refcount=Blob.refcount + 1)
+    )
+    return result.rowcount == 1
+
+
+async def store_blob(db: AsyncSession, content_hash, size, fileobj, part_size, codec=None):
+    """
+    Take a reference on content_hash, uploading fileobj only if no other file holds that blob.
+    A new blob is stored compressed with codec, if given; the hash and size stay those of the
+    original bytes, and a blob keeps the form it was first stored in. Returns True if the data
+    transfer was skipped.
+    """
+    while True:
+        if await acquire_blob(db, content_hash):
+            return True
+        try:
+            async with db.begin_nested():
+                db.add(Blob(hash=content_hash, size=size, refcount=1))
+        except IntegrityError:
+            # Another upload inserted the same blob concurrently; take a reference on theirs
+            continue
+        data, length, metadata = fileobj, size, None
+        if codec:
+            data, length, metadata = CompressingReader(fileobj, codec), -1, compression_metadata(codec, size)
+        await run_storage(
+            client.put_object, DEDUP_BUCKET, content_hash, data, length, part_size=part_size, metadata=metadata
+        )
+        return False
+
+
+async def release_blobs(db: AsyncSession, *criteria):
+    """Drop the blob references held by the Files rows matching criteria (before they are deleted)."""
+    rows = (await db.execute(
+        select(Files.blob_hash, func.count()).where(*criteria, Files.blob_hash.isnot(None)).group_by(Files.blob_hash)
+    )).all()
+    for content_hash, count in rows:
+        await db.execute(
+            update(Blob).where(Blob.hash == content_hash).values(refcount=Blob.refcount - count)
+        )
+
+
+async def collect_garbage(db: AsyncSession):
+    """
+    Remove unreferenced blobs. Rows are locked while their objects are deleted, so a concurrent
+    upload of the same content waits and then stores the blob again instead of losing it.
+    """
+    try:
+        while True:
+            hashes = (await db.execute(
+                select(Blob.hash).where(Blob.refcount <= 0).limit(DELETE_BATCH_SIZE).with_for_update(skip_locked=True)
+            )).scalars().all()
+            if not hashes:
+                await db.rollback()
+                return
+            failed = set(await run_storage(remove_objects, DEDUP_BUCKET, hashes))
+            await db.execute(delete(Blob).where(Blob.hash.in_([h for h in hashes if h not in failed])))
+            await db.commit()
+            if failed:
+                print("Blob garbage collection error:", sorted(failed))
+                return
+    except Exception as e:
+        # Unreferenced blobs are picked up again by the next collection
+        print("Blob garbage collection error:", e)
+        await db.rollback()
@@ -0,0 +1,254 @@
+"""
+File lifecycle events delivered to user-registered webhooks.
+
+emit_event writes one outbox row per matching webhook into the caller's session, so the event
+is committed (or rolled back) together with the change it describes. A background dispatcher
+leases due rows in batches, POSTs them with bounded concurrency and retries failures with
+exponential backoff. Delivery is at-least-once; receivers can de-duplicate on X-Webhook-Delivery.
+
+Webhook URLs must resolve to public addresses, so users cannot point the server at its own network
+(loopback, private, link-local). The check runs at registration and again before every delivery,
+which then connects to the address that was checked, so a DNS answer that changes in between
+cannot redirect it. Hosts in WEBHOOK_ALLOWED_HOSTS skip the check.
+"""
+
+from sqlalchemy import select, update, delete, event, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from database import SessionLocal
+from models import Webhook, EventOutbox
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit
+import asyncio
+import hashlib
+import hmac
+import ipaddress
+import json
+import os
+import socket
+import random
+import time
+
+EVENT_TYPES = ("file.uploaded", "file.deleted", "file.shared", "bucket.deleted")
+
+WEBHOOK_BATCH_SIZE = int(os.getenv("WEBHOOK_BATCH_SIZE", 100))
+WEBHOOK_CONCURRENCY = int(os.getenv("WEBHOOK_CONCURRENCY", 16))
+WEBHOOK_TIMEOUT = float(os.getenv("WEBHOOK_TIMEOUT", 10))
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", 8))
+WEBHOOK_BACKOFF_BASE = float(os.getenv("WEBHOOK_BACKOFF_BASE", 2))
+WEBHOOK_BACKOFF_MAX = float(os.getenv("WEBHOOK_BACKOFF_MAX", 3600))
+WEBHOOK_POLL_INTERVAL = float(os.getenv("WEBHOOK_POLL_INTERVAL", 5))
+# Delivered and dead rows are pruned after this many seconds
+WEBHOOK_RETENTION = int(os.getenv("WEBHOOK_RETENTION", 7 * 24 * 3600))
+# Rows being delivered are leased for this long, so another worker's dispatcher skips them
+WEBHOOK_LEASE = WEBHOOK_TIMEOUT * 3
+# Comma-separated hostnames that may resolve to internal addresses, e.g. an in-cluster receiver
+WEBHOOK_ALLOWED_HOSTS = {host.strip().lower() for host in os.getenv("WEBHOOK_ALLOWED_HOSTS", "").split(",") if host.strip()}
+
+# Set after a commit that emitted events, so this worker's dispatcher runs without waiting for the poll
+wakeup = asyncio.Event()
+
+
+@event.listens_for(Session, "after_commit")
+def wake_dispatcher(session):
+    if session.info.pop("events_emitted", False):
+        wakeup.set()
+
+
+@event.listens_for(Session, "after_rollback")
+def discard_wakeup(session):
+    session.info.pop("events_emitted", None)
+
+
+def subscribes(webhook_events, event_type):
+    return not webhook_events or event_type in webhook_events.split(",")
+
+
+async def emit_event(db: AsyncSession, user_id, event_type, payloads):
+    """
+    Queue event_type for every webhook of user_id that subscribes to it, one delivery per payload.
+    Nothing is committed here; the caller's commit publishes the events.
+    """
+    hooks = (await db.execute(
+        select(Webhook.id, Webhook.events).where(Webhook.user_id == user_id, Webhook.active.is_(True))
+    )).all()
+    hooks = [hook_id for hook_id, events in hooks if subscribes(events, event_type)]
+    if not hooks:
+        return
+    now = datetime.utcnow()
+    db.add_all(
+        EventOutbox(
+            webhook_id=hook_id, event_type=event_type, next_attempt_at=now, created_at=now,
+            payload=json.dumps({"type": event_type, "created_at": now.isoformat() + "Z", "data": payload}),
+        )
+        for payload in payloads for hook_id in hooks
+    )
+    db.info["events_emitted"] = True
+
+
+class UnsafeWebhookURL(ValueError):
+    pass
+
+
+def public_address(address):
+    ip = ipaddress.ip_address(address.split("%")[0])
+    if ip.version == 6 and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+async def resolve_webhook_url(url):
+    """
+    Check that url is an http(s) URL whose host resolves only to public addresses. Returns the
+    address to connect to, or None for hosts in WEBHOOK_ALLOWED_HOSTS. Raises UnsafeWebhookURL.
+    """
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise UnsafeWebhookURL("Webhook URL must be http or https")
+    host = parts.hostname.lower()
+    if host in WEBHOOK_ALLOWED_HOSTS:
+        return None
+    try:
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except (OSError, ValueError) as e:
+        raise UnsafeWebhookURL(f"Cannot resolve webhook host {host}: {e}")
+    addresses = [info[4][0] for info in infos]
+    # Every address, not just the first: a client could be handed any of them
+    if not addresses or not all(public_address(address) for address in addresses):
+        raise UnsafeWebhookURL(f"Webhook host {host} resolves to a non-public address")
+    return addresses[0]
+
+
+def pinned_request(url, address):
+    """(url, extra headers, extensions) that reach address while keeping url's Host and TLS name."""
+    parts = urlsplit(url)
+    if address is None:
+        return url, {}, {}
+    userinfo, _, host = parts.netloc.rpartition("@")
+    netloc = (f"{userinfo}@" if userinfo else "") + (f"[{address}]" if ":" in address else address)
+    netloc += f":{parts.port}" if parts.port else ""
+    return parts._replace(netloc=netloc).geturl(), {"Host": host}, {"sni_hostname": parts.hostname}
+
+
+def sign(secret, body):
+    return "sha256=" + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+def backoff(attempts):
+    delay = min(WEBHOOK_BACKOFF_BASE ** attempts, WEBHOOK_BACKOFF_MAX)
+    return timedelta(seconds=delay * random.uniform(0.5, 1.0))
+
+
+async def lease_batch():
+    """Claim up to WEBHOOK_BATCH_SIZE due deliveries by pushing their next attempt past the lease."""
+    now = datetime.utcnow()
+    async with SessionLocal() as db:
+        rows = (await db.execute(
+            select(EventOutbox.id, EventOutbox.event_type, EventOutbox.payload, EventOutbox.attempts,
+                   Webhook.url, Webhook.secret)
+            .join(Webhook, Webhook.id == EventOutbox.webhook_id)
+            .where(EventOutbox.delivered_at.is_(None), EventOutbox.failed_at.is_(None),
+                   EventOutbox.next_attempt_at <= now)
+            .order_by(EventOutbox.next_attempt_at)
+            .limit(WEBHOOK_BATCH_SIZE)
+            .with_for_update(of=EventOutbox, skip_locked=True)
+        )).all()
+        if rows:
+            await db.execute(
+                update(EventOutbox).where(EventOutbox.id.in_([row.id for row in rows]))
+                .values(next_attempt_at=now + timedelta(seconds=WEBHOOK_LEASE))
+            )
+        await db.commit()
+    return rows
+
+
+async def deliver(http, semaphore, row):
+    """POST one delivery. Returns (outbox id, error or None)."""
+    body = row.payload.encode()
+    headers = {
+        "Content-Type": "application/json",
+        "X-Webhook-Event": row.event_type,
+        "X-Webhook-Delivery": str(row.id),
+        "X-Webhook-Signature": sign(row.secret, body),
+    }
+    async with semaphore:
+        try:
+            # Re-checked on every delivery: the host's DNS may have changed since registration
+            url, pinned_headers, extensions = pinned_request(row.url, await resolve_webhook_url(row.url))
+            response = await http.post(url, content=body, headers={**headers, **pinned_headers}, extensions=extensions)
+        except Exception as e:
+            return row.id, f"{type(e).__name__}: {e}"
+    if response.status_code >= 300:
+        return row.id, f"HTTP {response.status_code}"
+    return row.id, None
+
+
+async def record_results(rows, results):
+    attempts = {row.id: row.attempts for row in rows}
+    now = datetime.utcnow()
+    async with SessionLocal() as db:
+        delivered = [outbox_id for outbox_id, error in results if error is None]
+        if delivered:
+            await db.execute(
+                update(EventOutbox).where(EventOutbox.id.in_(delivered))
+                .values(delivered_at=now, attempts=EventOutbox.attempts + 1, last_error=None)
+            )
+        for outbox_id, error in results:
+            if error is None:
+                continue
+            tries = attempts[outbox_id] + 1
+            values = {"attempts": tries, "last_error": error[:500]}
+            if tries >= WEBHOOK_MAX_ATTEMPTS:
+                values["failed_at"] = now
+            else:
+                values["next_attempt_at"] = now + backoff(tries)
+            await db.execute(update(EventOutbox).where(EventOutbox.id == outbox_id).values(**values))
+        await db.commit()
+
+
+async def dispatch_once(http):
+    """Deliver one leased batch. Returns the number of deliveries attempted."""
+    rows = await lease_batch()
+    if not rows:
+        return 0
+    semaphore = asyncio.Semaphore(WEBHOOK_CONCURRENCY)
+    results = await asyncio.gather(*(deliver(http, semaphore, row) for row in rows))
+    await record_results(rows, results)
+    return len(rows)
+
+
+async def prune_outbox():
+    cutoff = datetime.utcnow() - timedelta(seconds=WEBHOOK_RETENTION)
+    async with SessionLocal() as db:
+        await db.execute(delete(EventOutbox).where(EventOutbox.created_at < cutoff, or_(
+            EventOutbox.delivered_at.isnot(None), EventOutbox.failed_at.isnot(None)
+        )))
+        await db.commit()
+
+
+async def run_dispatcher():
+    """Background task: deliver outbox rows until cancelled."""
+    import httpx
+
+    limits = httpx.Limits(max_connections=WEBHOOK_CONCURRENCY, max_keepalive_connections=WEBHOOK_CONCURRENCY)
+    last_prune = 0.0
+    async with httpx.AsyncClient(timeout=WEBHOOK_TIMEOUT, limits=limits) as http:
+        while True:
+            if time.monotonic() - last_prune > 3600:
+                last_prune = time.monotonic()
+                try:
+                    await prune_outbox()
+                except Exception as e:
+                    print("Webhook outbox prune error:", e)
+            try:
+                if await dispatch_once(http) == WEBHOOK_BATCH_SIZE:
+                    # Full batch: there is probably more waiting
+                    continue
+            except Exception as e:
+                print("Webhook dispatch error:", e)
+            try:
+                await asyncio.wait_for(wakeup.wait(), WEBHOOK_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            wakeup.clear()
@@ -0,0 +1,181 @@
+"""
+In-process, in-memory stand-in for the MinIO client, covering the calls the API makes.
+Used by the benchmark suite so the app can run without a MinIO server; install it with
+`minio_client.client = FakeMinio()` before importing main.
+"""
+
+from minio.datatypes import Object, Part
+from types import SimpleNamespace
+import datetime
+import hashlib
+import io
+import threading
+import uuid
+
+
+class FakeS3Error(Exception):
+    def __init__(self, code, message=""):
+        super().__init__(f"{code}: {message}")
+        self.code = code
+
+
+class FakeResponse(io.BytesIO):
+    """Mimics the urllib3 response returned by get_object."""
+
+    def release_conn(self):
+        pass
+
+    def stream(self, amt=64 * 1024):
+        while chunk := self.read(amt):
+            yield chunk
+
+
+class StoredObject:
+    def __init__(self, data, content_type, metadata):
+        self.data = data
+        self.etag = hashlib.md5(data).hexdigest()
+        self.content_type = content_type or "application/octet-stream"
+        self.metadata = {f"x-amz-meta-{key}".lower(): value for key, value in (metadata or {}).items()}
+        self.last_modified = datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
+
+
+class FakeMinio:
+    def __init__(self):
+        self.buckets = {}
+        self.uploads = {}
+        self.policies = {}
+        self.lock = threading.Lock()
+
+    def _bucket(self, bucket_name):
+        try:
+            return self.buckets[bucket_name]
+        except KeyError:
+            raise FakeS3Error("NoSuchBucket", bucket_name)
+
+    def _object(self, bucket_name, object_name):
+        try:
+            return self._bucket(bucket_name)[object_name]
+        except KeyError:
+            raise FakeS3Error("NoSuchKey", object_name)
+
+    def bucket_exists(self, bucket_name):
+        return bucket_name in self.buckets
+
+    def make_bucket(self, bucket_name):
+        with self.lock:
+            if bucket_name in self.buckets:
+                raise FakeS3Error("BucketAlreadyOwnedByYou", bucket_name)
+            self.buckets[bucket_name] = {}
+
+    def remove_bucket(self, bucket_name):
+        with self.lock:
+            if self._bucket(bucket_name):
+                raise FakeS3Error("BucketNotEmpty", bucket_name)
+            del self.buckets[bucket_name]
+
+    def put_object(self, bucket_name, object_name, data, length, content_type="application/octet-stream",
+                   metadata=None, part_size=0, **kwargs):
+        self._bucket(bucket_name)
+        if length >= 0:
+            content = data.read(length)
+        else:
+            chunks = []
+            while chunk := data.read(part_size or 5 * 1024 * 1024):
+                chunks.append(chunk)
+            content = b"".join(chunks)
+        stored = StoredObject(content, content_type, metadata)
+        with self.lock:
+            self._bucket(bucket_name)[object_name] = stored
+        return SimpleNamespace(bucket_name=bucket_name, object_name=object_name, etag=stored.etag)
+
+    def get_object(self, bucket_name, object_name, offset=0, length=0, **kwargs):
+        data = self._object(bucket_name, object_name).data
+        return FakeResponse(data[offset:offset + length] if length else data[offset:])
+
+    def stat_object(self, bucket_name, object_name, **kwargs):
+        stored = self._object(bucket_name, object_name)
+        return Object(
+            bucket_name, object_name, last_modified=stored.last_modified, etag=stored.etag,
+            size=len(stored.data), metadata=stored.metadata, content_type=stored.content_type
+        )
+
+    def list_objects(self, bucket_name, prefix=None, recursive=False, start_after=None, **kwargs):
+        prefix = prefix or ""
+        with self.lock:
+            names = sorted(name for name in self._bucket(bucket_name) if name.startswith(prefix))
+        last_dir = None
+        for name in names:
+            if start_after is not None and name <= start_after:
+                continue
+            rest = name[len(prefix):]
+            if not recursive and "/" in rest:
+                directory = prefix + rest.split("/", 1)[0] + "/"
+                if directory != last_dir and (start_after is None or directory > start_after):
+                    last_dir = directory
+                    yield Object(bucket_name, directory)
+                continue
+            stored = self.buckets[bucket_name].get(name)
+            if stored is not None:
+                yield Object(bucket_name, name, last_modified=stored.last_modified, etag=stored.etag,
+                             size=len(stored.data))
+
+    def remove_object(self, bucket_name, object_name):
+        with self.lock:
+            self._bucket(bucket_name).pop(object_name, None)
+
+    def remove_objects(self, bucket_name, delete_object_list):
+        bucket = self._bucket(bucket_name)
+        with self.lock:
+            for delete_object in delete_object_list:
+                bucket.pop(delete_object.name, None)
+        return iter(())
+
+    def set_bucket_policy(self, bucket_name, policy):
+        self._bucket(bucket_name)
+        self.policies[bucket_name] = policy
+
+    def get_bucket_policy(self, bucket_name):
+        try:
+            return self.policies[bucket_name]
+        except KeyError:
+            raise FakeS3Error("NoSuchBucketPolicy", bucket_name)
+
+    def delete_bucket_policy(self, bucket_name):
+        self.policies.pop(bucket_name, None)
+
+    # Multipart primitives used through minio_client's wrappers
+
+    def _create_multipart_upload(self, bucket_name, object_name, headers):
+        self._bucket(bucket_name)
+        upload_id = uuid.uuid4().hex
+        self.uploads[upload_id] = {"parts": {}, "content_type": headers.get("Content-Type")}
+        return upload_id
+
+    def _upload_part(self, bucket_name, object_name, data, headers, upload_id, part_number):
+        if upload_id not in self.uploads:
+            raise FakeS3Error("NoSuchUpload", upload_id)
+        if hasattr(data, "read"):
+            data = data.read()
+        self.uploads[upload_id]["parts"][part_number] = data
+        return hashlib.md5(data).hexdigest()
+
+    def _list_parts(self, bucket_name, object_name, upload_id, **kwargs):
+        if upload_id not in self.uploads:
+            raise FakeS3Error("NoSuchUpload", upload_id)
+        parts = [
+            Part(number, hashlib.md5(data).hexdigest(), size=len(data))
+            for number, data in sorted(self.uploads[upload_id]["parts"].items())
+        ]
+        return SimpleNamespace(parts=parts, is_truncated=False, next_part_number_marker=None)
+
+    def _complete_multipart_upload(self, bucket_name, object_name, upload_id, parts, **kwargs):
+        upload = self.uploads.pop(upload_id, None)
+        if upload is None:
+            raise FakeS3Error("NoSuchUpload", upload_id)
+        data = b"".join(upload["parts"][part.part_number] for part in parts)
+        with self.lock:
+            self._bucket(bucket_name)[object_name] = StoredObject(data, upload["content_type"], None)
+
+    def _abort_multipart_upload(self, bucket_name, object_name, upload_id):
+        if self.uploads.pop(upload_id, None) is None:
+            raise FakeS3Error("NoSuchUpload", upload_id)
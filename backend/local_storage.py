@@ -0,0 +1,401 @@
+"""
+# local_storage.py
+Local-filesystem storage driver. It implements the same client interface as MinIO (see
+StorageDriver in minio_client.py), so single-node deployments and CI can keep objects on local
+disk without an S3 hop.
+
+Layout under the root directory:
+    <bucket>/objects/<quoted name>   object bytes, written in chunks to <bucket>/tmp and renamed into place
+    <bucket>/meta/<quoted name>      JSON sidecar with etag, content type and user metadata
+    <bucket>/policy.json             bucket policy (stored, not enforced)
+    .uploads/<upload id>/            parts of in-progress multipart uploads
+Object names are percent-quoted into a single file name, so "/" in keys never creates directories.
+
+Reads are served from memory-mapped files. Full-object responses can go out through the ASGI
+pathsend extension, which lets the server use sendfile.
+"""
+
+from minio.datatypes import Object, Part
+from minio.deleteobjects import DeleteError
+from types import SimpleNamespace
+from urllib.parse import quote, unquote, urlencode
+from auth import SECRET_KEY
+import datetime
+import hashlib
+import hmac
+import json
+import mmap
+import os
+import shutil
+import time
+import uuid
+
+WRITE_CHUNK_SIZE = 1024 * 1024
+# Base URL of the API's /storage routes, which serve presigned requests for this driver
+LOCAL_STORAGE_PUBLIC_URL = os.getenv("LOCAL_STORAGE_PUBLIC_URL", "http://localhost:8000/storage")
+
+
+class LocalStorageError(Exception):
+    def __init__(self, code, message=""):
+        super().__init__(f"{code}: {message}")
+        self.code = code
+
+
+def copy_file(source, destination):
+    """Append source to destination with os.sendfile where the platform allows file-to-file copies."""
+    size = os.fstat(source.fileno()).st_size
+    copied = 0
+    try:
+        while copied < size:
+            sent = os.sendfile(destination.fileno(), source.fileno(), copied, size - copied)
+            if not sent:
+                break
+            copied += sent
+    except OSError:
+        if copied:
+            raise
+        shutil.copyfileobj(source, destination, WRITE_CHUNK_SIZE)
+
+
+class LocalObjectResponse:
+    """get_object result for a local file: reads come from a memory map of the requested range."""
+
+    def __init__(self, path, offset=0, length=0):
+        self.path = path
+        self.file = open(path, "rb")
+        size = os.fstat(self.file.fileno()).st_size
+        self.offset = min(offset, size)
+        self.length = size - self.offset if not length else min(length, size - self.offset)
+        self.full = self.offset == 0 and self.length == size
+        # mmap cannot map an empty file
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        self.position = self.offset
+        self.end = self.offset + self.length
+
+    def read(self, amt=None):
+        if self.map is None:
+            return b""
+        stop = self.end if amt is None else min(self.end, self.position + amt)
+        data = self.map[self.position:stop]
+        self.position = stop
+        return data
+
+    def stream(self, amt=64 * 1024):
+        while chunk := self.read(amt):
+            yield chunk
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        self.file.close()
+
+    def release_conn(self):
+        pass
+
+
+class LocalStorageClient:
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        os.makedirs(os.path.join(self.root, ".uploads"), exist_ok=True)
+
+    # Paths
+
+    def _bucket_dir(self, bucket_name):
+        if not bucket_name or bucket_name.startswith(".") or "/" in bucket_name or "\\" in bucket_name:
+            raise LocalStorageError("InvalidBucketName", bucket_name)
+        return os.path.join(self.root, bucket_name)
+
+    def _existing_bucket_dir(self, bucket_name):
+        path = self._bucket_dir(bucket_name)
+        if not os.path.isdir(path):
+            raise LocalStorageError("NoSuchBucket", bucket_name)
+        return path
+
+    @staticmethod
+    def _file_name(object_name):
+        name = quote(object_name, safe="")
+        if name in (".", ".."):
+            # Valid keys in S3, but as file names they are the directory itself or its parent
+            name = name.replace(".", "%2E")
+        if not object_name or len(name) > 255:
+            raise LocalStorageError("KeyTooLongError" if object_name else "InvalidObjectName", object_name)
+        return name
+
+    def _paths(self, bucket_name, object_name):
+        bucket_dir = self._existing_bucket_dir(bucket_name)
+        name = self._file_name(object_name)
+        return os.path.join(bucket_dir, "objects", name), os.path.join(bucket_dir, "meta", name)
+
+    @staticmethod
+    def _temp_path(path):
+        """Scratch file on the same filesystem as path (under <bucket>/tmp or the upload dir) for atomic renames."""
+        directory = os.path.dirname(path)
+        if os.path.basename(directory) in ("objects", "meta"):
+            directory = os.path.join(os.path.dirname(directory), "tmp")
+        return os.path.join(directory, f".{uuid.uuid4().hex}.tmp")
+
+    def _write_meta(self, path, meta):
+        temp = self._temp_path(path)
+        with open(temp, "w") as meta_file:
+            json.dump(meta, meta_file)
+        os.replace(temp, path)
+
+    def _publish(self, temp, object_path, meta_path, meta):
+        """
+        Move a finished scratch file into place, then its sidecar. The sidecar records the inode of
+        the data it describes, so stat_object can tell a sidecar left over from the previous version
+        (between the two renames, or after a crash between them) from the current one.
+        """
+        meta["inode"] = os.stat(temp).st_ino
+        os.replace(temp, object_path)
+        self._write_meta(meta_path, meta)
+
+    @staticmethod
+    def _read_meta(path):
+        try:
+            with open(path) as meta_file:
+                return json.load(meta_file)
+        except FileNotFoundError:
+            return {}
+
+    # Buckets
+
+    def bucket_exists(self, bucket_name):
+        return os.path.isdir(self._bucket_dir(bucket_name))
+
+    def make_bucket(self, bucket_name):
+        path = self._bucket_dir(bucket_name)
+        try:
+            os.mkdir(path)
+        except FileExistsError:
+            raise LocalStorageError("BucketAlreadyOwnedByYou", bucket_name)
+        for directory in ("objects", "meta", "tmp"):
+            os.mkdir(os.path.join(path, directory))
+
+    def remove_bucket(self, bucket_name):
+        path = self._existing_bucket_dir(bucket_name)
+        if os.listdir(os.path.join(path, "objects")):
+            raise LocalStorageError("BucketNotEmpty", bucket_name)
+        shutil.rmtree(path)
+
+    def set_bucket_policy(self, bucket_name, policy):
+        self._write_meta(os.path.join(self._existing_bucket_dir(bucket_name), "policy.json"), json.loads(policy))
+
+    def get_bucket_policy(self, bucket_name):
+        path = os.path.join(self._existing_bucket_dir(bucket_name), "policy.json")
+        if not os.path.exists(path):
+            raise LocalStorageError("NoSuchBucketPolicy", bucket_name)
+        return json.dumps(self._read_meta(path))
+
+    def delete_bucket_policy(self, bucket_name):
+        try:
+            os.remove(os.path.join(self._existing_bucket_dir(bucket_name), "policy.json"))
+        except FileNotFoundError:
+            pass
+
+    # Objects
+
+    def put_object(self, bucket_name, object_name, data, length, content_type="application/octet-stream",
+                   metadata=None, part_size=0, **kwargs):
+        """Write data in chunks straight to a scratch file on the same disk, then rename it into place."""
+        object_path, meta_path = self._paths(bucket_name, object_name)
+        temp = self._temp_path(object_path)
+        md5 = hashlib.md5()
+        remaining = length
+        chunk_size = part_size or WRITE_CHUNK_SIZE
+        try:
+            fd = os.open(temp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+            try:
+                while remaining != 0:
+                    chunk = data.read(chunk_size if remaining < 0 else min(chunk_size, remaining))
+                    if not chunk:
+                        break
+                    md5.update(chunk)
+                    view = memoryview(chunk)
+                    while view:
+                        view = view[os.write(fd, view):]
+                    if remaining > 0:
+                        remaining -= len(chunk)
+            finally:
+                os.close(fd)
+            if remaining > 0:
+                raise LocalStorageError("IncompleteBody", object_name)
+            etag = md5.hexdigest()
+            self._publish(temp, object_path, meta_path, {
+                "etag": etag,
+                "content_type": content_type or "application/octet-stream",
+                "metadata": {f"x-amz-meta-{key}".lower(): value for key, value in (metadata or {}).items()},
+            })
+        except BaseException:
+            if os.path.exists(temp):
+                os.remove(temp)
+            raise
+        return SimpleNamespace(bucket_name=bucket_name, object_name=object_name, etag=etag, version_id=None)
+
+    def get_object(self, bucket_name, object_name, offset=0, length=0, **kwargs):
+        object_path, _ = self._paths(bucket_name, object_name)
+        try:
+            return LocalObjectResponse(object_path, offset, length)
+        except FileNotFoundError:
+            raise LocalStorageError("NoSuchKey", object_name)
+
+    def stat_object(self, bucket_name, object_name, **kwargs):
+        object_path, meta_path = self._paths(bucket_name, object_name)
+        try:
+            stat = os.stat(object_path)
+        except FileNotFoundError:
+            raise LocalStorageError("NoSuchKey", object_name)
+        meta = self._read_meta(meta_path)
+        # Sidecars written before inodes were recorded are taken as they are
+        if meta.get("inode", stat.st_ino) != stat.st_ino:
+            # The sidecar describes the previous version: report what is actually stored
+            try:
+                with open(object_path, "rb") as object_file:
+                    meta = {"etag": hashlib.file_digest(object_file, "md5").hexdigest()}
+            except FileNotFoundError:
+                raise LocalStorageError("NoSuchKey", object_name)
+        return Object(
+            bucket_name, object_name,
+            last_modified=datetime.datetime.fromtimestamp(int(stat.st_mtime), datetime.timezone.utc),
+            etag=meta.get("etag"), size=stat.st_size, metadata=meta.get("metadata", {}),
+            content_type=meta.get("content_type", "application/octet-stream")
+        )
+
+    def list_objects(self, bucket_name, prefix=None, recursive=False, start_after=None, **kwargs):
+        prefix = prefix or ""
+        objects_dir = os.path.join(self._existing_bucket_dir(bucket_name), "objects")
+        names = sorted(
+            name for name in map(unquote, os.listdir(objects_dir))
+            if name.startswith(prefix)
+        )
+        last_dir = None
+        for name in names:
+            if start_after is not None and name <= start_after:
+                continue
+            rest = name[len(prefix):]
+            if not recursive and "/" in rest:
+                directory = prefix + rest.split("/", 1)[0] + "/"
+                if directory != last_dir and (start_after is None or directory > start_after):
+                    last_dir = directory
+                    yield Object(bucket_name, directory)
+                continue
+            try:
+                stat = os.stat(os.path.join(objects_dir, quote(name, safe="")))
+            except FileNotFoundError:
+                continue
+            yield Object(
+                bucket_name, name, size=stat.st_size,
+                last_modified=datetime.datetime.fromtimestamp(int(stat.st_mtime), datetime.timezone.utc)
+            )
+
+    def remove_object(self, bucket_name, object_name):
+        for path in self._paths(bucket_name, object_name):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def remove_objects(self, bucket_name, delete_object_list):
+        """Like the MinIO client, yields a DeleteError for each object that could not be removed."""
+        for delete_object in delete_object_list:
+            try:
+                self.remove_object(bucket_name, delete_object.name)
+            except (LocalStorageError, OSError) as e:
+                yield DeleteError(getattr(e, "code", "InternalError"), str(e), delete_object.name, None)
+
+    # Presigned URLs, served by the API's /storage routes
+
+    @staticmethod
+    def _signature(method, bucket_name, object_name, expires, disposition):
+        message = "\n".join((method, bucket_name, object_name, str(expires), disposition or ""))
+        return hmac.new(SECRET_KEY.encode(), message.encode(), hashlib.sha256).hexdigest()
+
+    def _presign(self, method, bucket_name, object_name, expires, disposition=None):
+        expires_at = int(time.time() + expires.total_seconds())
+        params = {"expires": expires_at, "signature": self._signature(method, bucket_name, object_name, expires_at, disposition)}
+        if disposition:
+            params["response-content-disposition"] = disposition
+        return f"{LOCAL_STORAGE_PUBLIC_URL}/{quote(bucket_name)}/{quote(object_name)}?{urlencode(params)}"
+
+    def presigned_get_object(self, bucket_name, object_name, expires, response_headers=None, **kwargs):
+        disposition = (response_headers or {}).get("response-content-disposition")
+        return self._presign("GET", bucket_name, object_name, expires, disposition)
+
+    def presigned_put_object(self, bucket_name, object_name, expires):
+        return self._presign("PUT", bucket_name, object_name, expires)
+
+    def verify_presigned(self, method, bucket_name, object_name, expires, signature, disposition=None):
+        """True if the signature matches a URL issued by _presign that has not expired yet."""
+        expected = self._signature(method, bucket_name, object_name, expires, disposition)
+        return expires >= time.time() and hmac.compare_digest(expected, signature)
+
+    # Multipart primitives, mirroring the private MinIO client methods wrapped in minio_client.py
+
+    def _upload_dir(self, upload_id):
+        path = os.path.join(self.root, ".uploads", self._file_name(upload_id))
+        if not os.path.isdir(path):
+            raise LocalStorageError("NoSuchUpload", upload_id)
+        return path
+
+    def _create_multipart_upload(self, bucket_name, object_name, headers):
+        self._paths(bucket_name, object_name)
+        upload_id = uuid.uuid4().hex
+        path = os.path.join(self.root, ".uploads", upload_id)
+        os.mkdir(path)
+        self._write_meta(os.path.join(path, "upload.json"), {"content_type": headers.get("Content-Type")})
+        return upload_id
+
+    def _upload_part(self, bucket_name, object_name, data, headers, upload_id, part_number):
+        """Store one part. data is bytes or a file object, which is copied in chunks."""
+        path = os.path.join(self._upload_dir(upload_id), str(part_number))
+        temp = self._temp_path(path)
+        md5 = hashlib.md5()
+        with open(temp, "wb") as part_file:
+            chunks = iter(lambda: data.read(WRITE_CHUNK_SIZE), b"") if hasattr(data, "read") else [data]
+            for chunk in chunks:
+                md5.update(chunk)
+                part_file.write(chunk)
+        os.replace(temp, path)
+        return md5.hexdigest()
+
+    def _list_parts(self, bucket_name, object_name, upload_id, **kwargs):
+        path = self._upload_dir(upload_id)
+        parts = []
+        for entry in sorted((entry for entry in os.listdir(path) if entry.isdigit()), key=int):
+            with open(os.path.join(path, entry), "rb") as part_file:
+                md5 = hashlib.file_digest(part_file, "md5")
+            parts.append(Part(int(entry), md5.hexdigest(), size=os.path.getsize(os.path.join(path, entry))))
+        return SimpleNamespace(parts=parts, is_truncated=False, next_part_number_marker=None)
+
+    def _complete_multipart_upload(self, bucket_name, object_name, upload_id, parts, **kwargs):
+        """Concatenate the parts with kernel-side copies (os.sendfile between files) and publish the object."""
+        path = self._upload_dir(upload_id)
+        object_path, meta_path = self._paths(bucket_name, object_name)
+        content_type = self._read_meta(os.path.join(path, "upload.json")).get("content_type")
+        temp = self._temp_path(object_path)
+        etags = []
+        try:
+            with open(temp, "wb") as out:
+                for part in parts:
+                    part_path = os.path.join(path, str(part.part_number))
+                    if not os.path.exists(part_path):
+                        raise LocalStorageError("InvalidPart", str(part.part_number))
+                    with open(part_path, "rb") as part_file:
+                        etags.append(hashlib.file_digest(part_file, "md5").digest())
+                        part_file.seek(0)
+                        copy_file(part_file, out)
+            # Same ETag format S3 uses for multipart objects
+            etag = f"{hashlib.md5(b''.join(etags)).hexdigest()}-{len(etags)}"
+            self._publish(temp, object_path, meta_path, {
+                "etag": etag, "content_type": content_type or "application/octet-stream", "metadata": {}
+            })
+        except BaseException:
+            if os.path.exists(temp):
+                os.remove(temp)
+            raise
+        shutil.rmtree(path, ignore_errors=True)
+        return SimpleNamespace(bucket_name=bucket_name, object_name=object_name, etag=etag, version_id=None)
+
+    def _abort_multipart_upload(self, bucket_name, object_name, upload_id):
+        shutil.rmtree(self._upload_dir(upload_id))
@@ -4,181 +4,1081 @@ This file contains the main application logic for the cloud bucket service.
 It includes endpoints for user authentication, bucket management, file operations, and sharing files.
 """
 
-from fastapi import FastAPI, HTTPException, UploadFile, File, Depends
+from fastapi import FastAPI, HTTPException, UploadFile, File, Depends, Query, Request
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
-from minio_client import client
-from schemas import UserCreate, Token
-from utilities import create_access_token, verify_password, hash_password, get_current_user
-from database import get_db, engine
-from models import Base, User, Bucket
-from fastapi.responses import StreamingResponse
-from schemas import ShareFileRequest
-from models import Files, FilePermission, FileVersion, PermissionType
-import io
+from sqlalchemy import select, delete, update, and_, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from minio_client import (
+    client, presign_client, PRESIGN_EXPIRY, UPLOAD_PART_SIZE, run_storage, stream_object, remove_objects,
+    purge_bucket, batched, iter_object_names, create_multipart_upload, upload_part, list_parts,
+    complete_multipart_upload, abort_multipart_upload, DOWNLOAD_CHUNK_SIZE, MULTIPART_MAX_PART_SIZE,
+    MULTIPART_MIN_PART_SIZE, MULTIPART_STALE_AFTER, MULTIPART_SWEEP_INTERVAL, ObjectResponse, object_cache, read_object
+)
+from schemas import UserCreate, Token, RefreshRequest, WebhookCreate
+from auth import ACCESS_TOKEN_EXPIRE_MINUTES, PASSWORD_QUEUE_LIMIT
+from utilities import (
+    create_access_token, create_refresh_token, decode_refresh_token, password_fingerprint, password_executor, start_password_workers,
+    verify_password, hash_password, get_current_user, get_admin_user, invalidate_user,
+    token_cache, principal_cache, permission_cache, HashingReader, encode_continuation_token, decode_continuation_token,
+    etag_matches, not_modified_since, parse_range
+)
+from database import get_db, engine, SessionLocal
+from models import User, Bucket
+from fastapi.responses import StreamingResponse, Response, RedirectResponse, PlainTextResponse
+from schemas import ShareFileRequest, BatchShareRequest
+from models import Files, FilePermission, FileVersion, PermissionType, Blob, MultipartUpload, Webhook, EventOutbox
+from bucket_registry import registry as bucket_registry, get_bucket, invalidate_bucket
+from metrics import MetricsMiddleware, instrument_engine, render_metrics, record_password_call, record_password_rejected
+from archive import stream_zip, stream_tar
+from dedup import (
+    DEDUP_ENABLED, DEDUP_BUCKET, hash_file, store_blob, acquire_blob, put_pointer, pointer_target,
+    release_blobs, collect_garbage
+)
+from compression import (
+    available_codecs, is_compressible, compression_metadata, stored_codec, CompressingReader, accepts_encoding,
+    decompress_stream, decompress_bytes, object_size, COMPRESSION_MIN_SIZE
+)
+from search import RECONCILE_INTERVAL, search_query, encode_cursor, decode_cursor
+from sharing import (
+    SHARE_BATCH_LIMIT, PolicyTooLarge, add_permissions, sync_bucket_policy, policy_wildcards, bucket_has_grants
+)
+from events import EVENT_TYPES, UnsafeWebhookURL, emit_event, run_dispatcher, resolve_webhook_url
+from contextlib import asynccontextmanager
+from email.utils import format_datetime
+from datetime import timedelta, datetime, timezone
+import asyncio
+import secrets
+import tempfile
+import time
 import json
+from itertools import islice
+from collections import deque
+from typing import Optional
 
-Base.metadata.create_all(bind=engine)
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # The schema is created and upgraded by `alembic upgrade head` before workers start
+    if DEDUP_ENABLED and not await run_storage(client.bucket_exists, DEDUP_BUCKET):
+        await run_storage(client.make_bucket, DEDUP_BUCKET)
+    await start_password_workers()
+    sweeper = asyncio.create_task(sweep_stale_uploads())
+    dispatcher = asyncio.create_task(run_dispatcher())
+    reconciler = asyncio.create_task(reconcile_storage()) if RECONCILE_INTERVAL > 0 else None
+    yield
+    sweeper.cancel()
+    dispatcher.cancel()
+    if reconciler:
+        reconciler.cancel()
+    password_executor.shutdown(wait=False, cancel_futures=True)
+    await engine.dispose()
+
+
+async def sweep_stale_uploads():
+    """Periodically abort multipart uploads that have had no part uploaded for MULTIPART_STALE_AFTER."""
+    while True:
+        await asyncio.sleep(MULTIPART_SWEEP_INTERVAL)
+        try:
+            cutoff = datetime.utcnow() - timedelta(seconds=MULTIPART_STALE_AFTER)
+            async with SessionLocal() as db:
+                rows = (await db.execute(
+                    select(MultipartUpload.id, MultipartUpload.upload_id, MultipartUpload.name, Bucket.name)
+                    .join(Bucket, Bucket.id == MultipartUpload.bucket_id)
+                    .where(MultipartUpload.last_activity_at < cutoff)
+                )).all()
+                for row_id, upload_id, name, bucket_name in rows:
+                    try:
+                        await run_storage(abort_multipart_upload, bucket_name, name, upload_id)
+                    except Exception as e:
+                        # Already gone in MinIO; the row is stale either way
+                        print("Multipart sweep error:", e)
+                    await db.execute(delete(MultipartUpload).where(MultipartUpload.id == row_id))
+                await db.commit()
+        except Exception as e:
+            print("Multipart sweep error:", e)
+
+
+async def reconcile_storage():
+    """Periodically bring the Files table, which search reads, back in line with the object store."""
+    while True:
+        await asyncio.sleep(RECONCILE_INTERVAL)
+        try:
+            async with SessionLocal() as db:
+                buckets = (await db.execute(select(Bucket.id, Bucket.name))).all()
+            for bucket_id, bucket_name in buckets:
+                try:
+                    async with SessionLocal() as db:
+                        await reconcile_bucket(db, bucket_id, bucket_name)
+                except Exception as e:
+                    print(f"Reconcile error for bucket {bucket_name}:", e)
+        except Exception as e:
+            print("Reconcile error:", e)
+
+
+async def reconcile_bucket(db: AsyncSession, bucket_id, bucket_name):
+    """
+    Add Files rows for objects that have none and drop rows whose object is gone.
+    Returns (added, removed). Versions are not recorded for added rows; no upload was seen.
+    """
+    known = set((await db.execute(select(Files.name).where(Files.bucket_id == bucket_id))).scalars())
+    # Objects written after this snapshot either get their own row or are skipped by the upsert below
+    unknown = []
+    async for name in iter_object_names(bucket_name):
+        if name in known:
+            known.discard(name)
+        else:
+            unknown.append(name)
+
+    insert = postgresql_insert if db.bind.dialect.name == "postgresql" else sqlite_insert
+    added = 0
+    for name in unknown:
+        try:
+            stat = await run_storage(client.stat_object, bucket_name, name)
+        except Exception:
+            # Deleted since it was listed
+            continue
+        size, blob_hash = object_size(stat), None
+        if DEDUP_ENABLED and (blob_hash := pointer_target(stat)):
+            if not await acquire_blob(db, blob_hash):
+                print(f"Reconcile error: {bucket_name}/{name} points at missing blob {blob_hash}")
+                continue
+            size = (await db.execute(select(Blob.size).where(Blob.hash == blob_hash))).scalar()
+        uploaded_at = stat.last_modified.astimezone(timezone.utc).replace(tzinfo=None) if stat.last_modified else None
+        inserted = (await db.execute(
+            insert(Files).values(bucket_id=bucket_id, name=name, size=size, blob_hash=blob_hash, uploaded_at=uploaded_at)
+            .on_conflict_do_nothing(index_elements=[Files.bucket_id, Files.name])
+            .returning(Files.id)
+        )).first()
+        if inserted:
+            added += 1
+        elif blob_hash:
+            # An upload recorded the file meanwhile and holds its own reference
+            await db.execute(update(Blob).where(Blob.hash == blob_hash).values(refcount=Blob.refcount - 1))
+
+    revoked = 0
+    for batch in batched(sorted(known)):
+        revoked += await delete_file_rows(db, Files.bucket_id == bucket_id, Files.name.in_(batch))
+    await db.commit()
+    forget_permissions(bucket_name, known)
+    # Added objects may fall under a collapsed grant, removed ones may have been shared
+    if revoked or (added and await bucket_has_grants(db, bucket_id)):
+        await refresh_bucket_policy(db, bucket_id, bucket_name)
+    if known and DEDUP_ENABLED:
+        await collect_garbage(db)
+    return added, len(known)
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(MetricsMiddleware)
+instrument_engine(engine.sync_engine)
+
+
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
+password_slots = asyncio.Semaphore(PASSWORD_QUEUE_LIMIT)
+
+
+async def run_password_call(func, *args):
+    """
+    Run a bcrypt call on the password process pool and record its time. When PASSWORD_QUEUE_LIMIT
+    calls are already pending, fail fast with 503 rather than letting a login burst pile up.
+    """
+    if password_slots.locked():
+        record_password_rejected(func.__name__)
+        raise HTTPException(status_code=503, detail="Too many concurrent logins, retry shortly",
+                            headers={"Retry-After": "1"})
+    async with password_slots:
+        start = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(password_executor, func, *args)
+        finally:
+            record_password_call(func.__name__, time.perf_counter() - start)
+
+
+def issue_tokens(user: User):
+    return {
+        "access_token": create_access_token({"sub": user.username}),
+        "token_type": "bearer",
+        "refresh_token": create_refresh_token(user.username, user.hashed_password),
+        "expires_in": ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+    }
 
 
 @app.post("/signup")
-def signup(user: UserCreate, db: Session = Depends(get_db)):
-    if db.query(User).filter(User.username == user.username).first():
+async def signup(user: UserCreate, db: AsyncSession = Depends(get_db)):
+    if (await db.execute(select(User.id).where(User.username == user.username))).first():
         raise HTTPException(status_code=400, detail="User already exists")
-    new_user = User(username=user.username, hashed_password=hash_password(user.password))
+    hashed_password = await run_password_call(hash_password, user.password)
+    new_user = User(username=user.username, hashed_password=hashed_password)
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.commit()
+    invalidate_user(new_user.username)
     return {"message": "User created"}
 
 
 @app.post("/login", response_model=Token)
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.username == form_data.username).first()
-    if not user or not verify_password(form_data.password, user.hashed_password):
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
+    user = (await db.execute(select(User).where(User.username == form_data.username))).scalars().first()
+    if not user or not await run_password_call(verify_password, form_data.password, user.hashed_password):
         raise HTTPException(status_code=401, detail="Invalid login")
-    token = create_access_token({"sub": user.username})
-    return {"access_token": token, "token_type": "bearer"}
+    return issue_tokens(user)
+
+
+@app.post("/refresh", response_model=Token)
+async def refresh(data: RefreshRequest, db: AsyncSession = Depends(get_db)):
+    """Exchange a refresh token for a new access / refresh token pair without re-checking the password."""
+    payload = decode_refresh_token(data.refresh_token)
+    snapshot = principal_cache.get(payload["sub"])
+    if snapshot is not None:
+        user = User(**snapshot)
+    else:
+        user = (await db.execute(select(User).where(User.username == payload["sub"]))).scalars().first()
+    if user is None or payload.get("pwd") != password_fingerprint(user.hashed_password):
+        raise HTTPException(status_code=401, detail="Invalid refresh token")
+    return issue_tokens(user)
+
+
+@app.get("/cache_stats")
+async def cache_stats(user: User = Depends(get_admin_user)):
+    """Sizes and hit rates of the service's caches, for the operators listed in ADMIN_USERS."""
+    return {
+        "auth_tokens": token_cache.stats(),
+        "auth_principals": principal_cache.stats(),
+        "bucket_registry": bucket_registry.stats(),
+        "permissions": permission_cache.stats(),
+        "objects": object_cache.stats(),
+    }
+
+
+@app.post("/webhooks")
+async def create_webhook(data: WebhookCreate, user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    """Register a URL that receives signed POSTs for the chosen file lifecycle events."""
+    try:
+        await resolve_webhook_url(data.url)
+    except UnsafeWebhookURL as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    unknown = set(data.events or ()) - set(EVENT_TYPES)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown event types {sorted(unknown)}, use {list(EVENT_TYPES)}")
+    webhook = Webhook(user_id=user.id, url=data.url, secret=data.secret or secrets.token_hex(32),
+                      events=",".join(data.events) if data.events else None)
+    db.add(webhook)
+    await db.commit()
+    return {"id": webhook.id, "url": webhook.url, "events": data.events or list(EVENT_TYPES), "secret": webhook.secret}
+
+
+@app.get("/webhooks")
+async def list_webhooks(user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    webhooks = (await db.execute(
+        select(Webhook).where(Webhook.user_id == user.id, Webhook.active.is_(True)).order_by(Webhook.id)
+    )).scalars().all()
+    return [
+        {"id": webhook.id, "url": webhook.url, "events": webhook.events.split(",") if webhook.events else list(EVENT_TYPES),
+         "created_at": webhook.created_at}
+        for webhook in webhooks
+    ]
+
+
+@app.delete("/webhooks")
+async def delete_webhook(webhook_id: int, user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    webhook = (await db.execute(
+        select(Webhook.id).where(Webhook.id == webhook_id, Webhook.user_id == user.id)
+    )).first()
+    if not webhook:
+        raise HTTPException(status_code=404, detail="Webhook not found")
+    # Pending deliveries are dropped with the webhook
+    await db.execute(delete(EventOutbox).where(EventOutbox.webhook_id == webhook_id))
+    await db.execute(delete(Webhook).where(Webhook.id == webhook_id))
+    await db.commit()
+    return {"message": f"Webhook {webhook_id} deleted"}
 
 
 @app.post("/buckets")
-def create_bucket(bucket: dict, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def create_bucket(bucket: dict, user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
     bucket_name = f"{user.username}-{bucket['bucket']}"
-    if not client.bucket_exists(bucket_name):
-        client.make_bucket(bucket_name)
-    new_bucket = Bucket(name=bucket_name, owner_id=user.id)
+    compression = check_codec(bucket.get("compression"))
+    if not await run_storage(client.bucket_exists, bucket_name):
+        await run_storage(client.make_bucket, bucket_name)
+    new_bucket = Bucket(name=bucket_name, owner_id=user.id, compression=compression)
     db.add(new_bucket)
-    db.commit()
+    await db.commit()
+    await invalidate_bucket(user.id, bucket_name)
     return {"message": f"Bucket {bucket_name} created"}
 
 
+@app.post("/bucket_compression")
+async def set_bucket_compression(bucket: str, codec: Optional[str] = None, user: User = Depends(get_current_user),
+                                 db: AsyncSession = Depends(get_db)):
+    """Turn compression of new uploads on (codec "gzip" / "zstd") or off (no codec). Stored objects are unchanged."""
+    bucket_name = f"{user.username}-{bucket}"
+    codec = check_codec(codec)
+    result = await db.execute(
+        update(Bucket).where(Bucket.name == bucket_name, Bucket.owner_id == user.id).values(compression=codec)
+    )
+    if result.rowcount == 0:
+        raise HTTPException(status_code=404, detail="Bucket not found")
+    await db.commit()
+    await invalidate_bucket(user.id, bucket_name)
+    return {"bucket": bucket_name, "compression": codec}
+
+
+def check_codec(codec):
+    if codec and codec not in available_codecs():
+        raise HTTPException(status_code=400, detail=f"Unsupported compression codec, use one of {list(available_codecs())}")
+    return codec or None
+
+
 @app.post("/upload")
-def upload(bucket: str, file: UploadFile = File(...), user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def upload(bucket: str, file: UploadFile = File(...), user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    bucket_name = f"{user.username}-{bucket}"
+    bucket_entry = await get_bucket(db, user.id, bucket_name)
+    if not bucket_entry["exists"]:
+        raise HTTPException(status_code=404, detail="Bucket not found")
+    if bucket_entry["id"] is None:
+        raise HTTPException(status_code=404, detail="Bucket not found in database")
+    content_type = file.content_type or "application/octet-stream"
+    codec = bucket_entry.get("compression")
+    if not (codec and file.size is not None and file.size >= COMPRESSION_MIN_SIZE
+            and is_compressible(content_type, file.filename)):
+        codec = None
+
+    if DEDUP_ENABLED:
+        # Hash the spooled file locally first so a blob that is already stored is never re-sent.
+        # Whether that happened is not reported: it would tell callers what other users have stored.
+        size, content_hash = await run_storage(hash_file, file.file)
+        await store_blob(db, content_hash, size, file.file, UPLOAD_PART_SIZE, codec=codec)
+        await put_pointer(bucket_name, file.filename, content_hash, content_type)
+    else:
+        # Stream the spooled upload straight into a multipart put; size and hash are computed on the fly
+        reader = HashingReader(file.file)
+        data, metadata = reader, None
+        if codec:
+            # Size and hash still describe the original bytes
+            data, metadata = CompressingReader(reader, codec), compression_metadata(codec, file.size)
+        await run_storage(
+            client.put_object,
+            bucket_name=bucket_name,
+            object_name=file.filename,
+            data=data,
+            length=-1,
+            part_size=UPLOAD_PART_SIZE,
+            content_type=content_type,
+            metadata=metadata
+        )
+        size, content_hash = reader.size, reader.hexdigest()
+
+    # Add file entry to database
+    new_file = await add_file_record(db, bucket_entry["id"], bucket_name, file.filename, size, content_hash, user.id,
+                                     blob_hash=content_hash if DEDUP_ENABLED else None)
+    return {"filename": file.filename, "status": "Upload successful", "file_id": new_file.id, "size": new_file.size}
+
+
+@app.post("/upload_by_hash")
+async def upload_by_hash(bucket: str, filename: str, content_hash: str, content_type: str = "application/octet-stream",
+                         user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    """Create a file from a blob the caller already stores in one of their files, without sending its content."""
+    if not DEDUP_ENABLED:
+        raise HTTPException(status_code=400, detail="Deduplication is not enabled")
     bucket_name = f"{user.username}-{bucket}"
-    if not client.bucket_exists(bucket_name):
+    bucket_entry = await get_bucket(db, user.id, bucket_name)
+    if not bucket_entry["exists"] or bucket_entry["id"] is None:
         raise HTTPException(status_code=404, detail="Bucket not found")
+    content_hash = content_hash.lower()
+    # Blobs are shared across users, so knowing a hash must not grant access to someone else's content
+    owned = (await db.execute(
+        select(Files.id).join(Bucket, Bucket.id == Files.bucket_id)
+        .where(Files.blob_hash == content_hash, Bucket.owner_id == user.id).limit(1)
+    )).first()
+    if not owned or not await acquire_blob(db, content_hash):
+        raise HTTPException(status_code=404, detail="Blob not found, upload the content instead")
+    size = (await db.execute(select(Blob.size).where(Blob.hash == content_hash))).scalar()
+    await put_pointer(bucket_name, filename, content_hash, content_type)
+    new_file = await add_file_record(db, bucket_entry["id"], bucket_name, filename, size, content_hash, user.id,
+                                     blob_hash=content_hash)
+    return {"filename": filename, "status": "Upload successful", "file_id": new_file.id, "size": size}
 
-    content = file.file.read()
-    stream = io.BytesIO(content)
 
-    client.put_object(
-        bucket_name=bucket_name,
-        object_name=file.filename,
-        data=stream,
-        length=len(content),
-        content_type=file.content_type
+async def add_file_record(db: AsyncSession, bucket_id, bucket_name, name, size, content_hash, user_id, blob_hash=None):
+    """Upsert the single Files row for (bucket_id, name) and record a FileVersion for this upload."""
+    # The blob reference held by the row being replaced is released; the new upload took its own
+    current = (await db.execute(
+        select(Files.blob_hash).where(Files.bucket_id == bucket_id, Files.name == name).with_for_update()
+    )).first()
+    if current and current.blob_hash:
+        await db.execute(update(Blob).where(Blob.hash == current.blob_hash).values(refcount=Blob.refcount - 1))
+
+    insert = postgresql_insert if db.bind.dialect.name == "postgresql" else sqlite_insert
+    values = {"size": size, "blob_hash": blob_hash, "uploaded_at": datetime.utcnow()}
+    new_file = (await db.execute(
+        insert(Files).values(bucket_id=bucket_id, name=name, **values)
+        .on_conflict_do_update(index_elements=[Files.bucket_id, Files.name], set_=values)
+        .returning(Files),
+        execution_options={"populate_existing": True}
+    )).scalar_one()
+    db.add(FileVersion(file_id=new_file.id, user_id=user_id, content_hash=content_hash))
+    await emit_event(db, user_id, "file.uploaded", [{
+        "bucket": bucket_name, "filename": name, "file_id": new_file.id, "size": size, "content_hash": content_hash
+    }])
+    await db.commit()
+    object_cache.invalidate(bucket_name, name)
+    if current is None and await bucket_has_grants(db, bucket_id):
+        # A new object under a collapsed "<prefix>*" grant must not become readable by that grantee
+        wildcards = await policy_wildcards(bucket_name)
+        if any(name.startswith(prefix) for prefix in wildcards):
+            await refresh_bucket_policy(db, bucket_id, bucket_name)
+    return new_file
+
+
+async def refresh_bucket_policy(db: AsyncSession, bucket_id, bucket_name):
+    """Rebuild a policy after files changed underneath it. Errors are logged; the file change stands."""
+    try:
+        await sync_bucket_policy(db, bucket_id, bucket_name, strict=False)
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        print("MinIO policy error:", e)
+
+
+async def commit_with_policies(db: AsyncSession, buckets, strict=True):
+    """
+    Rebuild and apply the policies of buckets ({bucket id: name}) inside the open transaction, then
+    commit, so grants and policies change together. On failure the transaction is rolled back and
+    any policy already replaced is rebuilt from the committed grants.
+    """
+    applied = {}
+    try:
+        for bucket_id, bucket_name in buckets.items():
+            await sync_bucket_policy(db, bucket_id, bucket_name, strict=strict)
+            applied[bucket_id] = bucket_name
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        for bucket_id, bucket_name in applied.items():
+            await refresh_bucket_policy(db, bucket_id, bucket_name)
+        if isinstance(e, PolicyTooLarge):
+            raise HTTPException(status_code=413, detail=str(e))
+        print("MinIO policy error:", e)
+        raise HTTPException(status_code=500, detail="Failed to set MinIO bucket policy")
+
+
+@app.post("/multipart/initiate")
+async def multipart_initiate(bucket: str, filename: str, content_type: str = "application/octet-stream",
+                             user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    """Start a resumable upload. Parts can then be sent in any order and concurrently."""
+    bucket_name = f"{user.username}-{bucket}"
+    bucket_entry = await get_bucket(db, user.id, bucket_name)
+    if not bucket_entry["exists"] or bucket_entry["id"] is None:
+        raise HTTPException(status_code=404, detail="Bucket not found")
+    upload_id = await run_storage(create_multipart_upload, bucket_name, filename, content_type)
+    db.add(MultipartUpload(
+        upload_id=upload_id, bucket_id=bucket_entry["id"], name=filename, user_id=user.id, content_type=content_type
+    ))
+    await db.commit()
+    return {"upload_id": upload_id, "bucket": bucket, "filename": filename}
+
+
+async def get_multipart_upload(db: AsyncSession, user: User, upload_id: str):
+    row = (await db.execute(
+        select(MultipartUpload, Bucket.name)
+        .join(Bucket, Bucket.id == MultipartUpload.bucket_id)
+        .where(MultipartUpload.upload_id == upload_id, MultipartUpload.user_id == user.id)
+    )).first()
+    if not row:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return row
+
+
+@app.put("/multipart/part")
+async def multipart_upload_part(request: Request, upload_id: str, part_number: int = Query(..., ge=1, le=10000),
+                                user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    """Upload one part from the raw request body. Re-sending a part number replaces it."""
+    upload, bucket_name = await get_multipart_upload(db, user, upload_id)
+    # Recorded before the body is read, so the sweep leaves an upload alone while a slow part arrives
+    await db.execute(
+        update(MultipartUpload).where(MultipartUpload.id == upload.id).values(last_activity_at=datetime.utcnow())
     )
+    await db.commit()
+    # Parts larger than UPLOAD_PART_SIZE spill to disk while the client is still sending them
+    with tempfile.SpooledTemporaryFile(max_size=UPLOAD_PART_SIZE) as body:
+        size = 0
+        async for chunk in request.stream():
+            size += len(chunk)
+            if size > MULTIPART_MAX_PART_SIZE:
+                raise HTTPException(status_code=413, detail=f"Parts are limited to {MULTIPART_MAX_PART_SIZE} bytes")
+            await run_storage(body.write, chunk)
+        if not size:
+            raise HTTPException(status_code=400, detail="Empty part")
+        body.seek(0)
+        try:
+            etag = await run_storage(upload_part, bucket_name, upload.name, upload_id, part_number, body, size)
+        except Exception as e:
+            print("Upload part error:", e)
+            raise HTTPException(status_code=500, detail="Failed to upload part")
+    return {"part_number": part_number, "etag": etag, "size": size}
 
-    # Add file entry to database
-    bucket_obj = db.query(Bucket).filter(Bucket.name == bucket_name, Bucket.owner_id == user.id).first()
-    if not bucket_obj:
-        raise HTTPException(status_code=404, detail="Bucket not found in database")
-    new_file = Files(name=file.filename, bucket_id=bucket_obj.id)
-    db.add(new_file)
-    db.commit()
-    db.refresh(new_file)
 
-    return {"filename": file.filename, "status": "Upload successful", "file_id": new_file.id}
+@app.get("/multipart/parts")
+async def multipart_list_parts(upload_id: str, user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    """List the parts stored so far, so a client can resume by sending only the missing ones."""
+    upload, bucket_name = await get_multipart_upload(db, user, upload_id)
+    try:
+        parts = await run_storage(list_parts, bucket_name, upload.name, upload_id)
+    except Exception as e:
+        print("List parts error:", e)
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return [{"part_number": part.part_number, "etag": part.etag, "size": part.size} for part in parts]
+
+
+@app.post("/multipart/complete")
+async def multipart_complete(upload_id: str, user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    """Assemble the uploaded parts, in part-number order, into the final object."""
+    upload, bucket_name = await get_multipart_upload(db, user, upload_id)
+    try:
+        parts = await run_storage(list_parts, bucket_name, upload.name, upload_id)
+        if not parts:
+            raise HTTPException(status_code=400, detail="No parts uploaded")
+        parts = sorted(parts, key=lambda part: part.part_number)
+        small = next((part for part in parts[:-1] if (part.size or 0) < MULTIPART_MIN_PART_SIZE), None)
+        if small:
+            raise HTTPException(status_code=400, detail=(
+                f"Part {small.part_number} is {small.size} bytes; every part but the last must be "
+                f"at least {MULTIPART_MIN_PART_SIZE} bytes, re-send it with more data"
+            ))
+        await run_storage(complete_multipart_upload, bucket_name, upload.name, upload_id, parts)
+    except HTTPException:
+        raise
+    except Exception as e:
+        print("Complete multipart upload error:", e)
+        raise HTTPException(status_code=500, detail="Failed to complete upload")
+    # The upload record is removed in the same transaction that creates the file and its version
+    await db.execute(delete(MultipartUpload).where(MultipartUpload.id == upload.id))
+    new_file = await add_file_record(db, upload.bucket_id, bucket_name, upload.name, sum(part.size or 0 for part in parts), None, user.id)
+    return {"filename": upload.name, "status": "Upload successful", "file_id": new_file.id, "size": new_file.size}
+
+
+@app.delete("/multipart/abort")
+async def multipart_abort(upload_id: str, user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    upload, bucket_name = await get_multipart_upload(db, user, upload_id)
+    try:
+        await run_storage(abort_multipart_upload, bucket_name, upload.name, upload_id)
+    except Exception as e:
+        print("Abort multipart upload error:", e)
+    await db.execute(delete(MultipartUpload).where(MultipartUpload.id == upload.id))
+    await db.commit()
+    return {"message": f"Upload {upload_id} aborted"}
 
 
 @app.get("/files")
-def list_files(bucket: str, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def list_files(
+    bucket: str,
+    prefix: Optional[str] = None,
+    delimiter: Optional[str] = None,
+    limit: int = Query(1000, ge=1, le=1000),
+    continuation_token: Optional[str] = None,
+    user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
     bucket_name = f"{user.username}-{bucket}"
-    if not client.bucket_exists(bucket_name):
+    bucket_entry = await get_bucket(db, user.id, bucket_name)
+    if not bucket_entry["exists"]:
         raise HTTPException(status_code=404, detail="Bucket not found")
-    objects = client.list_objects(bucket_name)
-    result = []
-    for obj in objects:
-        file_record = db.query(Files).filter(
-            Files.name == obj.object_name,
-            Files.bucket.has(name=bucket_name)
-        ).first()
-        result.append({
-            "filename": obj.object_name,
-            "file_id": file_record.id if file_record else None
-        })
-    return result
+    if delimiter not in (None, "", "/"):
+        raise HTTPException(status_code=400, detail="Only '/' is supported as delimiter")
+    start_after = decode_continuation_token(continuation_token) if continuation_token else None
+
+    # Fetch one extra entry so we know whether another page exists without listing further
+    objects = await run_storage(list_page, bucket_name, prefix, not delimiter, start_after, limit + 1)
+    next_token = None
+    if len(objects) > limit:
+        objects = objects[:limit]
+        last = objects[-1].object_name
+        # Skip past every key under a common prefix, not just the prefix itself
+        next_token = encode_continuation_token(last + "\U0010ffff" if objects[-1].is_dir else last)
+
+    names = [obj.object_name for obj in objects if not obj.is_dir]
+    file_ids = {}
+    if names and bucket_entry["id"] is not None:
+        file_ids = dict((await db.execute(
+            select(Files.name, Files.id).where(
+                Files.bucket_id == bucket_entry["id"],
+                Files.name.in_(names)
+            )
+        )).all())
+
+    files = [{"filename": name, "file_id": file_ids.get(name)} for name in names]
+    common_prefixes = [obj.object_name for obj in objects if obj.is_dir]
+    return StreamingResponse(stream_listing(files, common_prefixes, next_token), media_type="application/json")
+
+
+def list_page(bucket_name, prefix, recursive, start_after, limit):
+    return list(islice(
+        client.list_objects(bucket_name, prefix=prefix, recursive=recursive, start_after=start_after),
+        limit
+    ))
+
+
+def stream_listing(files, common_prefixes, next_token):
+    yield '{"files": ['
+    for i, entry in enumerate(files):
+        yield ("," if i else "") + json.dumps(entry)
+    yield '], "common_prefixes": ' + json.dumps(common_prefixes)
+    yield ', "next_continuation_token": ' + json.dumps(next_token) + '}'
 
 
 @app.get("/download")
-def download_file(bucket: str, filename: str, user: User = Depends(get_current_user)):
+async def download_file(request: Request, bucket: str, filename: str, redirect: bool = False,
+                        user: User = Depends(get_current_user)):
+    bucket_name = f"{user.username}-{bucket}"
+    if redirect:
+        # Let the client fetch the bytes from MinIO directly
+        return RedirectResponse(await presigned_download_url(bucket_name, filename), status_code=307)
+    return await serve_object(request, bucket_name, filename)
+
+
+@app.get("/download_archive")
+async def download_archive(
+    bucket: str,
+    names: Optional[list[str]] = Query(None),
+    prefix: Optional[str] = None,
+    format: str = Query("zip", pattern="^(zip|tar)$"),
+    compress: bool = False,
+    prefetch: int = Query(2, ge=0, le=16),
+    user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Stream several files as one ZIP (or tar) archive built on the fly. Pass either explicit names
+    or a prefix. Up to `prefetch` upcoming objects are opened ahead of the one being written.
+    """
+    bucket_name = f"{user.username}-{bucket}"
+    bucket_entry = await get_bucket(db, user.id, bucket_name)
+    if not bucket_entry["exists"]:
+        raise HTTPException(status_code=404, detail="Bucket not found")
+    if not names and prefix is None:
+        raise HTTPException(status_code=400, detail="Provide names or a prefix")
+
+    entries = archive_entries(bucket_name, iter_names(names) if names else iter_object_names(bucket_name, prefix), prefetch)
+    if format == "tar":
+        body, media_type = stream_tar(entries), "application/x-tar"
+    else:
+        body, media_type = stream_zip(entries, compress=compress), "application/zip"
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{bucket}.{format}"'}
+    )
+
+
+async def iter_names(names):
+    for name in names:
+        yield name
+
+
+async def archive_entries(bucket_name, names, prefetch):
+    """
+    Yield (name, size, last_modified, chunks) for each object, keeping up to `prefetch` later
+    objects already opened with their first chunk read. Missing objects are skipped.
+    """
+    async def open_entry(name):
+        try:
+            storage_bucket, object_name, stat, _ = await resolve_object(bucket_name, name)
+            response = await run_storage(client.get_object, storage_bucket, object_name)
+            first_chunk = await run_storage(response.read, DOWNLOAD_CHUNK_SIZE)
+        except Exception as e:
+            print("Archive error:", name, e)
+            return None
+        return name, stat, response, first_chunk
+
+    async def raw_chunks(response, first_chunk):
+        if first_chunk:
+            yield first_chunk
+        async for chunk in stream_object(response):
+            yield chunk
+
+    def chunks(stat, response, first_chunk):
+        codec, _ = stored_codec(stat)
+        if codec:
+            return decompress_stream(raw_chunks(response, first_chunk), codec)
+        return raw_chunks(response, first_chunk)
+
+    pending = deque()
+    names = aiter(names)
+    exhausted = False
+    try:
+        while True:
+            while not exhausted and len(pending) <= prefetch:
+                name = await anext(names, None)
+                if name is None:
+                    exhausted = True
+                else:
+                    pending.append(asyncio.create_task(open_entry(name)))
+            if not pending:
+                return
+            entry = await pending.popleft()
+            if entry is None:
+                continue
+            name, stat, response, first_chunk = entry
+            yield name, object_size(stat), stat.last_modified, chunks(stat, response, first_chunk)
+    finally:
+        # Client went away mid-archive: release connections opened ahead of time
+        for task in pending:
+            if task.done() and task.result():
+                task.result()[2].close()
+            task.cancel()
+
+
+@app.get("/presign/download")
+async def presign_download(bucket: str, filename: str, user: User = Depends(get_current_user)):
+    bucket_name = f"{user.username}-{bucket}"
+    return {"url": await presigned_download_url(bucket_name, filename), "expires_in": PRESIGN_EXPIRY}
+
+
+@app.post("/presign/upload")
+async def presign_upload(bucket: str, filename: str, user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    """Issue a presigned PUT URL; the client uploads to MinIO directly and then calls /upload_complete."""
     bucket_name = f"{user.username}-{bucket}"
+    bucket_entry = await get_bucket(db, user.id, bucket_name)
+    if not bucket_entry["exists"] or bucket_entry["id"] is None:
+        raise HTTPException(status_code=404, detail="Bucket not found")
+    url = presign_client.presigned_put_object(bucket_name, filename, expires=timedelta(seconds=PRESIGN_EXPIRY))
+    return {"url": url, "expires_in": PRESIGN_EXPIRY}
+
+
+@app.post("/upload_complete")
+async def upload_complete(bucket: str, filename: str, user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    """Record a file that was uploaded through a presigned PUT URL."""
+    bucket_name = f"{user.username}-{bucket}"
+    bucket_entry = await get_bucket(db, user.id, bucket_name)
+    if not bucket_entry["exists"] or bucket_entry["id"] is None:
+        raise HTTPException(status_code=404, detail="Bucket not found")
+    try:
+        stat = await run_storage(client.stat_object, bucket_name, filename)
+    except Exception as e:
+        print("Upload complete error:", e)
+        raise HTTPException(status_code=404, detail="Uploaded object not found")
+    # The content was never seen by the API, so no sha256 is recorded for this version
+    new_file = await add_file_record(db, bucket_entry["id"], bucket_name, filename, stat.size, None, user.id)
+    return {"filename": filename, "status": "Upload successful", "file_id": new_file.id, "size": new_file.size}
+
+
+# Presigned GET / PUT URLs issued by the local storage driver point here
+
+def verify_local_presigned(method: str, bucket_name: str, object_name: str, expires: int, signature: str,
+                           disposition: Optional[str] = None):
+    verify = getattr(client, "verify_presigned", None)
+    if verify is None:
+        raise HTTPException(status_code=404, detail="Not found")
+    if not verify(method, bucket_name, object_name, expires, signature, disposition):
+        raise HTTPException(status_code=403, detail="Invalid or expired signature")
+
+
+@app.get("/storage/{bucket_name}/{object_name:path}")
+async def local_presigned_get(request: Request, bucket_name: str, object_name: str, expires: int, signature: str):
+    disposition = request.query_params.get("response-content-disposition")
+    verify_local_presigned("GET", bucket_name, object_name, expires, signature, disposition)
+    response = await serve_object(request, bucket_name, object_name)
+    if disposition and response.status_code != 304:
+        response.headers["Content-Disposition"] = disposition
+    return response
+
+
+@app.put("/storage/{bucket_name}/{object_name:path}")
+async def local_presigned_put(request: Request, bucket_name: str, object_name: str, expires: int, signature: str):
+    verify_local_presigned("PUT", bucket_name, object_name, expires, signature)
+    with tempfile.SpooledTemporaryFile(max_size=UPLOAD_PART_SIZE) as body:
+        async for chunk in request.stream():
+            await run_storage(body.write, chunk)
+        body.seek(0)
+        try:
+            await run_storage(
+                client.put_object, bucket_name, object_name, body, -1, part_size=UPLOAD_PART_SIZE,
+                content_type=request.headers.get("content-type", "application/octet-stream")
+            )
+        except Exception as e:
+            print("Upload error:", e)
+            raise HTTPException(status_code=404, detail="Upload failed")
+    return Response(status_code=200)
+
+
+async def resolve_object(bucket_name: str, filename: str):
+    """
+    Stat a file, following dedup pointers. Returns (storage bucket, object name, stat, content type);
+    the content type is the one the file was uploaded with, which blobs do not carry.
+    """
+    object_name = filename
+    try:
+        stat = await run_storage(client.stat_object, bucket_name, object_name)
+        content_type = stat.content_type
+        content_hash = pointer_target(stat)
+        if content_hash:
+            # Deduplicated file: the bytes live in the blob store under their hash
+            bucket_name, object_name = DEDUP_BUCKET, content_hash
+            stat = await run_storage(client.stat_object, bucket_name, object_name)
+    except Exception as e:
+        print("Download error:", e)
+        raise HTTPException(status_code=404, detail="Download failed")
+    return bucket_name, object_name, stat, content_type
+
+
+async def presigned_download_url(bucket_name: str, filename: str):
+    # The object is stat'ed to follow dedup pointers and to label compressed objects with their encoding
+    bucket_name, object_name, stat, _ = await resolve_object(bucket_name, filename)
+    response_headers = {"response-content-disposition": f'attachment; filename="{filename}"'}
+    codec, _ = stored_codec(stat)
+    if codec:
+        response_headers["response-content-encoding"] = codec
+    return presign_client.presigned_get_object(
+        bucket_name, object_name,
+        expires=timedelta(seconds=PRESIGN_EXPIRY),
+        response_headers=response_headers
+    )
+
+
+async def serve_object(request: Request, bucket_name: str, filename: str):
+    """
+    Stream an object back with ETag / Last-Modified validators, answering conditional
+    requests with 304 and single byte ranges with 206. Compressed objects are sent as stored
+    with Content-Encoding when the client accepts the codec, and decompressed otherwise.
+    """
+    bucket_name, object_name, stat, content_type = await resolve_object(bucket_name, filename)
+    codec, original_size = stored_codec(stat)
+    encoded = codec is not None and accepts_encoding(request.headers.get("accept-encoding"), codec)
+    decode = codec is not None and not encoded
+    size = original_size if decode else stat.size
+
+    # The encoded and decoded forms are different representations, so they get different ETags
+    etag = f'"{stat.etag}-{codec}"' if encoded else f'"{stat.etag}"'
+    headers = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": f'attachment; filename="{filename}"'
+    }
+    if stat.last_modified:
+        headers["Last-Modified"] = format_datetime(stat.last_modified, usegmt=True)
+    if codec:
+        headers["Vary"] = "Accept-Encoding"
+    if encoded:
+        headers["Content-Encoding"] = codec
+
+    if_none_match = request.headers.get("if-none-match")
+    if_modified_since = request.headers.get("if-modified-since")
+    if (if_none_match and etag_matches(if_none_match, etag)) or \
+            (not if_none_match and if_modified_since and not_modified_since(if_modified_since, stat.last_modified)):
+        headers.pop("Content-Disposition")
+        return Response(status_code=304, headers=headers)
+
+    byte_range = parse_range(request.headers.get("range"), size)
+    if_range = request.headers.get("if-range")
+    if byte_range and if_range and not (etag_matches(if_range, etag) if '"' in if_range
+                                        else not_modified_since(if_range, stat.last_modified)):
+        byte_range = None
+
+    status_code = 200
+    offset, length = 0, size
+    if byte_range:
+        start, end = byte_range
+        offset, length = start, end - start + 1
+        status_code = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(length)
+
+    if object_cache.cacheable(stat.size):
+        # Small objects are served whole from memory; ranges and decoding are applied to the cached body
+        body, cached = await read_small_object(bucket_name, object_name, stat.etag)
+        if decode:
+            body = await run_storage(decompress_bytes, body, codec)
+        body = body[offset:offset + length]
+        if cached:
+            object_cache.count_served(len(body))
+        return Response(body, status_code=status_code, media_type=content_type or "application/octet-stream",
+                        headers=headers)
 
     try:
-        file_data = client.get_object(bucket_name, filename)
+        if decode:
+            # Ranges of the decoded content are cut out while decompressing the whole object
+            file_data = await run_storage(client.get_object, bucket_name, object_name)
+        else:
+            file_data = await run_storage(client.get_object, bucket_name, object_name, offset=offset, length=length if byte_range else 0)
+    except Exception as e:
+        print("Download error:", e)
+        raise HTTPException(status_code=404, detail="Download failed")
+    if decode:
         return StreamingResponse(
-            file_data,
-            media_type="application/octet-stream",
-            headers={
-                "Content-Disposition": f'attachment; filename="{filename}"'
-            }
+            decompress_stream(stream_object(file_data), codec, offset, length),
+            status_code=status_code,
+            media_type=content_type or "application/octet-stream",
+            headers=headers
         )
+    return ObjectResponse(
+        file_data,
+        status_code=status_code,
+        media_type=content_type or "application/octet-stream",
+        headers=headers
+    )
+
+
+async def read_small_object(bucket_name: str, object_name: str, etag: str):
+    """
+    Body of a small object through object_cache, keyed by ETag so a replaced object is never served
+    stale. Returns (body, whether it came from the cache).
+    """
+    key = (bucket_name, object_name, etag)
+    body = object_cache.get(key)
+    if body is None and object_cache.on_disk(key):
+        body = await run_storage(object_cache.read_disk, key)
+    if body is not None:
+        return body, True
+    try:
+        body = await run_storage(read_object, bucket_name, object_name)
     except Exception as e:
         print("Download error:", e)
         raise HTTPException(status_code=404, detail="Download failed")
+    await run_storage(object_cache.put, key, body)
+    return body, False
+
+
+async def abort_bucket_uploads(db: AsyncSession, bucket_name: str, bucket_id: int):
+    uploads = (await db.execute(
+        select(MultipartUpload.upload_id, MultipartUpload.name).where(MultipartUpload.bucket_id == bucket_id)
+    )).all()
+    for upload_id, name in uploads:
+        try:
+            await run_storage(abort_multipart_upload, bucket_name, name, upload_id)
+        except Exception as e:
+            print("Abort multipart upload error:", e)
+    await db.execute(delete(MultipartUpload).where(MultipartUpload.bucket_id == bucket_id))
+    await db.commit()
+
+
+async def delete_file_rows(db: AsyncSession, *criteria):
+    """
+    Delete the Files rows matching criteria together with their versions, permissions and blob references.
+    Returns the number of permissions removed.
+    """
+    file_ids = select(Files.id).where(*criteria)
+    await release_blobs(db, *criteria)
+    await db.execute(delete(FileVersion).where(FileVersion.file_id.in_(file_ids)))
+    revoked = (await db.execute(delete(FilePermission).where(FilePermission.file_id.in_(file_ids)))).rowcount
+    await db.execute(delete(Files).where(*criteria))
+    return revoked
 
 
 @app.delete("/delete_bucket")
-def delete_bucket(bucket: str, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def delete_bucket(bucket: str, user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
     bucket_name = f"{user.username}-{bucket}"
-    if not client.bucket_exists(bucket_name):
+    bucket_entry = await get_bucket(db, user.id, bucket_name)
+    if not bucket_entry["exists"]:
         raise HTTPException(status_code=404, detail="Bucket not found")
-    client.remove_bucket(bucket_name)
-    bucket_obj = db.query(Bucket).filter(Bucket.name == bucket_name, Bucket.owner_id == user.id).first()
-    if bucket_obj:
+    await invalidate_bucket(user.id, bucket_name)
+    if bucket_entry["id"] is not None:
+        await abort_bucket_uploads(db, bucket_name, bucket_entry["id"])
+    # Empty the bucket first; MinIO refuses to remove a non-empty bucket
+    try:
+        failed = await purge_bucket(bucket_name)
+        if failed:
+            raise Exception(f"{len(failed)} objects could not be deleted")
+        await run_storage(client.remove_bucket, bucket_name)
+    except Exception as e:
+        print("Delete bucket error:", e)
+        # Requests during the purge may have re-cached the bucket as it was
+        await invalidate_bucket(user.id, bucket_name)
+        raise HTTPException(status_code=500, detail="Failed to delete bucket")
+    object_cache.invalidate(bucket_name)
+    if bucket_entry["id"] is not None:
         # Delete all files associated with the bucket
-        db.query(Files).filter(Files.bucket_id == bucket_obj.id).delete()
+        await delete_file_rows(db, Files.bucket_id == bucket_entry["id"])
         # Delete the bucket itself
-        db.delete(bucket_obj)
-        db.commit()
+        await db.execute(delete(Bucket).where(Bucket.id == bucket_entry["id"]))
+        await emit_event(db, user.id, "bucket.deleted", [{"bucket": bucket_name}])
+        await db.commit()
+    # Again after the commit: a request during the purge could re-cache {id, exists: True} for the
+    # registry TTL, and only now does a lookup find neither the bucket nor its row.
+    # Likewise for grants, so a concurrent check cannot re-cache a grant of a deleted file.
+    await invalidate_bucket(user.id, bucket_name)
+    forget_permissions(bucket_name)
+    if bucket_entry["id"] is not None and DEDUP_ENABLED:
+        await collect_garbage(db)
     return {"message": f"Bucket {bucket_name} deleted"}
 
 
 @app.delete("/delete_files")
-def delete_files(bucket:dict, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def delete_files(bucket:dict, user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
     bucket_name = f"{user.username}-{bucket['bucket']}"
-    if not client.bucket_exists(bucket_name):
+    bucket_entry = await get_bucket(db, user.id, bucket_name)
+    if not bucket_entry["exists"]:
         raise HTTPException(status_code=404, detail="Bucket not found")
     try:
-        filenames = json.loads(bucket['filename'])
-        bucket_obj = db.query(Bucket).filter(Bucket.name == bucket_name, Bucket.owner_id == user.id).first()
-        for file in filenames:
-            client.remove_object(bucket_name, str(file))
-            print(f"File {file} deleted from bucket {bucket_name}")
-            # Delete from database
-            if bucket_obj:
-                db.query(Files).filter(Files.name == str(file), Files.bucket_id == bucket_obj.id).delete()
-        db.commit()
-        return {"message": f"File {filenames} deleted from bucket {bucket_name}"}
+        filenames = [str(file) for file in json.loads(bucket['filename'])]
+        bucket_id = bucket_entry["id"]
+        failed = []
+        removed = []
+        revoked = 0
+        # One DeleteObjects request and one DELETE ... IN (...) per batch of keys
+        for batch in batched(filenames):
+            batch_failed = set(await run_storage(remove_objects, bucket_name, batch))
+            failed.extend(batch_failed)
+            deleted = [name for name in batch if name not in batch_failed]
+            removed.extend(deleted)
+            for name in deleted:
+                object_cache.invalidate(bucket_name, name)
+            if bucket_id and deleted:
+                revoked += await delete_file_rows(db, Files.bucket_id == bucket_id, Files.name.in_(deleted))
+            await emit_event(db, user.id, "file.deleted", [{"bucket": bucket_name, "filename": name} for name in deleted])
     except Exception as e:
         print("Delete file error:", e)
+        await db.rollback()
         raise HTTPException(status_code=404, detail="File not found")
+    # Drop the deleted files' grants so a later upload under the same name is not exposed.
+    # Raises its own 500 if the policy cannot be applied.
+    await commit_with_policies(db, {bucket_id: bucket_name} if revoked else {}, strict=False)
+    forget_permissions(bucket_name, removed)
+    if DEDUP_ENABLED:
+        # Logs its own errors; unreferenced blobs are collected by a later run
+        await collect_garbage(db)
+    if failed:
+        print(f"Delete file error: could not delete {failed} from bucket {bucket_name}")
+        raise HTTPException(status_code=500, detail=f"Failed to delete {failed}")
+    return {"message": f"File {filenames} deleted from bucket {bucket_name}"}
 
 
 @app.post("/share")
-def share_file(data: ShareFileRequest, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
+async def share_file(data: ShareFileRequest, db: AsyncSession = Depends(get_db), user: User = Depends(get_current_user)):
     # Find the file by name and bucket
     bucket_name = f"{user.username}-{data.bucket}"
-    file = db.query(Files).join(Bucket).filter(
-        Files.name == data.filename,
-        Bucket.name == bucket_name
-    ).first()
-    if not file:
+    row = (await db.execute(
+        select(Files, Bucket.owner_id).join(Bucket).where(
+            Files.name == data.filename,
+            Bucket.name == bucket_name
+        )
+    )).first()
+    if not row:
         raise HTTPException(status_code=404, detail="File not found")
-    if file.bucket.owner_id != user.id:
+    file, owner_id = row
+    if owner_id != user.id:
         raise HTTPException(status_code=403, detail="Not authorized to share this file")
 
-    # Check if file is already shared
-    existing_permission = db.query(FilePermission).filter(FilePermission.file_id == file.id).first()
-    if existing_permission:
-        raise HTTPException(status_code=400, detail="File has already been shared")
-
     # Find the shared user by username
-    shared_user = db.query(User).filter(User.username == data.shared_with_username).first()
+    shared_user = (await db.execute(
+        select(User).where(User.username == data.shared_with_username)
+    )).scalars().first()
     if not shared_user:
         raise HTTPException(status_code=404, detail="Shared user not found")
 
+    # Check if file is already shared with this user
+    existing_permission = (await db.execute(
+        select(FilePermission.id).where(
+            FilePermission.file_id == file.id,
+            FilePermission.shared_with_user_id == shared_user.id
+        )
+    )).first()
+    if existing_permission:
+        raise HTTPException(status_code=400, detail="File has already been shared")
+
     # Add permission in database
     permission = FilePermission(
         file_id=file.id,
@@ -186,68 +1086,202 @@ def share_file(data: ShareFileRequest, db: Session = Depends(get_db), user: User
         permission_type="read"
     )
     db.add(permission)
-    db.commit()
-
-    # Share in MinIO by creating a bucket policy for the specific shared user
-    object_name = file.name
-    policy = {
-        "Version": "2012-10-17",
-        "Statement": [
-            {
-                "Effect": "Allow",
-                "Principal": {"AWS": [f"arn:aws:iam::minio:user/{shared_user.username}"]},
-                "Action": ["s3:GetObject"],
-                "Resource": [f"arn:aws:s3:::{bucket_name}/{object_name}"]
-            }
-        ]
-    }
-    try:
-        client.set_bucket_policy(bucket_name, json.dumps(policy))
-    except Exception as e:
-        print("MinIO policy error:", e)
-        raise HTTPException(status_code=500, detail="Failed to set MinIO bucket policy")
+    await emit_event(db, user.id, "file.shared", [{
+        "bucket": bucket_name, "filename": file.name, "file_id": file.id, "shared_with": shared_user.username
+    }])
+    # Share in MinIO through the bucket policy, rebuilt from all of the bucket's permissions
+    await commit_with_policies(db, {file.bucket_id: bucket_name})
+    permission_cache.pop((shared_user.id, bucket_name, file.name))
 
     return {"message": "File shared successfully"}
 
 
+@app.post("/share_batch")
+async def share_files(data: BatchShareRequest, db: AsyncSession = Depends(get_db), user: User = Depends(get_current_user)):
+    """
+    Share many files with many users in one request. All grants are validated first, new ones are
+    written in one bulk insert, and each affected bucket's policy is rebuilt and applied once.
+    """
+    if not data.shares:
+        raise HTTPException(status_code=400, detail="No shares given")
+    if len(data.shares) > SHARE_BATCH_LIMIT:
+        raise HTTPException(status_code=400, detail=f"At most {SHARE_BATCH_LIMIT} shares per request")
+    wanted_files = {(f"{user.username}-{share.bucket}", share.filename) for share in data.shares}
+    usernames = {share.shared_with_username for share in data.shares}
+
+    # Only the caller's own buckets are searched, so files of other users are simply not found
+    files = {}
+    for batch in batched(wanted_files):
+        rows = (await db.execute(
+            select(Bucket.name, Files.name, Files.id, Bucket.id)
+            .join(Bucket, Bucket.id == Files.bucket_id)
+            .where(Bucket.owner_id == user.id, tuple_(Bucket.name, Files.name).in_(batch))
+        )).all()
+        files.update({(bucket_name, name): (file_id, bucket_id) for bucket_name, name, file_id, bucket_id in rows})
+    users = {}
+    for batch in batched(usernames):
+        users.update((await db.execute(select(User.username, User.id).where(User.username.in_(batch)))).all())
+    missing_files = sorted(f"{bucket_name}/{name}" for bucket_name, name in wanted_files - files.keys())
+    missing_users = sorted(usernames - users.keys())
+    if missing_files or missing_users:
+        raise HTTPException(status_code=404, detail={"missing_files": missing_files, "missing_users": missing_users})
+
+    grants = {}
+    for share in data.shares:
+        file_id, _ = files[(f"{user.username}-{share.bucket}", share.filename)]
+        grants[(file_id, users[share.shared_with_username], share.permission)] = share
+    added = await add_permissions(db, grants)
+    await emit_event(db, user.id, "file.shared", [
+        {"bucket": f"{user.username}-{grants[grant].bucket}", "filename": grants[grant].filename, "file_id": grant[0],
+         "shared_with": grants[grant].shared_with_username, "permission": grant[2]}
+        for grant in added
+    ])
+    added_files = {file_id for file_id, _, _ in added}
+    buckets = {bucket_id: bucket_name for (bucket_name, _), (file_id, bucket_id) in files.items() if file_id in added_files}
+    # Nothing is stored unless every affected bucket's policy could be applied
+    await commit_with_policies(db, buckets)
+    for share in (grants[grant] for grant in added):
+        permission_cache.pop((users[share.shared_with_username], f"{user.username}-{share.bucket}", share.filename))
+
+    return {"shared": len(added), "already_shared": len(grants) - len(added), "buckets": sorted(buckets.values())}
+
+
+SHARED_SORT_COLUMNS = {
+    "filename": Files.name,
+    "bucket": Bucket.name,
+    "size": Files.size,
+    "uploaded_at": Files.uploaded_at,
+}
+
+
 @app.get("/shared_with_me")
-def files_shared_with_me(user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    permissions = db.query(FilePermission).filter(FilePermission.shared_with_user_id == user.id).all()
-    shared_files = []
-    for perm in permissions:
-        file = db.query(Files).filter(Files.id == perm.file_id).first()
-        if file:
-            bucket = db.query(Bucket).filter(Bucket.id == file.bucket_id).first()
-            shared_files.append({
-                "filename": file.name,
-                "bucket": bucket.name if bucket else None,
-                "permission_type": perm.permission_type
-            })
-    return shared_files
+async def files_shared_with_me(
+    limit: int = Query(1000, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+    sort: str = Query("filename", pattern="^(filename|bucket|size|uploaded_at)$"),
+    order: str = Query("asc", pattern="^(asc|desc)$"),
+    user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    sort_column = SHARED_SORT_COLUMNS[sort]
+    rows = (await db.execute(
+        select(Files.name, Bucket.name, FilePermission.permission_type, Files.size, Files.uploaded_at)
+        .select_from(FilePermission)
+        .join(Files, Files.id == FilePermission.file_id)
+        .join(Bucket, Bucket.id == Files.bucket_id)
+        .where(FilePermission.shared_with_user_id == user.id)
+        .order_by(sort_column.desc() if order == "desc" else sort_column.asc(), FilePermission.id)
+        .limit(limit)
+        .offset(offset)
+    )).all()
+    return [
+        {
+            "filename": filename,
+            "bucket": bucket_name,
+            "permission_type": permission_type,
+            "size": size,
+            "uploaded_at": uploaded_at
+        }
+        for filename, bucket_name, permission_type, size, uploaded_at in rows
+    ]
+
+
+@app.get("/search")
+async def search_files(
+    prefix: Optional[str] = None,
+    contains: Optional[str] = None,
+    min_size: Optional[int] = Query(None, ge=0),
+    max_size: Optional[int] = Query(None, ge=0),
+    uploaded_after: Optional[datetime] = None,
+    uploaded_before: Optional[datetime] = None,
+    bucket: Optional[str] = None,
+    owner: Optional[str] = None,
+    shared_with: Optional[str] = None,
+    scope: str = Query("all", pattern="^(all|own|shared)$"),
+    sort: str = Query("filename", pattern="^(filename|size|uploaded_at)$"),
+    order: str = Query("asc", pattern="^(asc|desc)$"),
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Search file metadata across the caller's buckets and the files shared with them, without listing
+    the object store. bucket is the caller's own bucket name; pass next_cursor back for the next page.
+    """
+    after = decode_cursor(cursor, sort, order) if cursor else None
+    # Stored timestamps are naive UTC
+    uploaded_after, uploaded_before = (
+        value.astimezone(timezone.utc).replace(tzinfo=None) if value and value.tzinfo else value
+        for value in (uploaded_after, uploaded_before)
+    )
+    rows = (await db.execute(search_query(
+        user, scope=scope, prefix=prefix, contains=contains, min_size=min_size, max_size=max_size,
+        uploaded_after=uploaded_after, uploaded_before=uploaded_before,
+        bucket_name=f"{user.username}-{bucket}" if bucket else None, owner=owner, shared_with=shared_with,
+        sort=sort, order=order, after=after, limit=limit + 1
+    ))).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(sort, order, rows[-1])
+    return {"files": [row._asdict() for row in rows], "next_cursor": next_cursor}
+
+
+@app.post("/reconcile")
+async def reconcile(bucket: str, user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    """Re-sync one of the caller's buckets with the object store now instead of waiting for the background job."""
+    bucket_name = f"{user.username}-{bucket}"
+    bucket_entry = await get_bucket(db, user.id, bucket_name)
+    if not bucket_entry["exists"] or bucket_entry["id"] is None:
+        raise HTTPException(status_code=404, detail="Bucket not found")
+    added, removed = await reconcile_bucket(db, bucket_entry["id"], bucket_name)
+    return {"bucket": bucket_name, "added": added, "removed": removed}
 
 
 @app.get("/download_shared")
-def download_shared_file(bucket: str, filename: str, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    # Check if user has permission to access the file
-    bucket_obj = db.query(Bucket).filter(Bucket.name == bucket).first()
-    file = db.query(Files).filter(Files.name == filename, Files.bucket_id == bucket_obj.id).first() if bucket_obj else None
-    if not file:
-        raise HTTPException(status_code=404, detail="File not found")
-    permission = db.query(FilePermission).filter(
-        FilePermission.file_id == file.id,
-        FilePermission.shared_with_user_id == user.id
-    ).first()
-    if not permission:
+async def download_shared_file(request: Request, bucket: str, filename: str, redirect: bool = False,
+                               user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    await authorize_shared(db, user, bucket, filename)
+    if redirect:
+        return RedirectResponse(await presigned_download_url(bucket, filename), status_code=307)
+    return await serve_object(request, bucket, filename)
+
+
+@app.get("/presign/download_shared")
+async def presign_download_shared(bucket: str, filename: str, user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    await authorize_shared(db, user, bucket, filename)
+    return {"url": await presigned_download_url(bucket, filename), "expires_in": PRESIGN_EXPIRY}
+
+
+def forget_permissions(bucket_name: str, names=None):
+    """
+    Evict cached share decisions for files of bucket_name (all of them when names is None), so a
+    file deleted and re-created under the same name does not inherit the old file's grants.
+    """
+    names = None if names is None else set(names)
+    permission_cache.discard_where(lambda key: key[1] == bucket_name and (names is None or key[2] in names))
+
+
+async def authorize_shared(db: AsyncSession, user: User, bucket: str, filename: str):
+    """Raise 404 / 403 unless user has been granted access to the shared file."""
+    cache_key = (user.id, bucket, filename)
+    allowed = permission_cache.get(cache_key)
+    if allowed is None:
+        # One lookup: the file (404 if missing) outer-joined to this user's permission on it (403 if none)
+        rows = (await db.execute(
+            select(FilePermission.id)
+            .select_from(Files)
+            .join(Bucket, Bucket.id == Files.bucket_id)
+            .outerjoin(FilePermission, and_(
+                FilePermission.file_id == Files.id,
+                FilePermission.shared_with_user_id == user.id
+            ))
+            .where(Bucket.name == bucket, Files.name == filename)
+        )).scalars().all()
+        if not rows:
+            raise HTTPException(status_code=404, detail="File not found")
+        allowed = any(permission_id is not None for permission_id in rows)
+        permission_cache.set(cache_key, allowed)
+    if not allowed:
         raise HTTPException(status_code=403, detail="You do not have access to this file")
-    try:
-        file_data = client.get_object(bucket, filename)
-        return StreamingResponse(
-            file_data,
-            media_type="application/octet-stream",
-            headers={
-                "Content-Disposition": f'attachment; filename="{filename}"'
-            }
-        )
-    except Exception as e:
-        print("Download shared file error:", e)
-        raise HTTPException(status_code=404, detail="Download failed")
@@ -0,0 +1,201 @@
+"""
+Prometheus-format metrics for the API: request latency, in-flight requests and bytes moved per
+route, plus database query and MinIO call timings. Each request also accumulates a per-phase
+breakdown (db / storage / password hashing) used by the slow-request log.
+"""
+
+from contextvars import ContextVar
+from sqlalchemy import event
+import threading
+import time
+import os
+
+SLOW_REQUEST_SECONDS = float(os.getenv("SLOW_REQUEST_SECONDS", 0))
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class Metric:
+    def __init__(self, name, help, kind):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{escape_label(value)}"' for key, value in labels) + "}"
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Counter(Metric):
+    def __init__(self, name, help):
+        super().__init__(name, help, "counter")
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        with self.lock:
+            return self.header() + [f"{self.name}{format_labels(key)} {value}" for key, value in self.values.items()]
+
+
+class Gauge(Counter):
+    def __init__(self, name, help):
+        Metric.__init__(self, name, help, "gauge")
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, "histogram")
+        self.buckets = buckets
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            # [per-bucket counts..., sum, count]
+            series = self.values.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = self.header()
+        with self.lock:
+            for key, series in self.values.items():
+                for bound, bucket_count in zip(self.buckets, series):
+                    lines.append(f"{self.name}_bucket{format_labels(key + (('le', bound),))} {bucket_count}")
+                lines.append(f"{self.name}_bucket{format_labels(key + (('le', '+Inf'),))} {series[-1]}")
+                lines.append(f"{self.name}_sum{format_labels(key)} {series[-2]}")
+                lines.append(f"{self.name}_count{format_labels(key)} {series[-1]}")
+        return lines
+
+
+REQUESTS = Counter("http_requests_total", "HTTP requests by method, route and status.")
+REQUEST_LATENCY = Histogram("http_request_duration_seconds", "HTTP request latency by method and route.")
+IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP requests currently being served.")
+BYTES_UPLOADED = Counter("http_request_bytes_total", "Request body bytes received by route.")
+BYTES_DOWNLOADED = Counter("http_response_bytes_total", "Response body bytes sent by route.")
+DB_QUERIES = Counter("db_queries_total", "SQL statements executed.")
+DB_LATENCY = Histogram("db_query_duration_seconds", "SQL statement execution time.")
+STORAGE_CALLS = Counter("storage_calls_total", "MinIO client calls by operation.")
+STORAGE_LATENCY = Histogram("storage_call_duration_seconds", "MinIO client call time by operation.")
+PASSWORD_LATENCY = Histogram("password_hash_duration_seconds", "bcrypt hash/verify time by operation.")
+PASSWORD_REJECTED = Counter("password_hash_rejected_total", "bcrypt calls shed because the password pool queue was full.")
+
+ALL_METRICS = (
+    REQUESTS, REQUEST_LATENCY, IN_FLIGHT, BYTES_UPLOADED, BYTES_DOWNLOADED,
+    DB_QUERIES, DB_LATENCY, STORAGE_CALLS, STORAGE_LATENCY, PASSWORD_LATENCY,
+    PASSWORD_REJECTED,
+)
+
+
+def render_metrics():
+    lines = []
+    for metric in ALL_METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# Per-request phase breakdown, e.g. {"db": [count, seconds], "storage": [count, seconds]}
+request_phases = ContextVar("request_phases", default=None)
+
+
+def record_phase(phase, seconds):
+    phases = request_phases.get()
+    if phases is not None:
+        entry = phases.setdefault(phase, [0, 0.0])
+        entry[0] += 1
+        entry[1] += seconds
+
+
+def record_storage_call(operation, seconds):
+    STORAGE_CALLS.inc(operation=operation)
+    STORAGE_LATENCY.observe(seconds, operation=operation)
+    record_phase("storage", seconds)
+
+
+def record_password_call(operation, seconds):
+    PASSWORD_LATENCY.observe(seconds, operation=operation)
+    record_phase("password", seconds)
+
+
+def record_password_rejected(operation):
+    PASSWORD_REJECTED.inc(operation=operation)
+
+
+def instrument_engine(engine):
+    """Count and time every statement executed through a (sync) SQLAlchemy engine."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        DB_QUERIES.inc()
+        DB_LATENCY.observe(elapsed)
+        record_phase("db", elapsed)
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware, so streamed request and response bodies are counted without buffering."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        phases = {}
+        token = request_phases.set(phases)
+        counts = {"in": 0, "out": 0, "status": 500}
+
+        async def counting_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                counts["in"] += len(message.get("body", b""))
+            return message
+
+        async def counting_send(message):
+            if message["type"] == "http.response.start":
+                counts["status"] = message["status"]
+            elif message["type"] == "http.response.body":
+                counts["out"] += len(message.get("body", b""))
+            await send(message)
+
+        IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            elapsed = time.perf_counter() - start
+            IN_FLIGHT.dec()
+            request_phases.reset(token)
+            route = scope.get("route")
+            path = getattr(route, "path", "unmatched")
+            method = scope["method"]
+            REQUESTS.inc(method=method, route=path, status=counts["status"])
+            REQUEST_LATENCY.observe(elapsed, method=method, route=path)
+            BYTES_UPLOADED.inc(counts["in"], route=path)
+            BYTES_DOWNLOADED.inc(counts["out"], route=path)
+            if SLOW_REQUEST_SECONDS and elapsed >= SLOW_REQUEST_SECONDS:
+                breakdown = ", ".join(f"{phase}={count} calls/{seconds:.3f}s" for phase, (count, seconds) in phases.items())
+                print(f"Slow request: {method} {scope['path']} {counts['status']} took {elapsed:.3f}s ({breakdown or 'no I/O recorded'})")
@@ -0,0 +1,86 @@
+"""Baseline schema: users, buckets, files, permissions and versions
+
+Revision ID: 0001_baseline
+Revises:
+Create Date: 2026-10-17
+
+Databases created by the old startup-time create_all already have these tables; they are
+left as they are, so `alembic upgrade head` adopts such a database without a manual stamp.
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0001_baseline"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    existing = set(sa.inspect(op.get_bind()).get_table_names())
+
+    if "users" not in existing:
+        op.create_table(
+            "users",
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("username", sa.String),
+            sa.Column("hashed_password", sa.String),
+        )
+        op.create_index("ix_users_id", "users", ["id"])
+        op.create_index("ix_users_username", "users", ["username"], unique=True)
+
+    if "buckets" not in existing:
+        op.create_table(
+            "buckets",
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("name", sa.String),
+            sa.Column("owner_id", sa.Integer, sa.ForeignKey("users.id")),
+            sa.Column("created_at", sa.DateTime),
+        )
+        op.create_index("ix_buckets_id", "buckets", ["id"])
+        op.create_index("ix_buckets_name", "buckets", ["name"], unique=True)
+
+    if "files" not in existing:
+        op.create_table(
+            "files",
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("name", sa.String),
+            sa.Column("bucket_id", sa.Integer, sa.ForeignKey("buckets.id")),
+            sa.Column("size", sa.Integer),
+            sa.Column("access_type", sa.Enum("public", "private", name="accesstype")),
+            sa.Column("uploaded_at", sa.DateTime),
+            sa.Column("locked_by_user_id", sa.Integer, sa.ForeignKey("users.id"), nullable=True),
+        )
+        op.create_index("ix_files_id", "files", ["id"])
+
+    if "file_permissions" not in existing:
+        op.create_table(
+            "file_permissions",
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("file_id", sa.Integer, sa.ForeignKey("files.id")),
+            sa.Column("shared_with_user_id", sa.Integer, sa.ForeignKey("users.id")),
+            sa.Column("permission_type", sa.Enum("read", "write", name="permissiontype")),
+        )
+        op.create_index("ix_file_permissions_id", "file_permissions", ["id"])
+
+    if "file_versions" not in existing:
+        op.create_table(
+            "file_versions",
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("file_id", sa.Integer, sa.ForeignKey("files.id")),
+            sa.Column("user_id", sa.Integer, sa.ForeignKey("users.id")),
+            sa.Column("timestamp", sa.DateTime),
+            sa.Column("content_hash", sa.String),
+        )
+        op.create_index("ix_file_versions_id", "file_versions", ["id"])
+
+
+def downgrade():
+    op.drop_table("file_versions")
+    op.drop_table("file_permissions")
+    op.drop_table("files")
+    op.drop_table("buckets")
+    op.drop_table("users")
+    sa.Enum(name="permissiontype").drop(op.get_bind(), checkfirst=True)
+    sa.Enum(name="accesstype").drop(op.get_bind(), checkfirst=True)
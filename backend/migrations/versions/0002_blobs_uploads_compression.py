@@ -0,0 +1,63 @@
+"""Dedup blobs, multipart upload tracking and per-bucket compression
+
+Revision ID: 0002_blobs_uploads_compression
+Revises: 0001_baseline
+Create Date: 2026-10-17
+
+These tables and columns may already exist where create_all ran with newer models, so each
+one is only added when missing.
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0002_blobs_uploads_compression"
+down_revision = "0001_baseline"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    existing = set(inspector.get_table_names())
+
+    if "blobs" not in existing:
+        op.create_table(
+            "blobs",
+            sa.Column("hash", sa.String, primary_key=True),
+            sa.Column("size", sa.Integer),
+            sa.Column("refcount", sa.Integer, nullable=False, server_default="0"),
+            sa.Column("created_at", sa.DateTime),
+        )
+
+    if "blob_hash" not in {column["name"] for column in inspector.get_columns("files")}:
+        with op.batch_alter_table("files") as batch:
+            batch.add_column(sa.Column("blob_hash", sa.String, nullable=True))
+            batch.create_foreign_key("fk_files_blob_hash_blobs", "blobs", ["blob_hash"], ["hash"])
+
+    if "multipart_uploads" not in existing:
+        op.create_table(
+            "multipart_uploads",
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("upload_id", sa.String),
+            sa.Column("bucket_id", sa.Integer, sa.ForeignKey("buckets.id")),
+            sa.Column("name", sa.String),
+            sa.Column("user_id", sa.Integer, sa.ForeignKey("users.id")),
+            sa.Column("content_type", sa.String),
+            sa.Column("created_at", sa.DateTime),
+        )
+        op.create_index("ix_multipart_uploads_id", "multipart_uploads", ["id"])
+        op.create_index("ix_multipart_uploads_upload_id", "multipart_uploads", ["upload_id"], unique=True)
+        op.create_index("ix_multipart_uploads_created_at", "multipart_uploads", ["created_at"])
+
+    if "compression" not in {column["name"] for column in inspector.get_columns("buckets")}:
+        op.add_column("buckets", sa.Column("compression", sa.String, nullable=True))
+
+
+def downgrade():
+    op.drop_column("buckets", "compression")
+    op.drop_table("multipart_uploads")
+    with op.batch_alter_table("files") as batch:
+        batch.drop_constraint("fk_files_blob_hash_blobs", type_="foreignkey")
+        batch.drop_column("blob_hash")
+    op.drop_table("blobs")
@@ -0,0 +1,60 @@
+"""Unique (bucket_id, name) on files and indexes for the hot lookups
+
+Revision ID: 0003_file_lookup_indexes
+Revises: 0002_blobs_uploads_compression
+Create Date: 2026-10-17
+
+Repeated uploads used to insert a new files row each time. Before the unique constraint is
+added, every (bucket_id, name) group is collapsed onto its newest row: versions and permissions
+move to that row, duplicate permissions are dropped, and blob references held by the removed
+rows are released.
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0003_file_lookup_indexes"
+down_revision = "0002_blobs_uploads_compression"
+branch_labels = None
+depends_on = None
+
+KEPT = "SELECT MAX(id) FROM files GROUP BY bucket_id, name"
+# Newest row with the same (bucket_id, name) as the row referenced by {table}.file_id
+SURVIVOR = """
+    (SELECT MAX(kept.id) FROM files kept, files dropped
+     WHERE dropped.id = {table}.file_id AND kept.bucket_id = dropped.bucket_id AND kept.name = dropped.name)
+"""
+
+
+def upgrade():
+    for table in ("file_versions", "file_permissions"):
+        op.execute(
+            f"UPDATE {table} SET file_id = {SURVIVOR.format(table=table)} "
+            f"WHERE file_id IN (SELECT id FROM files WHERE id NOT IN ({KEPT}))"
+        )
+    op.execute(
+        "DELETE FROM file_permissions WHERE id NOT IN "
+        "(SELECT MIN(id) FROM file_permissions GROUP BY file_id, shared_with_user_id)"
+    )
+    op.execute(
+        "UPDATE blobs SET refcount = refcount - "
+        f"(SELECT COUNT(*) FROM files WHERE files.blob_hash = blobs.hash AND files.id NOT IN ({KEPT}))"
+    )
+    op.execute(f"DELETE FROM files WHERE id NOT IN ({KEPT})")
+
+    with op.batch_alter_table("files") as batch:
+        batch.create_unique_constraint("uq_files_bucket_id_name", ["bucket_id", "name"])
+    op.create_index("ix_files_blob_hash", "files", ["blob_hash"])
+    op.create_index("ix_file_permissions_shared_with_user_id", "file_permissions", ["shared_with_user_id"])
+    op.create_index("ix_file_permissions_file_id_shared_with_user_id", "file_permissions",
+                    ["file_id", "shared_with_user_id"])
+    op.create_index("ix_file_versions_file_id", "file_versions", ["file_id"])
+
+
+def downgrade():
+    op.drop_index("ix_file_versions_file_id", "file_versions")
+    op.drop_index("ix_file_permissions_file_id_shared_with_user_id", "file_permissions")
+    op.drop_index("ix_file_permissions_shared_with_user_id", "file_permissions")
+    op.drop_index("ix_files_blob_hash", "files")
+    with op.batch_alter_table("files") as batch:
+        batch.drop_constraint("uq_files_bucket_id_name", type_="unique")
@@ -0,0 +1,54 @@
+"""Webhooks and the event outbox
+
+Revision ID: 0004_webhooks_outbox
+Revises: 0003_file_lookup_indexes
+Create Date: 2026-10-17
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0004_webhooks_outbox"
+down_revision = "0003_file_lookup_indexes"
+branch_labels = None
+depends_on = None
+
+PENDING = sa.text("delivered_at IS NULL AND failed_at IS NULL")
+
+
+def upgrade():
+    op.create_table(
+        "webhooks",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("user_id", sa.Integer, sa.ForeignKey("users.id")),
+        sa.Column("url", sa.String, nullable=False),
+        sa.Column("secret", sa.String, nullable=False),
+        sa.Column("events", sa.String, nullable=True),
+        sa.Column("active", sa.Boolean, nullable=False),
+        sa.Column("created_at", sa.DateTime),
+    )
+    op.create_index("ix_webhooks_id", "webhooks", ["id"])
+    op.create_index("ix_webhooks_user_id", "webhooks", ["user_id"])
+
+    op.create_table(
+        "event_outbox",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("webhook_id", sa.Integer, sa.ForeignKey("webhooks.id")),
+        sa.Column("event_type", sa.String, nullable=False),
+        sa.Column("payload", sa.Text, nullable=False),
+        sa.Column("attempts", sa.Integer, nullable=False),
+        sa.Column("next_attempt_at", sa.DateTime, nullable=False),
+        sa.Column("delivered_at", sa.DateTime, nullable=True),
+        sa.Column("failed_at", sa.DateTime, nullable=True),
+        sa.Column("last_error", sa.String, nullable=True),
+        sa.Column("created_at", sa.DateTime),
+    )
+    op.create_index("ix_event_outbox_webhook_id", "event_outbox", ["webhook_id"])
+    op.create_index("ix_event_outbox_created_at", "event_outbox", ["created_at"])
+    op.create_index("ix_event_outbox_pending", "event_outbox", ["next_attempt_at"],
+                    postgresql_where=PENDING, sqlite_where=PENDING)
+
+
+def downgrade():
+    op.drop_table("event_outbox")
+    op.drop_table("webhooks")
@@ -0,0 +1,37 @@
+"""Indexes for metadata search
+
+Revision ID: 0005_search_indexes
+Revises: 0004_webhooks_outbox
+Create Date: 2026-10-17
+
+On Postgres the indexes are built CONCURRENTLY, outside a transaction, so uploads keep writing to
+files while they build. The trigram index needs the pg_trgm extension; elsewhere it is a plain index.
+"""
+
+from alembic import op
+
+revision = "0005_search_indexes"
+down_revision = "0004_webhooks_outbox"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    postgresql = op.get_bind().dialect.name == "postgresql"
+    if postgresql:
+        op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    with op.get_context().autocommit_block():
+        op.create_index("ix_files_name_trgm", "files", ["name"], postgresql_using="gin",
+                        postgresql_ops={"name": "gin_trgm_ops"}, postgresql_concurrently=True)
+        op.create_index("ix_files_name_id", "files", ["name", "id"], postgresql_concurrently=True)
+        op.create_index("ix_files_size_id", "files", ["size", "id"], postgresql_concurrently=True)
+        op.create_index("ix_files_uploaded_at_id", "files", ["uploaded_at", "id"], postgresql_concurrently=True)
+        op.create_index("ix_buckets_owner_id", "buckets", ["owner_id"], postgresql_concurrently=True)
+
+
+def downgrade():
+    op.drop_index("ix_buckets_owner_id", "buckets")
+    op.drop_index("ix_files_uploaded_at_id", "files")
+    op.drop_index("ix_files_size_id", "files")
+    op.drop_index("ix_files_name_id", "files")
+    op.drop_index("ix_files_name_trgm", "files")
@@ -0,0 +1,29 @@
+"""Last part activity on multipart uploads
+
+Revision ID: 0006_multipart_activity
+Revises: 0005_search_indexes
+Create Date: 2026-10-18
+
+The stale-upload sweep now goes by the time of the last part rather than the start of the upload,
+so a slow upload that is still sending parts is not aborted. Existing uploads start from created_at.
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0006_multipart_activity"
+down_revision = "0005_search_indexes"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("multipart_uploads", sa.Column("last_activity_at", sa.DateTime))
+    op.execute("UPDATE multipart_uploads SET last_activity_at = created_at")
+    op.create_index("ix_multipart_uploads_last_activity_at", "multipart_uploads", ["last_activity_at"])
+
+
+def downgrade():
+    op.drop_index("ix_multipart_uploads_last_activity_at", "multipart_uploads")
+    with op.batch_alter_table("multipart_uploads") as batch:
+        batch.drop_column("last_activity_at")
@@ -1,9 +1,242 @@
 from minio import Minio
+from minio.deleteobjects import DeleteObject
+from minio.datatypes import Part
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from datetime import timedelta
+from itertools import islice
+from typing import Protocol
+from starlette.responses import StreamingResponse
+import asyncio
+import time
 import os
+from metrics import record_storage_call
+from local_storage import LocalStorageClient
+from cache import ObjectCache
 
-client = Minio(
-    "minio:9000",
-    access_key="minioadmin",
-    secret_key="minioadmin",
-    secure=False
+
+class StorageDriver(Protocol):
+    """
+    The storage interface the service codes against. It is the subset of the MinIO client API
+    in use, so a Minio instance is a driver as is; LocalStorageClient is the filesystem driver.
+    get_object takes offset / length for ranged reads and returns a response with read(),
+    close() and release_conn(). The multipart primitives are wrapped at the end of this module.
+    """
+
+    def bucket_exists(self, bucket_name): ...
+    def make_bucket(self, bucket_name): ...
+    def remove_bucket(self, bucket_name): ...
+    def put_object(self, bucket_name, object_name, data, length, content_type="application/octet-stream",
+                   metadata=None, part_size=0): ...
+    def get_object(self, bucket_name, object_name, offset=0, length=0): ...
+    def stat_object(self, bucket_name, object_name): ...
+    def list_objects(self, bucket_name, prefix=None, recursive=False, start_after=None): ...
+    def remove_objects(self, bucket_name, delete_object_list): ...
+    def set_bucket_policy(self, bucket_name, policy): ...
+    def get_bucket_policy(self, bucket_name): ...
+    def delete_bucket_policy(self, bucket_name): ...
+    def presigned_get_object(self, bucket_name, object_name, expires, response_headers=None): ...
+    def presigned_put_object(self, bucket_name, object_name, expires): ...
+
+
+# "minio" (default) or "local", which keeps objects under LOCAL_STORAGE_ROOT on this node
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "minio")
+PRESIGN_EXPIRY = int(os.getenv("PRESIGN_EXPIRY", 900))
+
+client: StorageDriver
+presign_client: StorageDriver
+if STORAGE_BACKEND == "local":
+    client = LocalStorageClient(os.getenv("LOCAL_STORAGE_ROOT", "/data"))
+    # Presigned URLs point at the API's own /storage routes
+    presign_client = client
+else:
+    client = Minio(
+        "minio:9000",
+        access_key="minioadmin",
+        secret_key="minioadmin",
+        secure=False
+    )
+
+    # Presigned URLs are handed to clients, so they are signed for the endpoint clients can reach.
+    # Setting the region keeps presigning offline (no bucket-location lookup).
+    presign_client = Minio(
+        os.getenv("MINIO_PUBLIC_ENDPOINT", "localhost:9000"),
+        access_key="minioadmin",
+        secret_key="minioadmin",
+        secure=os.getenv("MINIO_PUBLIC_SECURE", "false").lower() in ("1", "true", "yes"),
+        region=os.getenv("MINIO_REGION", "us-east-1")
+    )
+
+# Part size used for streamed (unknown length) multipart uploads. MinIO requires at least 5 MiB.
+UPLOAD_PART_SIZE = max(int(os.getenv("UPLOAD_PART_SIZE", 10 * 1024 * 1024)), 5 * 1024 * 1024)
+DOWNLOAD_CHUNK_SIZE = int(os.getenv("DOWNLOAD_CHUNK_SIZE", 1024 * 1024))
+
+# Read-through cache for small downloads (see cache.ObjectCache). OBJECT_CACHE_SIZE=0 disables it;
+# OBJECT_CACHE_DIR with OBJECT_CACHE_DISK_SIZE adds a local-disk tier behind the memory one.
+object_cache = ObjectCache(
+    max_bytes=int(os.getenv("OBJECT_CACHE_SIZE", 64 * 1024 * 1024)),
+    max_object_size=int(os.getenv("OBJECT_CACHE_MAX_OBJECT_SIZE", 256 * 1024)),
+    disk_dir=os.getenv("OBJECT_CACHE_DIR") or None,
+    disk_bytes=int(os.getenv("OBJECT_CACHE_DISK_SIZE", 1024 * 1024 * 1024)),
 )
+
+# Resumable uploads: largest accepted part, and when an unfinished upload is considered abandoned
+MULTIPART_MAX_PART_SIZE = int(os.getenv("MULTIPART_MAX_PART_SIZE", 64 * 1024 * 1024))
+# S3 rejects completing an upload whose parts, other than the last, are smaller than this
+MULTIPART_MIN_PART_SIZE = 5 * 1024 * 1024
+MULTIPART_STALE_AFTER = int(os.getenv("MULTIPART_STALE_AFTER", 24 * 3600))
+MULTIPART_SWEEP_INTERVAL = int(os.getenv("MULTIPART_SWEEP_INTERVAL", 3600))
+
+# The MinIO SDK is blocking. Its calls run on a dedicated pool so slow transfers cannot
+# starve Starlette's shared threadpool or the event loop.
+STORAGE_WORKERS = int(os.getenv("STORAGE_WORKERS", 64))
+storage_executor = ThreadPoolExecutor(max_workers=STORAGE_WORKERS, thread_name_prefix="storage")
+
+# S3 DeleteObjects accepts at most 1000 keys per request
+DELETE_BATCH_SIZE = 1000
+PURGE_CONCURRENCY = int(os.getenv("PURGE_CONCURRENCY", 8))
+
+
+async def run_storage(func, *args, **kwargs):
+    """Run a blocking storage call on the storage executor and await its result."""
+    loop = asyncio.get_running_loop()
+    start = time.perf_counter()
+    try:
+        return await loop.run_in_executor(storage_executor, partial(func, *args, **kwargs))
+    finally:
+        record_storage_call(getattr(func, "__name__", "call"), time.perf_counter() - start)
+
+
+async def stream_object(response, chunk_size=DOWNLOAD_CHUNK_SIZE):
+    """Async iterator over a get_object response that reads each chunk on the storage executor."""
+    try:
+        while True:
+            chunk = await run_storage(response.read, chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        response.close()
+        response.release_conn()
+
+
+def read_object(bucket_name, object_name):
+    """Whole body of a (small) object in one blocking call."""
+    response = client.get_object(bucket_name, object_name)
+    try:
+        return response.read()
+    finally:
+        response.close()
+        response.release_conn()
+
+
+class ObjectResponse(StreamingResponse):
+    """
+    Streams a get_object response. When the object is a whole local file and the server supports
+    the ASGI pathsend extension, the path is handed to the server instead so it can use sendfile.
+    """
+
+    def __init__(self, file_data, **kwargs):
+        super().__init__(stream_object(file_data), **kwargs)
+        self.file_data = file_data
+
+    async def __call__(self, scope, receive, send):
+        if getattr(self.file_data, "full", False) and "http.response.pathsend" in scope.get("extensions", {}):
+            self.file_data.close()
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            await send({"type": "http.response.pathsend", "path": self.file_data.path})
+            return
+        await super().__call__(scope, receive, send)
+
+
+def remove_objects(bucket_name, names):
+    """Delete up to DELETE_BATCH_SIZE objects in one request. Returns the names that failed."""
+    errors = client.remove_objects(bucket_name, [DeleteObject(name) for name in names])
+    return [error.name for error in errors]
+
+
+def batched(iterable, size=DELETE_BATCH_SIZE):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+async def iter_object_names(bucket_name, prefix=None):
+    """Async iterator over every object name under prefix, listed a page at a time on the storage executor."""
+    pages = batched(obj.object_name for obj in client.list_objects(bucket_name, prefix=prefix, recursive=True))
+    while (page := await run_storage(next, pages, None)) is not None:
+        for name in page:
+            yield name
+
+
+async def purge_bucket(bucket_name):
+    """
+    Delete every object in a bucket, paging through the listing and keeping up to
+    PURGE_CONCURRENCY DeleteObjects requests in flight. Returns the names that failed.
+    """
+    pages = batched(obj.object_name for obj in client.list_objects(bucket_name, recursive=True))
+    semaphore = asyncio.Semaphore(PURGE_CONCURRENCY)
+    tasks = []
+
+    async def remove_page(page):
+        try:
+            return await run_storage(remove_objects, bucket_name, page)
+        finally:
+            semaphore.release()
+
+    while True:
+        await semaphore.acquire()
+        page = await run_storage(next, pages, None)
+        if page is None:
+            semaphore.release()
+            break
+        tasks.append(asyncio.create_task(remove_page(page)))
+
+    failed = []
+    for result in await asyncio.gather(*tasks):
+        failed.extend(result)
+    return failed
+
+
+# S3 multipart primitives for the resumable upload API. The MinIO SDK only exposes them as
+# private methods of the client, so they are wrapped here in one place.
+
+def create_multipart_upload(bucket_name, object_name, content_type):
+    return client._create_multipart_upload(bucket_name, object_name, {"Content-Type": content_type})
+
+
+def upload_part(bucket_name, object_name, upload_id, part_number, data, length):
+    """Upload one part of length bytes streamed from the file object data, and return its ETag."""
+    if not isinstance(client, Minio):
+        return client._upload_part(bucket_name, object_name, data, None, upload_id, part_number)
+    # The SDK signs the payload hash, so _upload_part needs the whole part in memory. A presigned
+    # request is UNSIGNED-PAYLOAD and lets the body stream from the file instead.
+    url = client.get_presigned_url(
+        "PUT", bucket_name, object_name, expires=timedelta(hours=1),
+        extra_query_params={"partNumber": str(part_number), "uploadId": upload_id},
+    )
+    response = client._http.urlopen("PUT", url, body=data, headers={"Content-Length": str(length)})
+    if response.status != 200:
+        raise Exception(f"UploadPart failed with HTTP {response.status}: {response.data[:500]!r}")
+    return response.headers["ETag"].strip('"')
+
+
+def list_parts(bucket_name, object_name, upload_id):
+    parts, marker = [], None
+    while True:
+        result = client._list_parts(bucket_name, object_name, upload_id, part_number_marker=marker)
+        parts.extend(result.parts)
+        if not result.is_truncated:
+            return parts
+        marker = result.next_part_number_marker
+
+
+def complete_multipart_upload(bucket_name, object_name, upload_id, parts):
+    parts = sorted(parts, key=lambda part: part.part_number)
+    return client._complete_multipart_upload(
+        bucket_name, object_name, upload_id, [Part(part.part_number, part.etag) for part in parts]
+    )
+
+
+def abort_multipart_upload(bucket_name, object_name, upload_id):
+    client._abort_multipart_upload(bucket_name, object_name, upload_id)
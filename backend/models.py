@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Enum, Boolean
+from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime, Enum, Boolean, UniqueConstraint, Index, text
 from sqlalchemy.orm import relationship
 from database import Base
 import enum
@@ -27,14 +27,27 @@ class Bucket(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, unique=True, index=True)
-    owner_id = Column(Integer, ForeignKey("users.id"))
+    owner_id = Column(Integer, ForeignKey("users.id"), index=True)
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    # Codec used to compress compressible uploads ("gzip" / "zstd"), or None to store them as-is
+    compression = Column(String, nullable=True)
 
     owner = relationship("User", back_populates="buckets")
     files = relationship("Files", back_populates="bucket")
 
+# The schema is managed by the Alembic migrations in migrations/; keep both in step.
+
 class Files(Base):
     __tablename__ = "files"
+    # One row per object; repeated uploads update it in place (see main.add_file_record)
+    __table_args__ = (
+        UniqueConstraint("bucket_id", "name", name="uq_files_bucket_id_name"),
+        # Metadata search (see search.py): name substrings through pg_trgm, keyset ordering through (column, id)
+        Index("ix_files_name_trgm", "name", postgresql_using="gin", postgresql_ops={"name": "gin_trgm_ops"}),
+        Index("ix_files_name_id", "name", "id"),
+        Index("ix_files_size_id", "size", "id"),
+        Index("ix_files_uploaded_at_id", "uploaded_at", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String)
@@ -43,17 +56,27 @@ class Files(Base):
     access_type = Column(Enum(AccessType))
     uploaded_at = Column(DateTime, default=datetime.datetime.utcnow)
     locked_by_user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    blob_hash = Column(String, ForeignKey("blobs.hash"), nullable=True, index=True)
 
     bucket = relationship("Bucket", back_populates="files")
     permissions = relationship("FilePermission", back_populates="file")
     versions = relationship("FileVersion", back_populates="file")
 
+class Blob(Base):
+    __tablename__ = "blobs"
+
+    hash = Column(String, primary_key=True)
+    size = Column(Integer)
+    refcount = Column(Integer, default=0, nullable=False)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
 class FilePermission(Base):
     __tablename__ = "file_permissions"
+    __table_args__ = (Index("ix_file_permissions_file_id_shared_with_user_id", "file_id", "shared_with_user_id"),)
 
     id = Column(Integer, primary_key=True, index=True)
     file_id = Column(Integer, ForeignKey("files.id"))
-    shared_with_user_id = Column(Integer, ForeignKey("users.id"))
+    shared_with_user_id = Column(Integer, ForeignKey("users.id"), index=True)
     permission_type = Column(Enum(PermissionType))
 
     file = relationship("Files", back_populates="permissions")
@@ -63,9 +86,55 @@ class FileVersion(Base):
     __tablename__ = "file_versions"
 
     id = Column(Integer, primary_key=True, index=True)
-    file_id = Column(Integer, ForeignKey("files.id"))
+    file_id = Column(Integer, ForeignKey("files.id"), index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
     timestamp = Column(DateTime, default=datetime.datetime.utcnow)
     content_hash = Column(String)
 
     file = relationship("Files", back_populates="versions")
+
+class MultipartUpload(Base):
+    __tablename__ = "multipart_uploads"
+
+    id = Column(Integer, primary_key=True, index=True)
+    upload_id = Column(String, unique=True, index=True)
+    bucket_id = Column(Integer, ForeignKey("buckets.id"))
+    name = Column(String)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    content_type = Column(String)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow, index=True)
+    # Start of the last part upload; the stale-upload sweep goes by this
+    last_activity_at = Column(DateTime, default=datetime.datetime.utcnow, index=True)
+
+class Webhook(Base):
+    __tablename__ = "webhooks"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    url = Column(String, nullable=False)
+    secret = Column(String, nullable=False)
+    # Comma-separated event types, or None for all events
+    events = Column(String, nullable=True)
+    active = Column(Boolean, default=True, nullable=False)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+class EventOutbox(Base):
+    """One pending / delivered webhook delivery, written in the transaction that caused the event."""
+    __tablename__ = "event_outbox"
+    __table_args__ = (
+        # Only undelivered rows are scanned by the dispatcher
+        Index("ix_event_outbox_pending", "next_attempt_at",
+              postgresql_where=text("delivered_at IS NULL AND failed_at IS NULL"),
+              sqlite_where=text("delivered_at IS NULL AND failed_at IS NULL")),
+    )
+
+    id = Column(Integer, primary_key=True)
+    webhook_id = Column(Integer, ForeignKey("webhooks.id"), index=True)
+    event_type = Column(String, nullable=False)
+    payload = Column(Text, nullable=False)
+    attempts = Column(Integer, default=0, nullable=False)
+    next_attempt_at = Column(DateTime, nullable=False)
+    delivered_at = Column(DateTime, nullable=True)
+    failed_at = Column(DateTime, nullable=True)
+    last_error = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow, index=True)
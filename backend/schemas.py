@@ -1,10 +1,21 @@
 from pydantic import BaseModel
+from typing import Optional, List
+from models import PermissionType
 
 class ShareFileRequest(BaseModel):
     filename: str
     bucket: str
     shared_with_username: str
 
+class ShareGrant(BaseModel):
+    bucket: str
+    filename: str
+    shared_with_username: str
+    permission: PermissionType = PermissionType.read
+
+class BatchShareRequest(BaseModel):
+    shares: List[ShareGrant]
+
 class UserCreate(BaseModel):
     username: str
     password: str
@@ -12,3 +23,14 @@ class UserCreate(BaseModel):
 class Token(BaseModel):
     access_token: str
     token_type: str
+    refresh_token: Optional[str] = None
+    expires_in: Optional[int] = None
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
+class WebhookCreate(BaseModel):
+    url: str
+    # None subscribes to every event type
+    events: Optional[List[str]] = None
+    secret: Optional[str] = None
\ No newline at end of file
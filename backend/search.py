@@ -0,0 +1,106 @@
+"""
+Metadata search over the Files table, across the caller's buckets and the files shared with them.
+Results are ordered by (sort column, id) and paged with a keyset cursor, so each page is an index
+range scan however deep the client pages. Name substring matches use the pg_trgm index on
+Postgres. The table is kept in step with the object store by the reconciliation job in main.
+"""
+
+from sqlalchemy import select, or_, and_, tuple_
+from sqlalchemy.orm import aliased
+from fastapi import HTTPException
+from models import Files, Bucket, FilePermission, User
+from utilities import encode_continuation_token, decode_continuation_token
+from datetime import datetime
+import os
+
+# Seconds between reconciliation passes over every bucket; 0 disables the background job
+RECONCILE_INTERVAL = int(os.getenv("RECONCILE_INTERVAL", 3600))
+
+SEARCH_SORT_COLUMNS = {
+    "filename": Files.name,
+    "size": Files.size,
+    "uploaded_at": Files.uploaded_at,
+}
+
+
+def encode_cursor(sort, order, row):
+    value = getattr(row, sort)
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    return encode_continuation_token([sort, order, value, row.file_id])
+
+
+def decode_cursor(cursor, sort, order):
+    """(sort value, file id) to continue after. The cursor must come from a search with the same order."""
+    try:
+        cursor_sort, cursor_order, value, file_id = decode_continuation_token(cursor)
+        if (cursor_sort, cursor_order) != (sort, order):
+            raise ValueError
+        if sort == "uploaded_at" and value is not None:
+            value = datetime.fromisoformat(value)
+        return value, int(file_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def search_query(user, scope="all", prefix=None, contains=None, min_size=None, max_size=None,
+                 uploaded_after=None, uploaded_before=None, bucket_name=None, owner=None, shared_with=None,
+                 sort="filename", order="asc", after=None, limit=100):
+    Owner = aliased(User)
+    sort_column = SEARCH_SORT_COLUMNS[sort]
+    query = (
+        select(Files.id.label("file_id"), Files.name.label("filename"), Bucket.name.label("bucket"),
+               Owner.username.label("owner"), Files.size.label("size"), Files.uploaded_at.label("uploaded_at"),
+               (Bucket.owner_id != user.id).label("shared"))
+        .join(Bucket, Bucket.id == Files.bucket_id)
+        .join(Owner, Owner.id == Bucket.owner_id)
+    )
+
+    own = Bucket.owner_id == user.id
+    shared = Files.id.in_(select(FilePermission.file_id).where(FilePermission.shared_with_user_id == user.id))
+    query = query.where({"own": own, "shared": shared}.get(scope, or_(own, shared)))
+
+    if prefix:
+        query = query.where(Files.name.startswith(prefix, autoescape=True))
+    if contains:
+        query = query.where(Files.name.icontains(contains, autoescape=True))
+    if min_size is not None:
+        query = query.where(Files.size >= min_size)
+    if max_size is not None:
+        query = query.where(Files.size <= max_size)
+    if uploaded_after is not None:
+        query = query.where(Files.uploaded_at >= uploaded_after)
+    if uploaded_before is not None:
+        query = query.where(Files.uploaded_at < uploaded_before)
+    if bucket_name:
+        query = query.where(Bucket.name == bucket_name)
+    if owner:
+        query = query.where(Owner.username == owner)
+    if shared_with:
+        query = query.where(Files.id.in_(
+            select(FilePermission.file_id)
+            .join(User, User.id == FilePermission.shared_with_user_id)
+            .where(User.username == shared_with)
+        ))
+
+    if after is not None:
+        query = query.where(after_cursor(sort_column, order, *after))
+    # NULLs (sizes and dates of rows recorded before those columns were filled) sort last ascending
+    # and first descending, which is the order a backward scan of the (column, id) index yields
+    if order == "desc":
+        query = query.order_by(sort_column.desc().nulls_first(), Files.id.desc())
+    else:
+        query = query.order_by(sort_column.asc().nulls_last(), Files.id.asc())
+    return query.limit(limit)
+
+
+def after_cursor(sort_column, order, value, file_id):
+    """Rows that come after (value, file_id) in the order used by search_query, NULL values included."""
+    key = tuple_(sort_column, Files.id)
+    if order == "desc":
+        if value is None:
+            return or_(and_(sort_column.is_(None), Files.id < file_id), sort_column.isnot(None))
+        return key < tuple_(value, file_id)
+    if value is None:
+        return and_(sort_column.is_(None), Files.id > file_id)
+    return or_(key > tuple_(value, file_id), sort_column.is_(None))
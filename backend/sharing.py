@@ -0,0 +1,183 @@
+"""
+File sharing grants and the bucket policies derived from them. FilePermission rows are the source
+of truth; a bucket's policy is always rebuilt from the bucket's full permission set, so grants made
+by different requests accumulate instead of overwriting each other.
+
+Policies are applied inside the transaction that changes the grants, before it commits, so a
+policy that cannot be applied rolls the grant change back with it. Bucket policies are limited in
+size (20 KiB in S3 and MinIO): when listing every shared object would exceed POLICY_MAX_BYTES, a
+grantee's objects are collapsed to "<prefix>*" wherever they are all of the bucket's objects under
+that prefix, and a change that still does not fit is refused.
+"""
+
+from sqlalchemy import select, insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from minio_client import client, run_storage
+from models import Files, FilePermission, User, Bucket, PermissionType
+from collections import defaultdict, Counter
+import json
+import os
+
+# Most (file, user, permission) grants accepted by one /share_batch request
+SHARE_BATCH_LIMIT = int(os.getenv("SHARE_BATCH_LIMIT", 5000))
+POLICY_MAX_BYTES = int(os.getenv("POLICY_MAX_BYTES", 20 * 1024))
+
+POLICY_ACTIONS = {
+    PermissionType.read: ("s3:GetObject",),
+    PermissionType.write: ("s3:GetObject", "s3:PutObject"),
+}
+
+
+class PolicyTooLarge(Exception):
+    def __init__(self, bucket_name, size):
+        super().__init__(
+            f"The policy of bucket {bucket_name} would be {size} bytes, over the {POLICY_MAX_BYTES} byte limit; "
+            "share whole folders or fewer files"
+        )
+        self.bucket_name = bucket_name
+        self.size = size
+
+
+async def add_permissions(db: AsyncSession, grants):
+    """
+    Insert the (file_id, user_id, permission) grants that do not exist yet, in one bulk insert.
+    Returns the grants that were added. Nothing is committed here.
+    """
+    grants = set(grants)
+    file_ids = {file_id for file_id, _, _ in grants}
+    existing = set((await db.execute(
+        select(FilePermission.file_id, FilePermission.shared_with_user_id, FilePermission.permission_type)
+        .where(FilePermission.file_id.in_(file_ids))
+    )).all()) if file_ids else set()
+    added = sorted(grants - existing)
+    if added:
+        await db.execute(insert(FilePermission), [
+            {"file_id": file_id, "shared_with_user_id": user_id, "permission_type": permission}
+            for file_id, user_id, permission in added
+        ])
+    return added
+
+
+def directories(name):
+    """Prefixes a wildcard may use for name, shortest first: the whole bucket, then each parent directory."""
+    yield ""
+    position = name.find("/")
+    while position != -1:
+        yield name[:position + 1]
+        position = name.find("/", position + 1)
+
+
+def collapse_objects(granted, bucket_objects):
+    """
+    Replace granted object names by "<prefix>*" wherever they are every object in the bucket under
+    that prefix; other names are kept as they are.
+    """
+    total = Counter(prefix for name in bucket_objects for prefix in directories(name))
+    covered = Counter(prefix for name in granted for prefix in directories(name))
+    resources = set()
+    for name in granted:
+        resources.add(next((prefix + "*" for prefix in directories(name) if covered[prefix] == total[prefix]), name))
+    return resources
+
+
+def build_bucket_policy(bucket_name, grants, bucket_objects=None):
+    """
+    Policy document for (object name, username, permission) grants, or None if there are none.
+    Each principal gets the union of its actions per object, and principals whose actions and
+    objects are identical share a single statement. When bucket_objects (every object name in the
+    bucket) is given, each principal's objects are collapsed with collapse_objects.
+    """
+    actions = defaultdict(set)
+    for object_name, username, permission in grants:
+        actions[(username, object_name)].update(POLICY_ACTIONS[PermissionType(permission)])
+    objects = defaultdict(set)
+    for (username, object_name), object_actions in actions.items():
+        objects[(username, tuple(sorted(object_actions)))].add(object_name)
+    principals = defaultdict(set)
+    for (username, object_actions), names in objects.items():
+        if bucket_objects is not None:
+            names = collapse_objects(names, bucket_objects)
+        resources = tuple(sorted(f"arn:aws:s3:::{bucket_name}/{name}" for name in names))
+        principals[(object_actions, resources)].add(f"arn:aws:iam::minio:user/{username}")
+    if not principals:
+        return None
+    return {
+        "Version": "2012-10-17",
+        "Statement": [
+            {
+                "Effect": "Allow",
+                "Principal": {"AWS": sorted(statement_principals)},
+                "Action": list(object_actions),
+                "Resource": list(resources),
+            }
+            for (object_actions, resources), statement_principals in sorted(principals.items())
+        ],
+    }
+
+
+def encode_policy(policy):
+    return json.dumps(policy, separators=(",", ":"))
+
+
+def fit_policy(policy):
+    """Drop the largest statements until the policy fits. Access is only ever removed, never widened."""
+    statements = sorted(policy["Statement"], key=lambda statement: len(encode_policy(statement)))
+    while statements and len(encode_policy({**policy, "Statement": statements})) > POLICY_MAX_BYTES:
+        statements.pop()
+    return {**policy, "Statement": statements} if statements else None
+
+
+async def sync_bucket_policy(db: AsyncSession, bucket_id, bucket_name, strict=True):
+    """
+    Rebuild the bucket's policy from every FilePermission on its files, as seen by db's open
+    transaction, and apply it with one call. The bucket row stays locked until the caller commits,
+    so concurrent rebuilds apply their snapshots in commit order.
+
+    A policy over POLICY_MAX_BYTES raises PolicyTooLarge when strict. Otherwise (used when files
+    are added or removed, which must not fail on the policy) the statements that do not fit are
+    dropped, which under-grants direct storage access and is logged.
+    """
+    await db.flush()
+    await db.execute(select(Bucket.id).where(Bucket.id == bucket_id).with_for_update())
+    grants = (await db.execute(
+        select(Files.name, User.username, FilePermission.permission_type)
+        .join(FilePermission, FilePermission.file_id == Files.id)
+        .join(User, User.id == FilePermission.shared_with_user_id)
+        .where(Files.bucket_id == bucket_id)
+    )).all()
+    policy = build_bucket_policy(bucket_name, grants)
+    if policy and len(encode_policy(policy)) > POLICY_MAX_BYTES:
+        bucket_objects = (await db.execute(select(Files.name).where(Files.bucket_id == bucket_id))).scalars().all()
+        policy = build_bucket_policy(bucket_name, grants, bucket_objects)
+    if policy and len(encode_policy(policy)) > POLICY_MAX_BYTES:
+        if strict:
+            raise PolicyTooLarge(bucket_name, len(encode_policy(policy)))
+        print(f"MinIO policy error: policy of bucket {bucket_name} exceeds {POLICY_MAX_BYTES} bytes, dropping statements")
+        policy = fit_policy(policy)
+    if policy is None:
+        await run_storage(client.delete_bucket_policy, bucket_name)
+    else:
+        await run_storage(client.set_bucket_policy, bucket_name, encode_policy(policy))
+
+
+async def policy_wildcards(bucket_name):
+    """Prefixes the bucket's current policy grants with a wildcard."""
+    try:
+        policy = json.loads(await run_storage(client.get_bucket_policy, bucket_name))
+    except Exception:
+        # No policy set
+        return []
+    resource_prefix = f"arn:aws:s3:::{bucket_name}/"
+    return [
+        resource[len(resource_prefix):-1]
+        for statement in policy.get("Statement", [])
+        for resource in statement.get("Resource", [])
+        if resource.startswith(resource_prefix) and resource.endswith("*")
+    ]
+
+
+async def bucket_has_grants(db: AsyncSession, bucket_id):
+    return (await db.execute(
+        select(FilePermission.id).join(Files, Files.id == FilePermission.file_id)
+        .where(Files.bucket_id == bucket_id).limit(1)
+    )).first() is not None
@@ -0,0 +1,34 @@
+import os
+import sys
+
+# The backend modules import each other as top-level modules, as they do when run from backend/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# database.py creates its engine on import; no test here needs Postgres
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite://")
+
+import asyncio
+import pytest
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from database import Base
+from models import Files  # Importing models registers every table on Base
+
+
+@pytest.fixture
+def run_with_db(tmp_path):
+    """
+    run(test) runs the coroutine function test(sessionmaker) in a fresh event loop, against a new
+    SQLite database with the full schema.
+    """
+    def run(test):
+        async def main():
+            engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'test.db'}")
+            async with engine.begin() as connection:
+                await connection.run_sync(Base.metadata.create_all)
+            try:
+                return await test(async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False))
+            finally:
+                await engine.dispose()
+
+        return asyncio.run(main())
+
+    return run
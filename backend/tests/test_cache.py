@@ -0,0 +1,119 @@
+from cache import ObjectCache
+
+
+def key(name, etag="e1"):
+    return ("bucket", name, etag)
+
+
+def body(size=100):
+    return b"x" * size
+
+
+def test_put_and_get():
+    cache = ObjectCache(max_bytes=300, max_object_size=100)
+    cache.put(key("a"), body())
+    assert cache.get(key("a")) == body()
+    assert cache.get(key("b")) is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["bytes"]) == (1, 1, 100)
+
+
+def test_objects_over_the_size_limit_are_not_cached():
+    cache = ObjectCache(max_bytes=300, max_object_size=100)
+    cache.put(key("a"), body(101))
+    assert cache.get(key("a")) is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_disabled_cache_stores_nothing():
+    cache = ObjectCache(max_bytes=0, max_object_size=100)
+    cache.put(key("a"), body())
+    assert cache.get(key("a")) is None
+
+
+def test_full_cache_rejects_objects_no_more_popular_than_its_lru_entries():
+    cache = ObjectCache(max_bytes=300, max_object_size=100)
+    for name in "abc":
+        cache.put(key(name), body())
+    cache.put(key("d"), body())
+    assert cache.stats()["rejections"] == 1
+    assert [cache.get(key(name)) is not None for name in "abcd"] == [True, True, True, False]
+
+
+def test_full_cache_admits_a_more_popular_object_and_evicts_lru():
+    cache = ObjectCache(max_bytes=300, max_object_size=100)
+    for name in "abc":
+        cache.put(key(name), body())
+    # Misses count as accesses: d is now requested more often than a, b and c have been
+    cache.get(key("d"))
+    cache.get(key("d"))
+    cache.put(key("d"), body())
+    stats = cache.stats()
+    assert (stats["entries"], stats["bytes"], stats["evictions"]) == (3, 300, 1)
+    assert cache.get(key("a")) is None
+    assert cache.get(key("d")) == body()
+
+
+def test_recently_used_entries_are_evicted_last():
+    cache = ObjectCache(max_bytes=300, max_object_size=100)
+    for name in "abc":
+        cache.put(key(name), body())
+    # Touch a so b becomes the least recently used entry; d then needs a higher frequency than b
+    cache.get(key("a"))
+    for _ in range(3):
+        cache.get(key("d"))
+    cache.put(key("d"), body())
+    assert cache.get(key("a")) is not None
+    assert cache.get(key("b")) is None
+
+
+def test_admission_evicts_as_many_entries_as_needed():
+    cache = ObjectCache(max_bytes=300, max_object_size=200)
+    for name in "abc":
+        cache.put(key(name), body())
+    for _ in range(2):
+        cache.get(key("d"))
+    cache.put(key("d"), body(200))
+    assert cache.get(key("a")) is None
+    assert cache.get(key("b")) is None
+    assert cache.get(key("c")) is not None
+    assert cache.stats()["bytes"] == 300
+
+
+def test_invalidate_drops_every_version_of_a_name():
+    cache = ObjectCache(max_bytes=1000, max_object_size=100)
+    cache.put(key("a", "e1"), body())
+    cache.put(key("a", "e2"), body())
+    cache.put(key("b"), body())
+    cache.invalidate("bucket", "a")
+    assert cache.get(key("a", "e1")) is None
+    assert cache.get(key("a", "e2")) is None
+    assert cache.get(key("b")) is not None
+    cache.invalidate("bucket")
+    assert cache.stats()["entries"] == 0
+
+
+def test_disk_tier_keeps_rejected_objects_and_promotes_them(tmp_path):
+    cache = ObjectCache(max_bytes=100, max_object_size=100, disk_dir=str(tmp_path), disk_bytes=1000)
+    cache.put(key("a"), body())
+    cache.put(key("b"), b"y" * 100)
+    assert cache.get(key("b")) is None
+    assert cache.on_disk(key("b"))
+    # b has now been requested more often than a, so reading it from disk moves it into memory
+    cache.get(key("b"))
+    assert cache.read_disk(key("b")) == b"y" * 100
+    assert cache.get(key("b")) == b"y" * 100
+    assert not cache.on_disk(key("b"))
+    assert cache.on_disk(key("a"))
+
+
+def test_disk_tier_is_bounded_and_invalidated(tmp_path):
+    cache = ObjectCache(max_bytes=100, max_object_size=100, disk_dir=str(tmp_path), disk_bytes=200)
+    for name in "abcd":
+        cache.put(key(name), body())
+    stats = cache.stats()
+    assert stats["disk_bytes"] <= 200
+    assert stats["disk_evictions"] == 1
+    cache.invalidate("bucket")
+    assert cache.stats()["disk_entries"] == 0
+    assert not any(path.is_file() for path in tmp_path.rglob("*"))
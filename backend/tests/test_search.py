@@ -0,0 +1,90 @@
+import pytest
+from datetime import datetime
+from fastapi import HTTPException
+from models import User, Bucket, Files, FilePermission, PermissionType
+from search import encode_cursor, decode_cursor, search_query
+
+# (name, size, uploaded_at); rows recorded before size and uploaded_at were filled have NULL there
+FILES = [
+    ("a", 30, datetime(2026, 1, 3)),
+    ("b", None, None),
+    ("c", 10, datetime(2026, 1, 1)),
+    ("d", 30, datetime(2026, 1, 3)),
+    ("e", None, None),
+    ("f", 20, datetime(2026, 1, 2)),
+]
+
+
+async def add_files(db):
+    alice, bob = User(username="alice"), User(username="bob")
+    db.add_all([alice, bob])
+    await db.flush()
+    own, other = Bucket(name="alice-docs", owner_id=alice.id), Bucket(name="bob-docs", owner_id=bob.id)
+    db.add_all([own, other])
+    await db.flush()
+    db.add_all(Files(name=name, bucket_id=own.id, size=size, uploaded_at=uploaded_at) for name, size, uploaded_at in FILES)
+    shared, hidden = Files(name="shared", bucket_id=other.id, size=5), Files(name="hidden", bucket_id=other.id, size=5)
+    db.add_all([shared, hidden])
+    await db.flush()
+    db.add(FilePermission(file_id=shared.id, shared_with_user_id=alice.id, permission_type=PermissionType.read))
+    await db.commit()
+    return alice
+
+
+async def page_through(db, user, sort, order, limit, **filters):
+    names, cursor = [], None
+    while True:
+        after = decode_cursor(cursor, sort, order) if cursor else None
+        rows = (await db.execute(search_query(user, sort=sort, order=order, after=after, limit=limit, **filters))).all()
+        names.extend(row.filename for row in rows)
+        if len(rows) < limit:
+            return names
+        cursor = encode_cursor(sort, order, rows[-1])
+
+
+@pytest.mark.parametrize("sort, order, expected", [
+    ("filename", "asc", ["a", "b", "c", "d", "e", "f"]),
+    ("filename", "desc", ["f", "e", "d", "c", "b", "a"]),
+    ("size", "asc", ["c", "f", "a", "d", "b", "e"]),
+    ("size", "desc", ["e", "b", "d", "a", "f", "c"]),
+    ("uploaded_at", "asc", ["c", "f", "a", "d", "b", "e"]),
+    ("uploaded_at", "desc", ["e", "b", "d", "a", "f", "c"]),
+])
+@pytest.mark.parametrize("limit", [1, 2, 4, 10])
+def test_paging_returns_every_row_once_in_order(run_with_db, sort, order, expected, limit):
+    async def test(sessionmaker):
+        async with sessionmaker() as db:
+            user = await add_files(db)
+            assert await page_through(db, user, sort, order, limit, scope="own") == expected
+
+    run_with_db(test)
+
+
+def test_scopes_and_filters(run_with_db):
+    async def test(sessionmaker):
+        async with sessionmaker() as db:
+            user = await add_files(db)
+            assert await page_through(db, user, "filename", "asc", 100) == ["a", "b", "c", "d", "e", "f", "shared"]
+            assert await page_through(db, user, "filename", "asc", 100, scope="shared") == ["shared"]
+            assert await page_through(db, user, "size", "asc", 2, min_size=15) == ["f", "a", "d"]
+            assert await page_through(db, user, "filename", "asc", 2, owner="bob") == ["shared"]
+
+    run_with_db(test)
+
+
+def test_cursor_round_trip():
+    row = type("Row", (), {"file_id": 7, "filename": "a", "size": None, "uploaded_at": datetime(2026, 1, 2, 3, 4, 5)})
+    assert decode_cursor(encode_cursor("uploaded_at", "desc", row), "uploaded_at", "desc") == (datetime(2026, 1, 2, 3, 4, 5), 7)
+    assert decode_cursor(encode_cursor("size", "asc", row), "size", "asc") == (None, 7)
+
+
+@pytest.mark.parametrize("cursor, sort, order", [
+    ("not-a-cursor", "size", "asc"),
+    (None, "size", "desc"),
+    (None, "filename", "asc"),
+])
+def test_cursor_from_another_search_is_rejected(cursor, sort, order):
+    row = type("Row", (), {"file_id": 7, "size": 3})
+    with pytest.raises(HTTPException) as error:
+        decode_cursor(cursor or encode_cursor("size", "asc", row), sort, order)
+    assert error.value.status_code == 400
@@ -0,0 +1,134 @@
+import json
+import pytest
+import sharing
+from fake_minio import FakeMinio
+from models import User, Bucket, Files, FilePermission, PermissionType
+from sharing import (
+    build_bucket_policy, collapse_objects, directories, encode_policy, fit_policy, sync_bucket_policy,
+    PolicyTooLarge, POLICY_MAX_BYTES,
+)
+
+READ = ["s3:GetObject"]
+WRITE = ["s3:GetObject", "s3:PutObject"]
+
+
+def resources(*names):
+    return [f"arn:aws:s3:::b/{name}" for name in names]
+
+
+def principals(*usernames):
+    return [f"arn:aws:iam::minio:user/{username}" for username in usernames]
+
+
+def test_no_grants_means_no_policy():
+    assert build_bucket_policy("b", []) is None
+
+
+def test_grants_are_merged_per_principal_and_object():
+    policy = build_bucket_policy("b", [("a.txt", "bob", "read"), ("a.txt", "bob", "write"), ("c.txt", "bob", "read")])
+    assert policy["Statement"] == [
+        {"Effect": "Allow", "Principal": {"AWS": principals("bob")}, "Action": READ, "Resource": resources("c.txt")},
+        {"Effect": "Allow", "Principal": {"AWS": principals("bob")}, "Action": WRITE, "Resource": resources("a.txt")},
+    ]
+
+
+def test_principals_with_identical_access_share_a_statement():
+    policy = build_bucket_policy("b", [
+        ("a.txt", "carol", PermissionType.read), ("a.txt", "bob", PermissionType.read), ("x.txt", "dave", "read"),
+    ])
+    assert [(statement["Principal"]["AWS"], statement["Resource"]) for statement in policy["Statement"]] == [
+        (principals("bob", "carol"), resources("a.txt")),
+        (principals("dave"), resources("x.txt")),
+    ]
+
+
+def test_directories():
+    assert list(directories("a/b/c.txt")) == ["", "a/", "a/b/"]
+    assert list(directories("c.txt")) == [""]
+
+
+def test_collapse_uses_the_shortest_fully_granted_prefix():
+    bucket = ["r/1", "r/2", "r/s/3", "other"]
+    assert collapse_objects({"r/1", "r/2", "r/s/3"}, bucket) == {"r/*"}
+    assert collapse_objects({"r/s/3", "other"}, bucket) == {"r/s/*", "other"}
+    assert collapse_objects(set(bucket), bucket) == {"*"}
+
+
+def test_collapse_never_widens_access():
+    bucket = ["r/1", "r/2", "r/3"]
+    assert collapse_objects({"r/1", "r/2"}, bucket) == {"r/1", "r/2"}
+
+
+def test_large_grant_sets_collapse_under_the_size_limit():
+    names = [f"reports/{index:05}.csv" for index in range(1000)]
+    grants = [(name, user, "read") for name in names for user in ("u1", "u2", "u3", "u4", "u5")]
+    assert len(encode_policy(build_bucket_policy("b", grants))) > POLICY_MAX_BYTES
+    policy = build_bucket_policy("b", grants, names + ["private.txt"])
+    assert len(encode_policy(policy)) <= POLICY_MAX_BYTES
+    assert policy["Statement"] == [{
+        "Effect": "Allow", "Principal": {"AWS": principals("u1", "u2", "u3", "u4", "u5")},
+        "Action": READ, "Resource": resources("reports/*"),
+    }]
+
+
+def test_fit_policy_drops_the_largest_statements():
+    grants = [(f"big/{index:05}", "bob", "read") for index in range(2000)] + [("small", "carol", "read")]
+    policy = fit_policy(build_bucket_policy("b", grants))
+    assert len(encode_policy(policy)) <= POLICY_MAX_BYTES
+    assert [statement["Principal"]["AWS"] for statement in policy["Statement"]] == [principals("carol")]
+
+
+@pytest.fixture
+def storage(monkeypatch):
+    fake = FakeMinio()
+    fake.make_bucket("b")
+    monkeypatch.setattr(sharing, "client", fake)
+    return fake
+
+
+async def add_bucket(db, names, grantee="bob"):
+    owner, user = User(username="alice"), User(username=grantee)
+    db.add_all([owner, user])
+    await db.flush()
+    bucket = Bucket(name="b", owner_id=owner.id)
+    db.add(bucket)
+    await db.flush()
+    files = [Files(name=name, bucket_id=bucket.id, size=1) for name in names]
+    db.add_all(files)
+    await db.flush()
+    return bucket, user, files
+
+
+def test_sync_applies_the_policy_from_the_stored_grants(run_with_db, storage):
+    async def test(sessionmaker):
+        async with sessionmaker() as db:
+            bucket, user, files = await add_bucket(db, ["a.txt", "b.txt"])
+            db.add(FilePermission(file_id=files[0].id, shared_with_user_id=user.id, permission_type=PermissionType.read))
+            await sync_bucket_policy(db, bucket.id, "b")
+            await db.commit()
+            policy = json.loads(storage.get_bucket_policy("b"))
+            assert policy["Statement"][0]["Resource"] == resources("a.txt")
+            await db.execute(FilePermission.__table__.delete())
+            await sync_bucket_policy(db, bucket.id, "b")
+            assert "b" not in storage.policies
+
+    run_with_db(test)
+
+
+def test_sync_refuses_a_policy_over_the_limit_unless_lenient(run_with_db, storage, capsys):
+    names = [f"n{index:05}-{'x' * 40}" for index in range(600)]
+
+    async def test(sessionmaker):
+        async with sessionmaker() as db:
+            # Every object but one is shared, so nothing collapses to a wildcard
+            bucket, user, files = await add_bucket(db, names + ["unshared"])
+            db.add_all(FilePermission(file_id=file.id, shared_with_user_id=user.id, permission_type=PermissionType.read)
+                       for file in files[:-1])
+            with pytest.raises(PolicyTooLarge):
+                await sync_bucket_policy(db, bucket.id, "b")
+            assert "b" not in storage.policies
+            await sync_bucket_policy(db, bucket.id, "b", strict=False)
+            assert "b" not in storage.policies
+            assert "dropping statements" in capsys.readouterr().out
+
+    run_with_db(test)
@@ -1,31 +1,184 @@
-from auth import SECRET_KEY, ALGORITHM, oauth2_scheme, password_context
+from auth import SECRET_KEY, ALGORITHM, oauth2_scheme, password_context, AUTH_CACHE_SIZE, AUTH_CACHE_TTL, \
+    PERMISSION_CACHE_SIZE, PERMISSION_CACHE_TTL, ACCESS_TOKEN_EXPIRE_MINUTES, REFRESH_TOKEN_EXPIRE_DAYS, \
+    PASSWORD_WORKERS, ADMIN_USERS
 from jose import jwt, JWTError
 from datetime import timedelta, datetime
 from fastapi import Depends, HTTPException
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import make_transient_to_detached
 from models import User
 from database import get_db
+from cache import TTLCache
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import asyncio
+import os
+import hashlib
+import base64
+import json
+import time
+from email.utils import parsedate_to_datetime
 
-def create_access_token(data: dict, expires_delta: timedelta = timedelta(minutes=60)):
+def create_access_token(data: dict, expires_delta: timedelta = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)):
     to_encode = data.copy()
-    to_encode.update({"exp": datetime.utcnow() + expires_delta})
+    to_encode.update({"exp": datetime.utcnow() + expires_delta, "type": "access"})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
+def password_fingerprint(hashed_password):
+    """Short digest of the stored hash, so refresh tokens stop working once the password changes."""
+    return hashlib.sha256(hashed_password.encode()).hexdigest()[:16]
+
+def create_refresh_token(username, hashed_password, expires_delta: timedelta = timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)):
+    return jwt.encode({
+        "sub": username,
+        "pwd": password_fingerprint(hashed_password),
+        "exp": datetime.utcnow() + expires_delta,
+        "type": "refresh",
+    }, SECRET_KEY, algorithm=ALGORITHM)
+
+def decode_refresh_token(token):
+    """Returns the refresh token's claims, or raises 401."""
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        raise HTTPException(status_code=401, detail="Token error")
+    if payload.get("type") != "refresh" or not payload.get("sub"):
+        raise HTTPException(status_code=401, detail="Invalid refresh token")
+    return payload
+
+# Module-level functions so the process pool can pickle them by reference
 def verify_password(plain, hashed):
     return password_context.verify(plain, hashed)
 
 def hash_password(password):
     return password_context.hash(password)
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+# Workers come from a forkserver rather than fork(): forking the multithreaded server (storage
+# thread pool, event loop) can copy a lock some other thread holds and deadlock the child.
+password_executor = ProcessPoolExecutor(
+    max_workers=PASSWORD_WORKERS, mp_context=multiprocessing.get_context("forkserver")
+)
+
+async def start_password_workers():
+    """Start every password worker now, at startup, instead of on the first logins."""
+    loop = asyncio.get_running_loop()
+    await asyncio.gather(*(loop.run_in_executor(password_executor, os.getpid) for _ in range(PASSWORD_WORKERS)))
+
+# token -> username, and username -> user column snapshot. Together they let a repeat request
+# skip both the JWT decode and the users lookup.
+token_cache = TTLCache(maxsize=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL)
+principal_cache = TTLCache(maxsize=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL)
+# (user_id, bucket_name, filename) -> whether the user may read that shared file
+permission_cache = TTLCache(maxsize=PERMISSION_CACHE_SIZE, ttl=PERMISSION_CACHE_TTL)
+
+def invalidate_user(username):
+    """Drop a cached principal; call on signup, password change and user deletion."""
+    principal_cache.pop(username)
+
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
+    username = token_cache.get(token)
+    if username is None:
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        except JWTError:
+            raise HTTPException(status_code=401, detail="Token error")
         username = payload.get("sub")
-        if username is None:
+        # Tokens issued before refresh tokens existed carry no type
+        if username is None or payload.get("type", "access") != "access":
             raise HTTPException(status_code=401, detail="Invalid credentials")
-        user = db.query(User).filter(User.username == username).first()
-        if user is None:
-            raise HTTPException(status_code=401, detail="User not found")
-        return user
-    except JWTError:
-        raise HTTPException(status_code=401, detail="Token error")
\ No newline at end of file
+        # Never cache a token past its own expiry
+        token_cache.set(token, username, ttl=payload.get("exp", 0) - time.time())
+
+    snapshot = principal_cache.get(username)
+    if snapshot is not None:
+        # Attach a copy of the cached row to this request's session without querying
+        cached = User(**snapshot)
+        make_transient_to_detached(cached)
+        return await db.merge(cached, load=False)
+
+    user = (await db.execute(select(User).where(User.username == username))).scalars().first()
+    if user is None:
+        raise HTTPException(status_code=401, detail="User not found")
+    principal_cache.set(username, {"id": user.id, "username": user.username, "hashed_password": user.hashed_password})
+    return user
+
+async def get_admin_user(user: User = Depends(get_current_user)):
+    if user.username not in ADMIN_USERS:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return user
+
+class HashingReader:
+    """Wraps a file object and computes its size and sha256 digest while it is being read."""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.size = 0
+        self._hash = hashlib.sha256()
+
+    def read(self, size=-1):
+        chunk = self.fileobj.read(size)
+        if chunk:
+            self.size += len(chunk)
+            self._hash.update(chunk)
+        return chunk
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+
+def encode_continuation_token(start_after):
+    return base64.urlsafe_b64encode(json.dumps({"start_after": start_after}).encode()).decode()
+
+def decode_continuation_token(token):
+    try:
+        return json.loads(base64.urlsafe_b64decode(token.encode()))["start_after"]
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid continuation token")
+
+
+def etag_matches(header, etag):
+    """True if an If-None-Match / If-Range style header value matches etag (weak comparison)."""
+    candidates = [c.strip() for c in header.split(",")]
+    return "*" in candidates or etag.strip('"') in [c.removeprefix("W/").strip('"') for c in candidates]
+
+def not_modified_since(header, last_modified):
+    """True if last_modified is not newer than the HTTP date in an If-Modified-Since header."""
+    try:
+        since = parsedate_to_datetime(header)
+    except (TypeError, ValueError):
+        return False
+    if since is None or since.tzinfo is None or last_modified is None:
+        return False
+    return last_modified.replace(microsecond=0) <= since
+
+def parse_range(header, size):
+    """
+    Parse a single "bytes=start-end" Range header against an object of the given size.
+    Returns (start, end) inclusive, or None to serve the whole object (absent, malformed or multi-range).
+    Raises 416 if the range starts at or past the end of the object.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start, sep, end = header[len("bytes="):].strip().partition("-")
+    if not sep:
+        return None
+    try:
+        if start == "":
+            # Suffix range: the last N bytes
+            length = int(end)
+            if length <= 0:
+                raise ValueError
+            start, end = max(size - length, 0), size - 1
+        else:
+            start = int(start)
+            if end and int(end) < start:
+                # An invalid range-spec: the header is ignored (RFC 9110, 14.1.1)
+                return None
+            end = min(int(end), size - 1) if end else size - 1
+    except ValueError:
+        return None
+    if start >= size:
+        raise HTTPException(status_code=416, detail="Requested range not satisfiable",
+                            headers={"Content-Range": f"bytes */{size}"})
+    return start, end
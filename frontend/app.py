@@ -1,5 +1,7 @@
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
+import json
 import logging
 
 # Setup logging
@@ -10,11 +12,52 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 API_URL = "http://backend:8000"
+# Listings are cached briefly per token and bucket; this client's own uploads and deletes invalidate them
+LISTING_CACHE_TTL = 60
+SHARED_PAGE_SIZE = 50
 
 if "token" not in st.session_state:
     st.session_state.token = None
 if "logged_in" not in st.session_state:
     st.session_state.logged_in = False
+if "http" not in st.session_state:
+    # One pooled, keep-alive session per browser session instead of a new connection per call
+    session = requests.Session()
+    session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+    session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+    st.session_state.http = session
+if "listing_generation" not in st.session_state:
+    st.session_state.listing_generation = {}
+
+http = st.session_state.http
+
+
+def listing_generation(bucket):
+    return st.session_state.listing_generation.get(bucket, 0)
+
+
+def invalidate_listing(bucket):
+    """Bump the bucket's generation so cached pages for it are no longer looked up."""
+    st.session_state.listing_generation[bucket] = listing_generation(bucket) + 1
+
+
+# The session is passed as an underscore argument so st.cache_data leaves it out of the cache key
+@st.cache_data(ttl=LISTING_CACHE_TTL, show_spinner=False)
+def fetch_file_page(_http, token, bucket, generation, continuation_token=None):
+    params = {"bucket": bucket}
+    if continuation_token:
+        params["continuation_token"] = continuation_token
+    r = _http.get(f"{API_URL}/files", params=params, headers={"Authorization": f"Bearer {token}"})
+    logger.debug(f"List files response: {r.status_code}")
+    return r.status_code, r.json()
+
+
+@st.cache_data(ttl=LISTING_CACHE_TTL, show_spinner=False)
+def fetch_shared_page(_http, token, offset, limit=SHARED_PAGE_SIZE):
+    r = _http.get(f"{API_URL}/shared_with_me", params={"offset": offset, "limit": limit},
+                  headers={"Authorization": f"Bearer {token}"})
+    logger.debug(f"Files shared with me response: {r.status_code}")
+    return r.status_code, r.json()
 
 st.title("Cloud Bucket Service")
 
@@ -27,7 +70,7 @@ def show_auth_page():
         password = st.text_input("Password", type="password", key="signup_pass")
         if st.button("Sign Up"):
             logger.info(f"Attempting signup for user: {username}")
-            r = requests.post(f"{API_URL}/signup", json={"username": username, "password": password})
+            r = http.post(f"{API_URL}/signup", json={"username": username, "password": password})
             logger.debug(f"Signup response: {r.status_code} {r.text}")
             if r.status_code == 200:
                 st.session_state.username = username
@@ -38,7 +81,7 @@ def show_auth_page():
         password = st.text_input("Password", type="password", key="login_pass")
         if st.button("Login"):
             logger.info(f"Attempting login for user: {username}")
-            r = requests.post(f"{API_URL}/login", data={"username": username, "password": password})
+            r = http.post(f"{API_URL}/login", data={"username": username, "password": password})
             if r.status_code == 200:
                 st.session_state.token = r.json()["access_token"]
                 st.session_state.logged_in = True
@@ -65,7 +108,7 @@ def show_main_menu():
         bucket_name = st.text_input("Bucket name")
         if st.button("Create"):
             logger.info(f"Creating bucket: {bucket_name}")
-            r = requests.post(f"{API_URL}/buckets", json={"bucket": bucket_name}, headers=headers)
+            r = http.post(f"{API_URL}/buckets", json={"bucket": bucket_name}, headers=headers)
             logger.debug(f"Create bucket response: {r.status_code} {r.text}")
             st.write(r.json())
 
@@ -75,24 +118,37 @@ def show_main_menu():
         if st.button("Upload") and uploaded_file:
             logger.info(f"Uploading file: {uploaded_file.name} to bucket: {bucket}")
             files = {"file": (uploaded_file.name, uploaded_file, uploaded_file.type)}
-            r = requests.post(f"{API_URL}/upload", params={"bucket": bucket}, files=files, headers=headers)
+            r = http.post(f"{API_URL}/upload", params={"bucket": bucket}, files=files, headers=headers)
             logger.debug(f"Upload file response: {r.status_code} {r.text}")
+            invalidate_listing(bucket)
             st.write(r.json())
 
     if menu == "List Files":
         bucket = st.text_input("Bucket")
         if st.button("List"):
-            logger.info(f"Listing files in bucket: {bucket}")
-            r = requests.get(f"{API_URL}/files", params={"bucket": bucket}, headers=headers)
-            logger.debug(f"List files response: {r.status_code} {r.text}")
-            st.write(r.json())
+            st.session_state.list_bucket = bucket
+            st.session_state.list_pages = [None]
+        if st.session_state.get("list_bucket"):
+            bucket = st.session_state.list_bucket
+            pages = st.session_state.list_pages
+            logger.info(f"Listing files in bucket: {bucket}, page {len(pages)}")
+            status, page = fetch_file_page(http, st.session_state.token, bucket, listing_generation(bucket), pages[-1])
+            st.write(page)
+            if status == 200:
+                col_prev, col_next = st.columns(2)
+                if len(pages) > 1 and col_prev.button("Previous page"):
+                    pages.pop()
+                    st.rerun()
+                if page.get("next_continuation_token") and col_next.button("Next page"):
+                    pages.append(page["next_continuation_token"])
+                    st.rerun()
 
     if menu == "Download File":
         bucket = st.text_input("Bucket")
         filename = st.text_input("Filename")
         if st.button("Download"):
             logger.info(f"Downloading file: {filename} from bucket: {bucket}")
-            r = requests.get(f"{API_URL}/download", params={"bucket": bucket, "filename": filename}, headers=headers)
+            r = http.get(f"{API_URL}/download", params={"bucket": bucket, "filename": filename}, headers=headers)
             logger.debug(f"Download file response: {r.status_code}")
             if r.status_code == 200:
                 st.download_button("Download", r.content, file_name=filename)
@@ -104,8 +160,9 @@ def show_main_menu():
         bucket = st.text_input("Bucket to delete")
         if st.button("Delete Bucket"):
             logger.info(f"Deleting bucket: {bucket}")
-            r = requests.delete(f"{API_URL}/delete_bucket", params={"bucket": bucket}, headers=headers)
+            r = http.delete(f"{API_URL}/delete_bucket", params={"bucket": bucket}, headers=headers)
             logger.debug(f"Delete bucket response: {r.status_code} {r.text}")
+            invalidate_listing(bucket)
             st.write(r.json())
 
     if menu == "Delete Files":
@@ -113,8 +170,11 @@ def show_main_menu():
         filename = st.text_input("Filenames to delete (separated by commas)")
         if st.button("Delete File"):
             logger.info(f"Deleting files: {filename} from bucket: {bucket}")
-            r = requests.delete(f"{API_URL}/delete_files", json={"bucket": bucket, "filename": filename}, headers=headers)
+            # The API takes the names as a JSON-encoded list
+            names = [name.strip() for name in filename.split(",") if name.strip()]
+            r = http.delete(f"{API_URL}/delete_files", json={"bucket": bucket, "filename": json.dumps(names)}, headers=headers)
             logger.debug(f"Delete files response: {r.status_code} {r.text}")
+            invalidate_listing(bucket)
             st.write(r.json())
 
     if menu == "Share File":
@@ -123,7 +183,7 @@ def show_main_menu():
         shared_with_username = st.text_input("Username to share with")
         if st.button("Share"):
             logger.info(f"Sharing file: {filename} from bucket: {bucket} with user: {shared_with_username}")
-            r = requests.post(f"{API_URL}/share", json={
+            r = http.post(f"{API_URL}/share", json={
                 "bucket": bucket,
                 "filename": filename,
                 "shared_with_username": shared_with_username
@@ -136,31 +196,36 @@ def show_main_menu():
 
     if menu == "Files Shared With Me":
         logger.info("Fetching files shared with current user")
-        r = requests.get(f"{API_URL}/shared_with_me", headers=headers)
-        logger.debug(f"Files shared with me response: {r.status_code} {r.text}")
-        if r.status_code == 200:
-            shared_files = r.json()
+        page_number = st.number_input("Page", min_value=1, value=1, step=1)
+        status, shared_files = fetch_shared_page(http, st.session_state.token, (page_number - 1) * SHARED_PAGE_SIZE)
+        if status == 200:
             if shared_files:
+                # Bodies are only fetched for the file the user asks for, not for every row on each rerun
                 for f in shared_files:
-                    st.write(f"Bucket: {f['bucket']}, Filename: {f['filename']}")
-                    dr = requests.get(
-                        f"{API_URL}/download_shared",
-                        params={"bucket": f["bucket"], "filename": f["filename"]},
-                        headers=headers
-                    )
-                    logger.debug(f"Download shared file response: {dr.status_code} for {f['filename']}")
-                    if dr.status_code == 200:
-                        st.download_button(
-                            label=f"Download {f['filename']}",
-                            data=dr.content,
-                            file_name=f['filename'],
-                            mime="application/octet-stream",
-                            key=f"download_{f['bucket']}_{f['filename']}"
+                    key = f"{f['bucket']}/{f['filename']}"
+                    col_name, col_action = st.columns([3, 1])
+                    col_name.write(f"Bucket: {f['bucket']}, Filename: {f['filename']}")
+                    if col_action.button("Fetch", key=f"fetch_{key}"):
+                        dr = http.get(
+                            f"{API_URL}/download_shared",
+                            params={"bucket": f["bucket"], "filename": f["filename"]},
+                            headers=headers
                         )
-                    else:
-                        st.error(dr.json().get("detail", "Download failed"))
-            else:
+                        logger.debug(f"Download shared file response: {dr.status_code} for {f['filename']}")
+                        if dr.status_code == 200:
+                            col_action.download_button(
+                                label=f"Download {f['filename']}",
+                                data=dr.content,
+                                file_name=f['filename'],
+                                mime="application/octet-stream",
+                                key=f"download_{key}"
+                            )
+                        else:
+                            st.error(dr.json().get("detail", "Download failed"))
+            elif page_number == 1:
                 st.info("No files shared with you.")
+            else:
+                st.info("No more shared files.")
         else:
             st.error("Failed to fetch shared files.")
 